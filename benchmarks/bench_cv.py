@@ -0,0 +1,36 @@
+"""
+Benchmarks of the cross-validation: censoring the known ranks and running the fuzzy model on each run.
+"""
+from .common import RANK_DICT, SMALL_SCALES, clean_survey
+
+import model.cv as fzcv
+import prep.prep_cv as pcv
+
+REPS = 3
+
+
+class CrossValidation(object):
+    """The cross-validation of the fuzzy model on the roof materials."""
+    params = SMALL_SCALES
+    param_names = ['n_rows']
+    timeout = 900
+
+    def setup(self, n_rows):
+        self.df = clean_survey(n_rows)
+        self.df = self.df[self.df['housing_roof_rank'].isin(list(RANK_DICT.values()))].reset_index(drop=True)
+        self.folds = pcv.cv_censor_index(self.df, 'housing_roof_rank', pct=.01, reps=REPS)
+
+    def time_cv_censor_col(self, n_rows):
+        pcv.cv_censor_col(self.df, 'housing_roof_rank', pct=.01, reps=REPS)
+
+    def peakmem_cv_censor_col(self, n_rows):
+        pcv.cv_censor_col(self.df, 'housing_roof_rank', pct=.01, reps=REPS)
+
+    def time_cv_censor_index(self, n_rows):
+        pcv.cv_censor_index(self.df, 'housing_roof_rank', pct=.01, reps=REPS)
+
+    def time_fuzzy_cv(self, n_rows):
+        fzcv.fuzzy_cv(self.folds, 'housing_roof', RANK_DICT, fused=True)
+
+    def peakmem_fuzzy_cv(self, n_rows):
+        fzcv.fuzzy_cv(self.folds, 'housing_roof', RANK_DICT, fused=True)
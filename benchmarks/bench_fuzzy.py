@@ -0,0 +1,41 @@
+"""
+Benchmarks of the fuzzy model: building the corpora, scanning the unknown words and predicting their rank.
+"""
+from .common import RANK_DICT, RANK_LIST, SMALL_SCALES, clean_survey
+
+import model.fuzzy as fz
+
+# number of unknown words scanned, so that the time grows with the corpora only
+N_UNKNOWN = 200
+CUTOFF = 75
+
+
+class FuzzyPipeline(object):
+    """The fuzzy prediction of the unknown roof materials."""
+    params = SMALL_SCALES
+    param_names = ['n_rows']
+    timeout = 600
+
+    def setup(self, n_rows):
+        self.df = clean_survey(n_rows)
+        self.corpus, unknown = fz.build_corpus(self.df, 'housing_roof', 'housing_roof_rank', RANK_LIST)
+        self.unknown = unknown[:N_UNKNOWN]
+        self.distrib = fz.fuzzy_scan(self.unknown, self.corpus)
+
+    def time_build_corpus(self, n_rows):
+        fz.build_corpus(self.df, 'housing_roof', 'housing_roof_rank', RANK_LIST)
+
+    def time_fuzzy_scan(self, n_rows):
+        fz.fuzzy_scan(self.unknown, self.corpus)
+
+    def peakmem_fuzzy_scan(self, n_rows):
+        fz.fuzzy_scan(self.unknown, self.corpus)
+
+    def time_fuzzy_predict(self, n_rows):
+        fz.fuzzy_predict(self.distrib, list(RANK_DICT), 'word', CUTOFF, RANK_DICT)
+
+    def time_fuzzy_scan_predict(self, n_rows):
+        fz.fuzzy_scan_predict(self.unknown, self.corpus, CUTOFF, RANK_DICT)
+
+    def peakmem_fuzzy_scan_predict(self, n_rows):
+        fz.fuzzy_scan_predict(self.unknown, self.corpus, CUTOFF, RANK_DICT)
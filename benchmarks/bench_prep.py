@@ -0,0 +1,59 @@
+"""
+Benchmarks of the data preparation: cleaning the strings, reading and cleaning a csv file, and ranking the codes.
+"""
+from .common import prep, SCALES, STR_VARS, survey, survey_csv, numeric_survey
+
+
+class CleanText(object):
+    """Cleaning of the material strings, one string at a time and one column at a time."""
+    params = SCALES
+    param_names = ['n_rows']
+
+    def setup(self, n_rows):
+        self.df = survey(n_rows)
+        self.values = list(self.df['housing_roof'].dropna().values[:10000])
+
+    def time_clean_text(self, n_rows):
+        [prep.clean_text(x) for x in self.values]
+
+    def time_clean_series(self, n_rows):
+        for var in STR_VARS:
+            prep.clean_series(self.df[var])
+
+    def peakmem_clean_series(self, n_rows):
+        for var in STR_VARS:
+            prep.clean_series(self.df[var])
+
+
+class ReadThenClean(object):
+    """Reading and cleaning of a survey csv file."""
+    params = SCALES
+    param_names = ['n_rows']
+    timeout = 600
+
+    def setup(self, n_rows):
+        self.path = survey_csv(n_rows)
+
+    def time_read_then_clean(self, n_rows):
+        prep.read_then_clean(self.path, STR_VARS)
+
+    def peakmem_read_then_clean(self, n_rows):
+        prep.read_then_clean(self.path, STR_VARS)
+
+    def time_load_data_typed(self, n_rows):
+        prep.load_data_typed(self.path)
+
+
+class Ranking(object):
+    """Ranking of the roof, wall and floor codes of the random forest model."""
+    params = SCALES
+    param_names = ['n_rows']
+
+    def setup(self, n_rows):
+        self.df = numeric_survey(n_rows)
+
+    def time_ranking(self, n_rows):
+        prep.ranking(self.df, ['roof', 'wall', 'floor'])
+
+    def peakmem_ranking(self, n_rows):
+        prep.ranking(self.df, ['roof', 'wall', 'floor'])
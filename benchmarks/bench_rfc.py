@@ -0,0 +1,37 @@
+"""
+Benchmarks of the random forest model: building the feature matrix, fitting the model and predicting with it.
+"""
+from .common import SCALES, numeric_survey, prep
+
+
+class RandomForest(object):
+    """The random forest model of the roof rank. It is skipped when rfc_build cannot be imported (it needs matplotlib
+    and seaborn)."""
+    params = SCALES
+    param_names = ['n_rows']
+    timeout = 900
+
+    def setup(self, n_rows):
+        try:
+            import model.rfc_build as rfc
+        except ImportError as error:
+            raise NotImplementedError(str(error))
+        self.rfc = rfc
+
+        self.df = prep.ranking(numeric_survey(n_rows), ['roof', 'wall', 'floor']).reset_index(drop=True)
+        self.features = prep.extract_features(self.df, 'roof')
+        self.x_train, self.x_test, self.y_train, self.y_test = prep.build_feature_matrix(
+            self.df, self.features, 'roof', random_state=0)
+        self.model = rfc.rfc_model(self.x_train, self.y_train, 'roof', save=False)
+
+    def time_build_feature_matrix(self, n_rows):
+        prep.build_feature_matrix(self.df, self.features, 'roof', random_state=0)
+
+    def time_rfc_fit(self, n_rows):
+        self.rfc.rfc_model(self.x_train, self.y_train, 'roof', save=False)
+
+    def peakmem_rfc_fit(self, n_rows):
+        self.rfc.rfc_model(self.x_train, self.y_train, 'roof', save=False)
+
+    def time_rfc_predict(self, n_rows):
+        self.model.predict(self.x_test)
@@ -0,0 +1,37 @@
+"""
+Benchmarks of the semantic model. They are skipped when the WordNet corpus of nltk is not downloaded.
+"""
+from .common import RANK_LIST, SMALL_SCALES, clean_survey
+
+import model.fuzzy as fz
+
+# number of unknown words scanned, the WordNet lookups are much slower than the fuzzy scores
+N_UNKNOWN = 20
+
+
+class SemanticScan(object):
+    """The semantic similarity scan of the unknown roof materials, against the unique known materials."""
+    params = SMALL_SCALES
+    param_names = ['n_rows']
+    timeout = 600
+
+    def setup(self, n_rows):
+        try:
+            from nltk.corpus import wordnet as wn
+            wn.synsets('wood')
+        except LookupError:
+            raise NotImplementedError('the WordNet corpus of nltk is not downloaded')
+
+        import semantic.semantic as sem
+        self.sem = sem
+
+        df = clean_survey(n_rows)
+        corpus, unknown = fz.build_corpus(df, 'housing_roof', 'housing_roof_rank', RANK_LIST, compact=True)
+        self.corpus = [words for words, counts in corpus]
+        self.unknown = unknown[:N_UNKNOWN]
+
+    def time_semantic_similarity_scan(self, n_rows):
+        self.sem.semantic_similarity_scan(self.unknown, self.corpus, scorer=self.sem.SemanticScorer())
+
+    def peakmem_semantic_similarity_scan(self, n_rows):
+        self.sem.semantic_similarity_scan(self.unknown, self.corpus, scorer=self.sem.SemanticScorer())
@@ -0,0 +1,99 @@
+"""
+Shared setup of the benchmarks: the import path of hp_classify and the synthetic datasets they run on.
+
+The datasets are drawn by prep.simulate.SurveySimulator with a fixed seed, so every commit is timed on exactly the same
+data. The scales can be set with the HP_BENCH_SCALES environment variable (eg. HP_BENCH_SCALES=10000,100000).
+"""
+import os
+import sys
+import tempfile
+from functools import lru_cache
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'hp_classify'))
+
+import prep.prep_data as prep
+import prep.simulate as sim
+
+# number of rows of the datasets
+SCALES = [int(x) for x in os.environ.get('HP_BENCH_SCALES', '10000,100000,1000000').split(',')]
+
+# the pairwise scans grow with the square of the data, so they only run on the smallest scales
+SMALL_SCALES = [x for x in SCALES if x <= 100000] or SCALES[:1]
+
+# directory where the csv files of each scale are written once, and reused by the next runs
+CACHE_DIR = os.environ.get('HP_BENCH_CACHE', os.path.join(tempfile.gettempdir(), 'hp_classify_bench'))
+
+STR_VARS = ['housing_roof', 'housing_wall', 'housing_floor']
+NUM_VARS = [s + '_num' for s in STR_VARS]
+RANK_VARS = [s + '_rank' for s in STR_VARS]
+STR_GARBAGE = ['nan', 'other', 'not a dejure resident', 'not dejure resident']
+RANK_GARBAGE = ['4', '5', '6', '7', '8', '9', 'n']
+RANK_LIST = ['1', '2', '3']
+RANK_DICT = {'natural': '1', 'rudimentary': '2', 'finished': '3'}
+
+
+@lru_cache(maxsize=None)
+def simulator():
+    """This function returns the simulator shared by every benchmark."""
+    return sim.SurveySimulator(seed=0)
+
+
+def survey(n_rows):
+    """This function returns a fresh copy of the raw survey df of a scale.
+
+    :param n_rows: This is the number of rows.
+    :return: df: This is a pandas df of raw survey rows.
+    """
+    return _survey(n_rows).copy()
+
+
+@lru_cache(maxsize=None)
+def _survey(n_rows):
+    return simulator().chunk(n_rows)
+
+
+def survey_csv(n_rows):
+    """This function returns the path of the csv file of a scale, writing it the first time.
+
+    :param n_rows: This is the number of rows.
+    :return: path: This is the path of the csv file.
+    """
+    path = os.path.join(CACHE_DIR, 'survey_' + str(n_rows) + '.csv')
+    if not os.path.exists(path):
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+        simulator().write(tmp_path, n_rows, file_format='csv')
+        os.replace(tmp_path, path)
+
+    return path
+
+
+def clean_survey(n_rows):
+    """This function returns a copy of the survey df of a scale once it is cleaned and ranked, like the fuzzy model
+    expects it.
+
+    :param n_rows: This is the number of rows.
+    :return: df: This is a pandas df with the cleaned strings and the _rank columns.
+    """
+    return _clean_survey(n_rows).copy()
+
+
+@lru_cache(maxsize=None)
+def _clean_survey(n_rows):
+    df = survey(n_rows)
+    for var in STR_VARS:
+        df[var] = prep.clean_series(df[var])
+    df = prep.remove_garbage_codes(df, STR_VARS, STR_GARBAGE)
+    df = prep.extract_ranking(df, NUM_VARS)
+
+    return prep.remove_garbage_codes(df, RANK_VARS, RANK_GARBAGE)
+
+
+def numeric_survey(n_rows):
+    """This function returns a copy of the numeric columns of the survey df of a scale, as load_data returns them.
+
+    :param n_rows: This is the number of rows.
+    :return: df: This is a pandas df of the year, codes and iso3 columns.
+    """
+    return survey(n_rows)[['int_year', 'housing_roof_num', 'housing_wall_num', 'housing_floor_num', 'iso3']]
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Runner of the benchmark suite.
+
+The benchmarks are written like asv benchmarks (classes with params, a setup function, and time_ and peakmem_
+functions), so they can also be run with asv. This runner does not need asv: it runs each benchmark in this process,
+and saves the results of the current commit as a JSON file, which can then be compared with the results of another
+commit.
+
+usage: python benchmarks/run.py                       # every benchmark, saved in benchmarks/results/<commit>.json
+       python benchmarks/run.py --bench fuzzy --repeat 5
+       python benchmarks/run.py --compare benchmarks/results/old.json benchmarks/results/new.json
+"""
+import contextlib
+import gc
+import importlib
+import itertools
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ['bench_prep', 'bench_fuzzy', 'bench_semantic', 'bench_cv', 'bench_rfc']
+
+
+def discover(pattern=None):
+    """This function lists the benchmarks of the suite.
+
+    :param pattern: This is an optional regex. Only the benchmarks whose name matches it are listed
+        (eg. bench_fuzzy.FuzzyPipeline.time_fuzzy_scan).
+
+    :return: benchmarks: This is a list of tuples (name, class, function name).
+    """
+    sys.path.insert(0, ROOT)
+
+    benchmarks = [] #initialize list to store loop vals
+    for module_name in MODULES:
+        module = importlib.import_module('benchmarks.' + module_name)
+        for cls_name, cls in sorted(vars(module).items()):
+            if not isinstance(cls, type) or cls.__module__ != module.__name__:
+                continue
+            for attr in sorted(vars(cls)):
+                if attr.startswith(('time_', 'peakmem_')):
+                    name = module_name + '.' + cls_name + '.' + attr
+                    if pattern is None or re.search(pattern, name):
+                        benchmarks.append((name, cls, attr))
+
+    return benchmarks
+
+
+def param_sets(cls):
+    """This helper function lists the combinations of parameters of a benchmark class, like asv does: params is either
+    a list of values or a list of lists of values (one per parameter).
+    """
+    params = getattr(cls, 'params', None)
+    if params is None:
+        return [()]
+    if len(params) > 0 and isinstance(params[0], (list, tuple)):
+        return list(itertools.product(*params))
+
+    return [(x,) for x in params]
+
+
+def measure(func, args, kind, repeat):
+    """This function runs a benchmark function.
+
+    :param func: This is the bound benchmark function.
+    :param args: This is the tuple of parameters.
+    :param kind: This is either 'time' or 'peakmem'.
+    :param repeat: This is the number of timed runs.
+
+    :return: result: This is a dict with the statistics of the runs. The times are in seconds, and the peak memory
+        (measured by tracemalloc, so only the memory allocated by python and numpy) is in bytes.
+    """
+    if kind == 'peakmem':
+        gc.collect()
+        tracemalloc.start()
+        try:
+            func(*args)
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return {'value': peak, 'unit': 'bytes'}
+
+    times = [] #initialize list to store loop vals
+    for x in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    times.sort()
+
+    return {'value': times[0], 'median': times[len(times) // 2], 'max': times[-1], 'runs': len(times), 'unit': 's'}
+
+
+def run(pattern=None, repeat=3, verbose=False):
+    """This function runs the benchmarks of the suite.
+
+    :param pattern: This is an optional regex selecting the benchmarks to run (see discover).
+    :param repeat: This is the number of timed runs of each time_ benchmark. The best time is kept as its value.
+    :param verbose: Set to True to show the progress messages printed by the benchmarked functions (default False)
+
+    :return: results: This is a list of dicts, one per benchmark and combination of parameters.
+    """
+    results = [] #initialize list to store loop vals
+
+    # group the functions by class and parameters, so that each setup is only run once for all of them
+    benchmarks = discover(pattern)
+    for cls in list(dict.fromkeys([x[1] for x in benchmarks])):
+        attrs = [(name, attr) for name, x, attr in benchmarks if x is cls]
+        for args in param_sets(cls):
+            instance = cls()
+            try:
+                with quiet(not verbose):
+                    if hasattr(instance, 'setup'):
+                        instance.setup(*args)
+            except NotImplementedError as error:
+                print('skipping', cls.__name__, args, ':', error)
+                for name, attr in attrs:
+                    results.append({'name': name, 'params': list(args), 'skipped': str(error)})
+                continue
+
+            for name, attr in attrs:
+                kind = attr.split('_')[0]
+                with quiet(not verbose):
+                    result = measure(getattr(instance, attr), args, kind, repeat)
+                print('{:<60} {:<12} {:>14.4g} {}'.format(name, str(list(args)), result['value'], result['unit']))
+                results.append(dict({'name': name, 'params': list(args)}, **result))
+
+            if hasattr(instance, 'teardown'):
+                instance.teardown(*args)
+
+    return results
+
+
+@contextlib.contextmanager
+def quiet(enabled=True):
+    """This helper function silences the print statements and progress bars of the benchmarked functions.
+    """
+    if not enabled:
+        yield
+        return
+
+    with open(os.devnull, 'w') as devnull:
+        with contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+            yield
+
+
+def environment():
+    """This function describes the commit and the machine the benchmarks are run on.
+
+    :return: env: This is a dict of the commit, date, machine and package versions.
+    """
+    def git(*args):
+        try:
+            return subprocess.check_output(('git',) + args, cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    versions = {} #initialize dict to store loop vals
+    for package in ['numpy', 'pandas', 'scipy', 'sklearn', 'rapidfuzz', 'fuzzywuzzy', 'nltk']:
+        try:
+            versions[package] = importlib.import_module(package).__version__
+        except (ImportError, AttributeError):
+            versions[package] = None
+
+    return {'commit': git('rev-parse', 'HEAD'),
+            'dirty': bool(git('status', '--porcelain', '--untracked-files=no')),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'machine': platform.node(),
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'python': platform.python_version(),
+            'versions': versions,
+            'scales': os.environ.get('HP_BENCH_SCALES')}
+
+
+def compare(old_path, new_path, threshold=1.1):
+    """This function compares the results of two runs, and prints the ratio new / old of each benchmark.
+
+    :param old_path: This is the JSON file of the reference run.
+    :param new_path: This is the JSON file of the run to check.
+    :param threshold: This is the ratio above which a benchmark is flagged as a regression (and below whose inverse
+        it is flagged as an improvement).
+
+    :return: regressions: This is the list of the names and parameters of the benchmarks that regressed.
+    """
+    runs = [] #initialize list to store loop vals
+    for path in [old_path, new_path]:
+        with open(path) as f:
+            data = json.load(f)
+        runs.append(dict(((x['name'], str(x['params'])), x) for x in data['results'] if 'value' in x))
+        print(path, ':', data['environment']['commit'], data['environment']['date'])
+
+    regressions = [] #initialize list to store loop vals
+    for key in [x for x in runs[1] if x in runs[0]]:
+        old, new = runs[0][key]['value'], runs[1][key]['value']
+        ratio = new / old if old else float('inf')
+        flag = ''
+        if ratio > threshold:
+            flag = 'REGRESSION'
+            regressions.append(key)
+        elif ratio < 1 / threshold:
+            flag = 'improved'
+        print('{:<60} {:<12} {:>12.4g} {:>12.4g} {:>8.2f}x {}'.format(key[0], key[1], old, new, ratio, flag))
+
+    return regressions
+
+
+def main():
+    """This function runs or compares the benchmarks from the command line.
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run the hp_classify benchmarks and save the results as JSON.')
+    parser.add_argument('--bench', default=None, help='regex selecting the benchmarks to run')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs of each time_ benchmark')
+    parser.add_argument('--out', default=None, help='output JSON file, default: benchmarks/results/<commit>.json')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two JSON files of results')
+    parser.add_argument('--threshold', type=float, default=1.1, help='ratio flagged as a regression by --compare')
+    parser.add_argument('--verbose', action='store_true', help='show the output of the benchmarked functions')
+    args = parser.parse_args()
+
+    if args.compare:
+        regressions = compare(args.compare[0], args.compare[1], threshold=args.threshold)
+        sys.exit(1 if regressions else 0)
+
+    env = environment()
+    results = run(args.bench, repeat=args.repeat, verbose=args.verbose)
+
+    out = args.out
+    if out is None:
+        out = os.path.join(ROOT, 'benchmarks', 'results', (env['commit'] or 'unknown')[:12] + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump({'environment': env, 'results': results}, f, indent=1)
+    print('results saved to', out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,351 @@
+"""
+Instrumentation of the pipeline: stage timings, work counters, profiling switches and logging.
+
+Each stage of the pipeline (read, clean, rank, corpus, scan, predict, cv_fold, fit, ...) runs inside ins.stage, which
+records its wall time, CPU time and the peak resident memory of the process. The work done inside a stage (pairs of
+words scored, cache hits, rows dropped) is counted with ins.count. Everything is kept by a Recorder, and can be
+written to a metrics JSON file at the end of a run:
+
+    import instrument as ins
+    ins.configure_logging('INFO')
+    ins.configure(profile=['scan'], trace_memory=['cv_fold'])   # optional, see Recorder.configure
+    ... run the pipeline ...
+    ins.dump('metrics.json')
+
+The same switches can be set with environment variables, eg. for a batch job that cannot be edited:
+HP_METRICS=metrics.json (dump on exit), HP_PROFILE=scan,fit, HP_TRACE_MEMORY=cv_fold and HP_LOG_LEVEL=INFO.
+
+Note that the stages and counters of worker processes are not sent back, so the work done in a pool is measured by
+the stage of the parent process that runs the pool.
+"""
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+LOGGER_NAME = 'hp_classify'
+
+# the library only logs, the application decides where the messages go (see configure_logging)
+logging.getLogger(LOGGER_NAME).addHandler(logging.NullHandler())
+
+logger = logging.getLogger(LOGGER_NAME + '.instrument')
+
+
+def get_logger(name):
+    """This function returns the logger of a module of the package.
+
+    :param name: This is the name of the module, eg. __name__.
+
+    :return: logger: This is a logging.Logger below the hp_classify logger.
+    """
+    return logging.getLogger(LOGGER_NAME + '.' + name)
+
+
+def configure_logging(level='INFO', stream=None, fmt='%(asctime)s %(levelname)s %(name)s: %(message)s'):
+    """This function sends the log messages of the package to a stream. The progress messages that used to be printed
+    are logged at the INFO level, and the ones printed inside loops (per word, per corpus, per cv run) at DEBUG.
+
+    :param level: This is the lowest level shown (eg. 'DEBUG', 'INFO', 'WARNING').
+    :param stream: This is the stream the messages are written to. Default = sys.stderr
+    :param fmt: This is the format of the messages.
+
+    :return: logger: This is the hp_classify logger.
+    """
+    root = logging.getLogger(LOGGER_NAME)
+    for handler in [x for x in root.handlers if getattr(x, '_hp_classify', False)]:
+        root.removeHandler(handler) # calling this function again replaces its handler
+
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter(fmt))
+    handler._hp_classify = True
+    root.addHandler(handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+
+    return root
+
+
+def peak_rss():
+    """This function returns the peak resident memory of the process so far, in bytes (None if unknown)."""
+    try:
+        import resource
+    except ImportError:
+        return None # not available on windows
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return peak if sys.platform == 'darwin' else peak * 1024 # note that linux reports kilobytes
+
+
+def current_rss():
+    """This function returns the current resident memory of the process, in bytes (None if unknown)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class Recorder(object):
+    """This is the store of the stages and counters of a run.
+
+    The totals of each stage (calls, wall time, CPU time, peak memory, counters) are kept for the whole run, and the
+    details of each call are kept for the most recent max_records calls, so that a long running process does not
+    grow without bound.
+    """
+
+    def __init__(self, max_records=10000):
+        """This function creates an empty recorder.
+
+        :param max_records: This is the number of most recent stage calls whose details are kept.
+        """
+        self.max_records = max_records
+        self.profile = set()
+        self.trace_memory = set()
+        self.profile_dir = '.'
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        """This function forgets every stage and counter recorded so far."""
+        with self.lock:
+            self.records = deque(maxlen=self.max_records)
+            self.totals = {} #stage name -> totals
+            self.counters = {} #counter name -> total
+            self.started = time.time()
+
+    def configure(self, profile=None, trace_memory=None, profile_dir=None):
+        """This function sets the profiling switches.
+
+        :param profile: This is a list of stage names to run under cProfile. The statistics of each call are written
+            to profile_dir/<stage>_<pid>_<n>.prof (see the pstats module), and the path is stored in its record.
+        :param trace_memory: This is a list of stage names to run under tracemalloc. The peak memory allocated by
+            python and numpy during each call, and the lines that allocated the most, are stored in its record.
+        :param profile_dir: This is the directory where the profiles are written. Default = the working directory.
+        """
+        if profile is not None:
+            self.profile = set(profile)
+        if trace_memory is not None:
+            self.trace_memory = set(trace_memory)
+        if profile_dir is not None:
+            self.profile_dir = profile_dir
+
+    def _stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    @contextmanager
+    def stage(self, name, **tags):
+        """This function records a stage of the pipeline, used as a context manager:
+
+            with ins.stage('scan', engine='rapidfuzz'):
+                ...
+
+        :param name: This is the name of the stage. The calls with the same name are summed in the totals.
+        :param tags: These are optional values stored in the record of the call (eg. the file read).
+
+        :return: record: This is the dict of the call, which can be updated inside the block.
+        """
+        stack = self._stack()
+        record = dict(tags, stage=name, parent=stack[-1]['stage'] if stack else None, counters={})
+
+        profiler = None
+        if name in self.profile:
+            import cProfile
+            profiler = cProfile.Profile()
+
+        tracing = False
+        if name in self.trace_memory:
+            import tracemalloc
+            tracing = not tracemalloc.is_tracing() # a stage nested in a traced stage is part of its trace
+            if tracing:
+                tracemalloc.start()
+
+        stack.append(record)
+        peak_before = peak_rss()
+        start_cpu = time.process_time()
+        start = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield record
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            record['wall_s'] = time.perf_counter() - start
+            record['cpu_s'] = time.process_time() - start_cpu
+            record['peak_rss'] = peak_rss()
+            record['rss'] = current_rss()
+            # how much the stage raised the peak memory of the process
+            record['peak_rss_growth'] = (record['peak_rss'] - peak_before) if peak_before is not None else None
+            stack.pop()
+
+            if tracing:
+                record['traced_peak'] = tracemalloc.get_traced_memory()[1]
+                stats = tracemalloc.take_snapshot().statistics('lineno')[:10]
+                record['traced_top'] = [[str(x.traceback), x.size] for x in stats]
+                tracemalloc.stop()
+            if profiler is not None:
+                record['profile'] = self._dump_profile(profiler, name)
+
+            self._add(record)
+            logger.debug('%s done in %.3f s (%.3f s cpu)', name, record['wall_s'], record['cpu_s'])
+
+    def _dump_profile(self, profiler, name):
+        with self.lock:
+            n_call = self.totals[name]['calls'] if name in self.totals else 0
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(self.profile_dir, name + '_' + str(os.getpid()) + '_' + str(n_call) + '.prof')
+        profiler.dump_stats(path)
+        logger.info('profile of %s written to %s', name, path)
+
+        return path
+
+    def _add(self, record):
+        with self.lock:
+            self.records.append(record)
+            total = self.totals.setdefault(record['stage'], {'calls': 0, 'wall_s': 0., 'cpu_s': 0.,
+                                                             'peak_rss': None, 'counters': {}})
+            total['calls'] += 1
+            total['wall_s'] += record['wall_s']
+            total['cpu_s'] += record['cpu_s']
+            if record['peak_rss'] is not None:
+                total['peak_rss'] = max(total['peak_rss'] or 0, record['peak_rss'])
+            for key, n in record['counters'].items():
+                total['counters'][key] = total['counters'].get(key, 0) + n
+
+    def count(self, name, n=1):
+        """This function counts work done, both for the whole run and for the innermost stage running in this thread.
+
+        :param name: This is the name of the counter (eg. pairs_scored).
+        :param n: This is the amount to add.
+        """
+        n = int(n)
+        stack = self._stack()
+        if stack:
+            stack[-1]['counters'][name] = stack[-1]['counters'].get(name, 0) + n
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def timed(self, name, **tags):
+        """This function is a decorator that records every call of a function as a stage.
+
+        :param name: This is the name of the stage.
+        :param tags: These are optional values stored in the record of each call.
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(name, function=func.__module__ + '.' + func.__name__, **tags):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def summary(self):
+        """This function returns the totals of each stage.
+
+        :return: summary: This is a dict mapping each stage name to its calls, wall time, CPU time, peak resident
+            memory and counters, in the order the stages were first completed.
+        """
+        with self.lock:
+            return json.loads(json.dumps(self.totals))
+
+    def to_dict(self):
+        """This function returns everything recorded so far.
+
+        :return: metrics: This is a dict with the run information, the totals of each stage, the counters, and the
+            details of the most recent stage calls.
+        """
+        import platform
+
+        with self.lock:
+            records = list(self.records)
+            counters = dict(self.counters)
+        return {'run': {'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+                        'duration_s': time.time() - self.started,
+                        'argv': list(sys.argv),
+                        'pid': os.getpid(),
+                        'python': platform.python_version(),
+                        'platform': platform.platform(),
+                        'peak_rss': peak_rss()},
+                'stages': self.summary(),
+                'counters': counters,
+                'records': records}
+
+    def dump(self, path):
+        """This function writes the metrics of the run to a JSON file.
+
+        :param path: This is the path of the file.
+
+        :return: path: This is the path of the file.
+        """
+        metrics = self.to_dict()
+        tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(metrics, f, indent=1, default=str)
+        os.replace(tmp_path, path)
+        logger.info('metrics written to %s', path)
+
+        return path
+
+
+# recorder used by the modules of the package
+RECORDER = Recorder()
+
+
+def stage(name, **tags):
+    """This function records a stage with the shared recorder (see Recorder.stage)."""
+    return RECORDER.stage(name, **tags)
+
+
+def timed(name, **tags):
+    """This function is a decorator recording each call of a function as a stage of the shared recorder."""
+    return RECORDER.timed(name, **tags)
+
+
+def count(name, n=1):
+    """This function counts work done with the shared recorder (see Recorder.count)."""
+    RECORDER.count(name, n)
+
+
+def configure(profile=None, trace_memory=None, profile_dir=None):
+    """This function sets the profiling switches of the shared recorder (see Recorder.configure)."""
+    RECORDER.configure(profile=profile, trace_memory=trace_memory, profile_dir=profile_dir)
+
+
+def summary():
+    """This function returns the totals of each stage of the shared recorder."""
+    return RECORDER.summary()
+
+
+def reset():
+    """This function forgets everything recorded by the shared recorder."""
+    RECORDER.reset()
+
+
+def dump(path):
+    """This function writes the metrics of the shared recorder to a JSON file."""
+    return RECORDER.dump(path)
+
+
+def _configure_from_env():
+    """This is a helper function for this module. It applies the HP_* environment variables when it is imported."""
+    import atexit
+
+    split = lambda x: [y.strip() for y in x.split(',') if y.strip()]
+    if os.environ.get('HP_LOG_LEVEL'):
+        configure_logging(os.environ['HP_LOG_LEVEL'])
+    configure(profile=split(os.environ.get('HP_PROFILE', '')) or None,
+              trace_memory=split(os.environ.get('HP_TRACE_MEMORY', '')) or None,
+              profile_dir=os.environ.get('HP_PROFILE_DIR'))
+    if os.environ.get('HP_METRICS'):
+        atexit.register(dump, os.environ['HP_METRICS'])
+
+
+_configure_from_env()
@@ -1,11 +1,23 @@
-def fuzzy_cv(cv_list, base_var, rank_dictionary, subset=None, threshold=75, jupyter=False):
+import instrument as ins
+
+logger = ins.get_logger(__name__)
+
+# options shared by every run of the fuzzy_cv_parallel pool, set once by _init_fold_worker
+_FOLD_OPTIONS = None
+
+
+@ins.timed('cv')
+def fuzzy_cv(cv_list, base_var, rank_dictionary, subset=None, threshold=75, jupyter=False, compact=False,
+             n_jobs=1, cache=None, fused=False, engine=None):
     """This is the master function for this module. It is used to loop over our list of randomly sampled
     cross-validation dfs and run the fuzzy prediction pipeline on them in order to return results and accuracy metrics
     for each. It reads in our custom fuzzy module in order to use its functions in sequence on each cv run.
 
     TODO: ?
 
-    :param cv_list: This is a list of pandas df, each containing a different cross-validation run.
+    :param cv_list: This is a list of pandas df, each containing a different cross-validation run. It can also be a
+        list of CensoredFold (see prep.prep_cv.cv_censor_index), in which case each run is only built when it is
+        processed, and the output dfs only carry the base_var column of the original df.
     :param base_var: This is a string indicating the variable you want to analyze the string values of and predict rank
     :param rank_dictionary: This is a dictionary that can be used to map the str names of the ranks back to ordinal vals
     :param subset: This is an optional parameter that can be used to subset our list of unknown words for testing
@@ -13,6 +25,16 @@ def fuzzy_cv(cv_list, base_var, rank_dictionary, subset=None, threshold=75, jupy
     in word similarity to accurately predict the words quality ranking.
     :param jupyter: This is a boolean that tells us if we are running in a jupyter nb. If so, we use a different tqdm
         progress bar.
+    :param compact: This is a boolean that tells us to score the unique words of each corpus once and weight them by
+        their counts. The predictions are identical, but the distributions are returned in the compact long format.
+    :param n_jobs: This is the number of processes used to scan the unknown words of each cv run (-1 uses all cores).
+    :param cache: This is an optional SimilarityCache (see model.sim_cache) shared by every cv run, so that the pairs
+        of words that were already scored in a previous run (or a previous call) are not scored again.
+    :param fused: This is a boolean that tells us to reduce the scores to predictions as they are computed (see
+        fz.fuzzy_scan_predict), so that the distributions are never built. The predictions are identical, but
+        cv_distrib is then a list of None.
+    :param engine: This is an optional str ('rapidfuzz' or 'fuzzywuzzy') used to force a given scoring engine.
+        Default = fz.default_engine(). Note that the two engines do not return the same scores (see fz.score_matrix).
 
     :return: cv_distrib: This is a list of len=len(cv_list), containing pandas dfs that have the distributions of scores
      for each unknown word
@@ -25,57 +47,97 @@ def fuzzy_cv(cv_list, base_var, rank_dictionary, subset=None, threshold=75, jupy
     """
 
     #import packages
-    from fuzzywuzzy import fuzz
-    from fuzzywuzzy import process
-    import pandas as pd
-    import numpy as np
-    
     if jupyter == True:
         from tqdm import tqdm_notebook as tqdm
     else: 
         from tqdm import tqdm as tqdm
+
+    # initialize lists to store loop vals
+    cv_distrib = []
+    cv_preds = []
+    cv_results = []
+    cv_df = []
+    
+    #loop over each cross validation:
+    for i in tqdm(range(len(cv_list)), desc="cv loop"):
+        
+        logger.debug('working on cv loop # %d', i)
+        distrib, preds, success_rate, out = cv_fold(cv_list[i], base_var, rank_dictionary, subset=subset,
+                                                    threshold=threshold, jupyter=jupyter, compact=compact,
+                                                    n_jobs=n_jobs, cache=cache, fused=fused, engine=engine)
+        
+        #append results to prep for next loop
+        cv_distrib.append(distrib)
+        cv_preds.append(preds)
+        cv_results.append(success_rate)
+        cv_df.append(out)
+        
+    return(cv_distrib, cv_preds, cv_results, cv_df)
+
+
+@ins.timed('cv_fold')
+def cv_fold(df, base_var, rank_dictionary, subset=None, threshold=75, jupyter=False, compact=False, n_jobs=1,
+            cache=None, fused=False, engine=None):
+    """This is a helper function for this module. It runs the fuzzy prediction pipeline on a single
+    cross-validation df. See fuzzy_cv for a description of the parameters.
+
+    :return: distrib: This is a pandas df that has the distributions of scores for each unknown word (None if fused)
+    :return: preds: This is a pandas df that has the prediction for each word based on the distributions of scores
+    :return: success_rate: This is a pandas crosstab that indicates the accuracy score result for the cv run
+    :return: out: This is a pandas df in which each of the unknown words has a prediction column added
+    """
+    #import packages
+    import pandas as pd
+    import numpy as np
     
     #import custom modules
     import sys
     sys.path.append('../hp_classify')
     import model.fuzzy as fz
+    import prep.prep_cv as pcv
     
     #setup objects
     rank_var = base_var + '_rank'
     og_var = rank_var + '_og'
+
+    #build the df of a lightweight fold, keeping only the column we need
+    if isinstance(df, pcv.CensoredFold):
+        df = df.to_frame(columns=[base_var])
     
     #TODO validate syntax
     rank_values = list(rank_dictionary.values())
     rank_keys = list(rank_dictionary.keys())
 
-    # initialize lists to store loop vals
-    cv_distrib = []
-    cv_preds = []
-    cv_results = []
-    cv_df = []
+    #build corpus of known and unknown strings
+    #note that the df is never modified, so there is no need to copy it
+    str_list, idk_strings = fz.build_corpus(df, base_var, rank_var, rank_values, compact=compact)
     
-    #loop over each cross validation:
-    for i in tqdm(range(len(cv_list)), desc="cv loop"):
-        
-        print('working on cv loop #', i)
-        df = cv_list[i].copy() #subset the cv list to the current df
+    #subset the unknown strings to allow for faster testing
+    if subset != None:
+        idk_strings = idk_strings[subset]
+    
+    if fused == True:
+        #reduce the scores to predictions as they are computed, then add them to the test rows without a merge
+        distrib = None
+        preds = fz.fuzzy_scan_predict(idk_strings, str_list, threshold, rank_dictionary, compact=compact,
+                                      engine=engine, n_jobs=n_jobs, cache=cache)
+        out = fz.apply_predictions(df, base_var, preds)
 
-        #build corpus of known and unknown strings
-        str_list, idk_strings = fz.build_corpus(df, base_var, rank_var, rank_values)
-        
-        #subset the unknown strings to allow for faster testing
-        if subset != None:
-            idk_strings = idk_strings[subset]
-        
+    else:
         #find distribution of scores for each string
-        distrib = fz.fuzzy_scan(idk_strings, str_list, jupyter=jupyter)
+        if compact == True:
+            distrib = fz.fuzzy_scan_compact(idk_strings, str_list, jupyter=jupyter, engine=engine, n_jobs=n_jobs,
+                                            cache=cache)
+        else:
+            distrib = fz.fuzzy_scan(idk_strings, str_list, jupyter=jupyter, engine=engine, n_jobs=n_jobs,
+                                    cache=cache)
         
         #TODO, output plots of distribution for analysis
         
         #predict class based on probability of exceeding similarity cutoff
         preds = fz.fuzzy_predict(distrib, rank_keys, 'word', threshold,
-                                 rank_dictionary)
-
+                                 rank_dictionary, weight='count' if compact == True else None)
+    
         #merge results back on the test data to validate
         train = df[df['train']==0]
         out = pd.merge(train,
@@ -83,32 +145,117 @@ def fuzzy_cv(cv_list, base_var, rank_dictionary, subset=None, threshold=75, jupy
                        left_on=base_var,
                        right_on='word',
                        how='left')
-
+    
         # Verify that rows have neither been added or lost by merging on predictions
         if len(train) != len(out):
             class RowCountException(Exception):
                 """Custom exception class.
-
+    
                 This exception is raised when the rowcount is not as expected.
-
+    
                 """
                 pass
-
+    
             raise RowCountException("Rowcount was modified by merge, output df is no longer representative")
+    
+    #calculate success rate and tabulate
+    out['success'] = np.where(out[og_var] == out['pred'], 1, 0)
+    success_rate = pd.crosstab(out[~pd.isnull(out['pred'])]['success'], columns='count')
+
+    return(distrib, preds, success_rate, out)
+
+
+@ins.timed('cv')
+def fuzzy_cv_parallel(cv_list, base_var, rank_dictionary, subset=None, threshold=75, compact=False, n_jobs=-1,
+                      seed=0, max_memory=None, cache_path=None, fused=False, engine=None):
+    """This is the parallel version of fuzzy_cv. Each cross-validation run is sent to a separate process, and the
+    results are returned in the same four lists, in the same order, as fuzzy_cv.
+
+    :param cv_list: This is a list of pandas df (or CensoredFold), each containing a different cross-validation run.
+    :param base_var: This is a string indicating the variable you want to analyze the string values of and predict rank
+    :param rank_dictionary: This is a dictionary that can be used to map the str names of the ranks back to ordinal vals
+    :param subset: This is an optional parameter that can be used to subset our list of unknown words for testing
+    :param threshold: This is the similarity score threshold, above which we think implies sufficient semantic meaning
+    in word similarity to accurately predict the words quality ranking.
+    :param compact: This is a boolean that tells us to score the unique words of each corpus once and weight them by
+        their counts.
+    :param n_jobs: This is the number of processes to run the cv runs in (-1 uses all cores).
+    :param seed: This is the base seed of the random number generator. Run #i seeds numpy with seed + i, so that any
+        random draw made within a run is reproducible whatever the number of processes.
+    :param max_memory: This is an optional limit, in bytes, on the address space of each process. A run exceeding it
+        raises a MemoryError rather than taking down the whole node.
+    :param cache_path: This is an optional path to an on-disk SimilarityCache (see model.sim_cache) shared by every
+        process.
+    :param fused: This is a boolean that tells us to reduce the scores to predictions as they are computed, so that
+        the distributions are never built or sent back (see fuzzy_cv).
+    :param engine: This is an optional str ('rapidfuzz' or 'fuzzywuzzy') used to force a given scoring engine in
+        every process (see fuzzy_cv).
+
+    :return: cv_distrib, cv_preds, cv_results, cv_df: These are the same lists that are returned by fuzzy_cv.
+    """
+    #import packages
+    import os
+    from concurrent.futures import ProcessPoolExecutor
+
+    #import custom modules
+    import sys
+    sys.path.append('../hp_classify')
+    import prep.prep_cv as pcv
+
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = os.cpu_count()
+    n_jobs = max(1, min(n_jobs, len(cv_list)))
+
+    #note that lightweight folds are built before they are sent, so the workers never receive the full df
+    tasks = [(cv_list[i].to_frame(columns=[base_var]) if isinstance(cv_list[i], pcv.CensoredFold) else cv_list[i],
+              seed + i) for i in range(len(cv_list))]
+    options = dict(base_var=base_var, rank_dictionary=rank_dictionary, subset=subset, threshold=threshold,
+                   compact=compact, cache_path=cache_path, fused=fused, engine=engine)
+
+    logger.info('running %d cv loops in %d processes', len(cv_list), n_jobs)
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_fold_worker,
+                             initargs=(options, max_memory)) as executor:
+        results = list(executor.map(_fold_worker, tasks)) # map returns the runs in order
+
+    cv_distrib, cv_preds, cv_results, cv_df = [list(x) for x in zip(*results)] if results else ([], [], [], [])
 
-        #calculate success rate and tabulate
-        out['success'] = np.where(out[og_var] == out['pred'], 1, 0)
-        success_rate = pd.crosstab(out[~pd.isnull(out['pred'])]['success'], columns='count')
-        
-        #append results to prep for next loop
-        cv_distrib.append(distrib)
-        cv_preds.append(preds)
-        cv_results.append(success_rate)
-        cv_df.append(out)
-        
     return(cv_distrib, cv_preds, cv_results, cv_df)
 
 
+def _init_fold_worker(options, max_memory):
+    """This is a helper function for fuzzy_cv_parallel. It stores the options shared by every run in the global state
+    of the process, and caps the memory that the process can use.
+    """
+    global _FOLD_OPTIONS
+    _FOLD_OPTIONS = options
+
+    if max_memory is not None:
+        import resource
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory, max_memory))
+
+
+def _fold_worker(task):
+    """This is a helper function for fuzzy_cv_parallel. It seeds the random number generator, then runs a single
+    cross-validation run.
+    """
+    import numpy as np
+
+    df, seed = task
+    np.random.seed(seed)
+
+    options = dict(_FOLD_OPTIONS)
+    cache = None
+    if options.pop('cache_path') is not None:
+        import model.sim_cache as sc
+        cache = sc.SimilarityCache(_FOLD_OPTIONS['cache_path'], engine=options['engine'])
+
+    try:
+        return (cv_fold(df, cache=cache, **options))
+    finally:
+        if cache is not None:
+            cache.close()
+
+
 def save_results_df(df_list, out_dir, out_name):
     """This is a helper function for this module. It is used to save the generated results to csv.
 
@@ -123,7 +270,7 @@ def save_results_df(df_list, out_dir, out_name):
 
     #concatenate the path using the dir and name of choice
     out_path = f'{out_dir}//{out_name}.csv'    
-    print('saving df to', out_path)
+    logger.info('saving df to %s', out_path)
     
     df = pd.concat(df_list) #concat the results list (over all cv runs) into a single pandas df
     df.to_csv(out_path, header=False, sep=';')
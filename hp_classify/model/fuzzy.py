@@ -1,4 +1,25 @@
-def build_corpus(df, str_var, rank_var, rank_list):
+import re
+
+import instrument as ins
+
+logger = ins.get_logger(__name__)
+
+# hard coded names for the distribution of each rank, in the order of the corpora returned by build_corpus
+RANK_NAMES = ['natural', 'rudimentary', 'finished']
+
+# precompiled tables used to process strings the way fuzzywuzzy does (drop chars 128-255, non-word chars to space)
+_ASCII_TABLE = dict((i, None) for i in range(128, 256))
+_RE_NON_WORD = re.compile(r"(?ui)\W")
+
+# corpora held by each process of the scan_matrices pool, set once by _init_scan_worker
+_SCAN_STATE = None
+
+# corpora, weights and cutoff used by the processes of fuzzy_scan_predict, set once by _init_exceed_worker
+_EXCEED_STATE = None
+
+
+@ins.timed('corpus')
+def build_corpus(df, str_var, rank_var, rank_list, compact=False):
     """This is a helper function for this module. It is used to build the corpuses that will be used to analyze
     word similarity in order to make a prediction for unknown words. It returns a separate corpus for each provided
     rank and also a vector of unknown words which currently are not associated with a rank and need to be predicted.
@@ -9,51 +30,343 @@ def build_corpus(df, str_var, rank_var, rank_list):
     :param str_var: This is a string indicating the variable you want to analyze the string values of.
     :param rank_var: This is a string indicating the variable you want to classify the string_var into ranks by.
     :param rank_list: This is a list of the rank categories you want to classify by. rank_var should contain these vals.
+    :param compact: This is a boolean that tells us to return each corpus in its compact form (see compact_corpus).
 
     :return: out: This is a list which length=length(rank_list). Each object in the list is a vector of words (corpus)
-        that are associated with this rank.
+        that are associated with this rank, or a tuple of (unique words, counts) if compact=True.
     :return: other: This is a vector of unknown words that we will compare against every corpus in out to classify.
     """
     # import necessary modules
     import pandas as pd
     import numpy as np
-    from fuzzywuzzy import fuzz
-    from fuzzywuzzy import process
 
     out = [] #initialize list to store loop vals
 
     for x in rank_list:
-        print("building corpus for rank #", x)
+        logger.debug("building corpus for rank # %s", x)
         out.append(df[df[rank_var] == x][str_var].values)
 
-    print("extracting unknown strings")
+    if compact == True:
+        out = compact_corpus(out)
+
+    logger.debug("extracting unknown strings")
     other = df[~df[rank_var].isin(rank_list)][str_var].unique()
     other = other[~pd.isnull(other)]  # cant classify NaN
-    print("need to classify", len(other), "unknown strings")
+    logger.info("need to classify %d unknown strings", len(other))
 
     return (out, other)
 
-def fuzzy_scan(unknown_list, corpus_list, jupyter=False):
+def compact_corpus(corpus_list):
+    """This is a helper function for this module. It is used to compress each corpus into its unique words and the
+    number of times that each of them occurs. Survey corpora repeat the same few strings many thousands of times, so
+    scoring the unique words and weighting the scores by their counts is much cheaper than scoring every row.
+
+    :param corpus_list: This is a list of vectors that contain all the words associated with each quality ranking level.
+
+    :return: out: This is a list of tuples (words, counts), one per corpus, where words is a vector of unique strings
+        and counts is an int vector of how many times each of them appears in the original corpus.
+    """
+    # import necessary modules
+    import pandas as pd
+    import numpy as np
+
+    out = [] #initialize list to store loop vals
+
+    for corpus in corpus_list:
+        # note that the scorer coerces every value to str, so NaN is kept as the string 'nan' like it would be scored
+        codes, uniques = pd.factorize(np.asarray(corpus, dtype=str))
+        out.append((np.asarray(uniques, dtype=object), np.bincount(codes, minlength=len(uniques))))
+
+    return (out)
+
+def process_string(text):
+    """This is a helper function for this module. It is used to normalize a string the same way that fuzzywuzzy does
+    before it computes a WRatio, so that every scoring engine sees identical inputs. Non-ascii characters are dropped,
+    every other non-alphanumeric character is replaced by a space, and the text is lowercased and stripped.
+
+    :param text: This is the string (or other value, which is coerced to str) that needs to be processed.
+
+    :return: text: This is the processed string.
+    """
+
+    text = str(text).translate(_ASCII_TABLE)
+    text = _RE_NON_WORD.sub(" ", text)
+
+    return text.lower().strip()
+
+
+def score_matrix(unknown_list, corpus, engine=None, workers=1, chunksize=256):
+    """This is a helper function for this module. It is used to compute the full matrix of WRatio similarity scores
+    between every word on the list of unknown words and every word in a single corpus, in one call. By default the
+    scores are computed pair by pair with fuzzywuzzy, which is the scorer the model was built and tuned with. The C++
+    cdist kernel of rapidfuzz is much faster, but it is only used when asked for (see default_engine), because its
+    scores are not the same: rapidfuzz computes the partial alignment exactly, whereas fuzzywuzzy uses a heuristic. On
+    random pairs of survey words, about 40% of the scores differ, by up to ~45 points (eg. 'gstone tiled' vs 'xg' scores
+    14 with fuzzywuzzy and 60 with rapidfuzz), and about 0.5% of the pairs end up on the other side of a cutoff of 75,
+    which changes some of the predictions.
+
+    :param unknown_list: This is a vector of words with an unknown quality ranking that we want to analyze and predict.
+    :param corpus: This is a vector of known words that we want to compare every unknown word against.
+    :param engine: This is an optional str ('rapidfuzz' or 'fuzzywuzzy') used to force a given scoring engine.
+    :param workers: This is the number of threads rapidfuzz is allowed to use (-1 uses all cores).
+    :param chunksize: This is the number of unknown words scored per block, which bounds the temporary memory used.
+
+    :return: scores: This is a uint8 numpy array of shape (len(unknown_list), len(corpus)) holding the scores.
+    """
+    if engine is None:
+        engine = default_engine()
+
+    # process each distinct string only once, then expand back to the full vectors
+    queries, unknown_inv = prepare_strings(unknown_list)
+    choices, corpus_inv = prepare_strings(corpus)
+
+    scores = score_prepared(queries, choices, engine=engine, workers=workers, chunksize=chunksize)
+
+    return scores[unknown_inv][:, corpus_inv]
+
+
+def prepare_strings(strings):
+    """This is a helper function for this module. It is used to reduce a vector of strings to its unique values,
+    processed with process_string, so that each distinct string only has to be processed and scored once.
+
+    :param strings: This is a vector of strings.
+
+    :return: processed: This is a list of the unique strings after processing.
+    :return: inverse: This is an int vector such that processed[inverse] rebuilds the full vector.
+    """
+    # import necessary modules
+    import numpy as np
+
+    uniq, inverse = np.unique(np.asarray(strings, dtype=str), return_inverse=True)
+
+    return ([process_string(x) for x in uniq], inverse.ravel())
+
+
+def score_prepared(queries, choices, engine, workers=1, chunksize=256, score_cutoff=None):
+    """This is a helper function for this module. It is used to compute the matrix of WRatio scores between two lists
+    of strings that have already been processed with prepare_strings.
+
+    :param queries: This is a list of processed strings, one per row of the output.
+    :param choices: This is a list of processed strings, one per column of the output.
+    :param engine: This is a str ('rapidfuzz' or 'fuzzywuzzy') indicating which scoring engine to use.
+    :param workers: This is the number of threads rapidfuzz is allowed to use (-1 uses all cores).
+    :param chunksize: This is the number of queries scored per block, which bounds the temporary memory used.
+    :param score_cutoff: This is an optional raw score below which rapidfuzz may stop early and return 0 instead.
+
+    :return: scores: This is a uint8 numpy array of shape (len(queries), len(choices)) holding the scores.
+    """
+    # import necessary modules
+    import numpy as np
+
+    scores = np.zeros((len(queries), len(choices)), dtype=np.uint8)
+    if len(queries) == 0 or len(choices) == 0:
+        return scores
+
+    if engine == 'rapidfuzz':
+        from rapidfuzz import fuzz, process
+
+        for start in range(0, len(queries), chunksize):
+            block = process.cdist(queries[start:start + chunksize], choices,
+                                  scorer=fuzz.WRatio, processor=None, workers=workers,
+                                  score_cutoff=score_cutoff)
+            scores[start:start + chunksize] = np.rint(block)
+    elif engine == 'fuzzywuzzy':
+        from fuzzywuzzy import fuzz
+
+        for x in range(len(queries)):
+            scores[x] = [fuzz.WRatio(queries[x], y, full_process=False) for y in choices]
+    else:
+        raise ValueError("Unknown scoring engine: " + str(engine))
+
+    return scores
+
+
+def scan_matrices(unknown_list, corpus_list, engine=None, workers=1, n_jobs=1, cache=None):
+    """This is a helper function for this module. It is used to compute the matrix of scores between the list of
+    unknown words and every corpus in corpus_list. If n_jobs > 1, the list of unknown words is split into chunks that
+    are scored in a pool of processes. The corpora are sent to each process once when it starts, rather than with
+    every chunk, and the chunks are merged back in their original order so the output does not depend on n_jobs.
+
+    :param unknown_list: This is a vector of words with an unknown quality ranking that we want to analyze and predict.
+    :param corpus_list: This is a list of vectors that contain all the words associated with each quality ranking level.
+    :param engine: This is an optional str ('rapidfuzz' or 'fuzzywuzzy') used to force a given scoring engine.
+    :param workers: This is the number of threads rapidfuzz is allowed to use within each process.
+    :param n_jobs: This is the number of processes to use (-1 uses all cores, 1 runs in the current process).
+    :param cache: This is an optional SimilarityCache (see model.sim_cache). If provided, only the pairs of words that
+        are missing from the cache are scored, and their scores are added to it.
+
+    :return: out: This is a list with one uint8 numpy array of shape (len(unknown_list), len(corpus)) per corpus.
+    """
+    # import necessary modules
+    import os
+    import numpy as np
+    from multiprocessing import Pool
+
+    if cache is not None:
+        if engine is not None and engine != cache.engine:
+            raise ValueError("The cache holds scores computed by " + cache.engine + ", not " + engine)
+        engine = cache.engine
+    if engine is None:
+        engine = default_engine()
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = os.cpu_count()
+
+    prepared = [prepare_strings(corpus) for corpus in corpus_list]
+
+    if cache is not None:
+        return (_scan_cached(unknown_list, prepared, engine, workers, n_jobs, cache))
+
+    # note that the pairs are counted between the unknown words and the unique processed corpus words
+    ins.count('pairs_scored', len(unknown_list) * sum([len(choices) for choices, corpus_inv in prepared]))
+
+    if n_jobs == 1 or len(unknown_list) < 2:
+        return (_scan_prepared(unknown_list, prepared, engine, workers))
+
+    # split the unknown words into a few chunks per process to balance the load
+    n_chunk = min(len(unknown_list), n_jobs * 4)
+    chunks = np.array_split(np.asarray(unknown_list, dtype=object), n_chunk)
+
+    with Pool(processes=n_jobs, initializer=_init_scan_worker, initargs=(prepared, engine, workers)) as pool:
+        results = pool.map(_scan_worker, chunks, chunksize=1) # map returns the chunks in order
+
+    return ([np.concatenate([x[y] for x in results]) for y in range(len(corpus_list))])
+
+
+def _scan_cached(unknown_list, prepared, engine, workers, n_jobs, cache):
+    """This is a helper function for scan_matrices. It looks up the scores of every pair of words in the cache, and
+    only computes the missing ones, either in the current process or in a pool of processes.
+    """
+    # import necessary modules
+    import numpy as np
+    import pandas as pd
+    from multiprocessing import Pool
+
+    processed, unknown_inv = prepare_strings(unknown_list)
+    # distinct unknown words can share a processed string (eg. 'brick' and 'Brick!'), so each processed string is
+    # looked up and scored once, and its scores are sent back to every word through the inverse index
+    codes, queries = pd.factorize(pd.Series(processed, dtype=object))
+    queries = list(queries)
+    unknown_inv = codes[unknown_inv]
+    out = [np.zeros((len(queries), len(choices)), dtype=np.uint8) for choices, corpus_inv in prepared]
+
+    # collect the missing pairs as tasks of (unknown word, corpus, positions of the missing words)
+    tasks = [] #initialize list to store loop vals
+    for x in range(len(queries)):
+        for y in range(len(prepared)):
+            scores = cache.get(queries[x], prepared[y][0])
+            missing = np.flatnonzero(scores < 0)
+            out[y][x] = np.maximum(scores, 0)
+            if len(missing) > 0:
+                tasks.append((queries[x], y, missing))
+
+    n_missing = sum([len(x[2]) for x in tasks])
+    ins.count('pairs_scored', n_missing)
+    ins.count('cache_hits', len(queries) * sum([len(choices) for choices, corpus_inv in prepared]) - n_missing)
+    logger.info('scoring %d pairs missing from the cache', n_missing)
+
+    if n_jobs == 1 or len(tasks) < 2:
+        results = [_score_missing(x, prepared, engine, workers) for x in tasks]
+    else:
+        with Pool(processes=n_jobs, initializer=_init_scan_worker, initargs=(prepared, engine, workers)) as pool:
+            results = pool.map(_missing_worker, tasks, chunksize=max(1, len(tasks) // (n_jobs * 4)))
+
+    # fill in and store the new scores
+    query_pos = dict([(queries[x], x) for x in range(len(queries))])
+    for (query, y, missing), scores in zip(tasks, results):
+        out[y][query_pos[query], missing] = scores
+        cache.put(query, [prepared[y][0][z] for z in missing], scores)
+    cache.commit()
+
+    return ([out[y][unknown_inv][:, prepared[y][1]] for y in range(len(prepared))])
+
+
+def _init_scan_worker(prepared, engine, workers):
+    """This is a helper function for scan_matrices. It stores the prepared corpora in the global state of the
+    process, so that they only have to be sent to each process once.
+    """
+    global _SCAN_STATE
+    _SCAN_STATE = (prepared, engine, workers)
+
+
+def _scan_worker(unknown_chunk):
+    """This is a helper function for scan_matrices. It scores a chunk of unknown words against the corpora stored by
+    _init_scan_worker.
+    """
+    return (_scan_prepared(unknown_chunk, *_SCAN_STATE))
+
+
+def _missing_worker(task):
+    """This is a helper function for _scan_cached. It scores a task of missing pairs against the corpora stored by
+    _init_scan_worker.
+    """
+    return (_score_missing(task, *_SCAN_STATE))
+
+
+def _score_missing(task, prepared, engine, workers):
+    """This is a helper function for _scan_cached. It scores an unknown word against the missing words of a corpus.
+    """
+    query, y, missing = task
+    choices = [prepared[y][0][z] for z in missing]
+
+    return (score_prepared([query], choices, engine=engine, workers=workers)[0])
+
+
+def _scan_prepared(unknown_chunk, prepared, engine, workers):
+    """This is a helper function for scan_matrices. It scores a chunk of unknown words against each of the prepared
+    corpora, and returns one score matrix per corpus.
+    """
+    queries, unknown_inv = prepare_strings(unknown_chunk)
+
+    out = [] #initialize list to store loop vals
+    for choices, corpus_inv in prepared:
+        scores = score_prepared(queries, choices, engine=engine, workers=workers)
+        out.append(scores[unknown_inv][:, corpus_inv])
+
+    return (out)
+
+
+def default_engine():
+    """This is a helper function for this module. It returns the name of the scoring engine used when none is given.
+    This is fuzzywuzzy, unless the HP_FUZZY_ENGINE environment variable is set to 'rapidfuzz'. Note that the two
+    engines do not return the same scores (see score_matrix), so switching engine changes some of the predictions.
+
+    :return: engine: This is a str, either 'rapidfuzz' or 'fuzzywuzzy'.
+    """
+    # import necessary modules
+    import os
+
+    engine = os.environ.get('HP_FUZZY_ENGINE', 'fuzzywuzzy').strip().lower()
+    if engine not in ['rapidfuzz', 'fuzzywuzzy']:
+        raise ValueError("Unknown scoring engine in HP_FUZZY_ENGINE: " + engine)
+
+    return engine
+
+
+@ins.timed('scan')
+def fuzzy_scan(unknown_list, corpus_list, jupyter=False, engine=None, workers=1, n_jobs=1,
+               cache=None):
     """This is a helper function for this module. It is used to scan each word on the list of unknown words by
-    comparing it to every word in each corpus in corpus_list. The words are compared using the fuzzywuzzy package and a
-    similarity score is computed using the Levenshtein distance. For each unknown word, a distribution of similiarity
-    scores is provided for every known rank. This distribution is later used to predict the most likely rank for the
-    given word.
+    comparing it to every word in each corpus in corpus_list. The words are compared using a WRatio similarity score,
+    which is based on the Levenshtein distance. For each unknown word, a distribution of similiarity scores is provided
+    for every known rank. This distribution is later used to predict the most likely rank for the given word.
 
-    TODO: ?
+    The scores for each corpus are computed in a single call using scan_matrices, and then reshaped into the long
+    format df that is expected by fuzzy_predict and fuzzy_density.
 
     :param unknown_list: This is a vector of words with an unknown quality ranking that we want to analyze and predict.
     :param corpus_list: This is a list of vectors that contain all the words associated with each quality ranking level.
     :param jupyter: This is a boolean that tells us if we are running in a jupyter nb. If so, we use a different tqdm
         progress bar.
+    :param engine: This is an optional str ('rapidfuzz' or 'fuzzywuzzy') used to force a given scoring engine.
+    :param workers: This is the number of threads rapidfuzz is allowed to use (-1 uses all cores).
+    :param n_jobs: This is the number of processes the unknown words are split across (-1 uses all cores).
+    :param cache: This is an optional SimilarityCache, used to only score the pairs of words that were never seen.
 
     :return: distrib: This is a pandas df with all the similarity scores for each unknown word.
     """
     # import necessary modules
     import pandas as pd
     import numpy as np
-    from fuzzywuzzy import fuzz
-    from fuzzywuzzy import process
 
     #note that if we are using a jupyter notebook we want to use a different tqdm call as it displays badly otherwise
     if jupyter == True:
@@ -61,41 +374,221 @@ def fuzzy_scan(unknown_list, corpus_list, jupyter=False):
     else:
         from tqdm import tqdm
 
+    logger.info('analyzing %d unknown strings', len(unknown_list))
+
+    n_word = len(unknown_list)
+    n_row = max(len(x) for x in corpus_list) # every word gets a block as long as the longest corpus
+
+    distrib = {'word': np.repeat(np.asarray(unknown_list, dtype=object), n_row)}
+
+    # compute the whole matrix of scores for each corpus in one call
+    matrices = scan_matrices(unknown_list, corpus_list, engine=engine, workers=workers, n_jobs=n_jobs, cache=cache)
+
+    #TODO: make this call more flexible, currently the colnames are hard coded so this fx will not work for
+    #other classification exercises
+    for y in tqdm(range(len(corpus_list)), desc="formatting distributions", leave=False):
+        scores = matrices[y].astype(np.int64)
+
+        # pad the shorter corpora with NaN, like a pd.Series of differing length would
+        if scores.shape[1] < n_row:
+            padded = np.full((n_word, n_row), np.nan)
+            padded[:, :scores.shape[1]] = scores
+            scores = padded
+
+        distrib[RANK_NAMES[y]] = scores.ravel()
+
+    return pd.DataFrame(distrib, index=np.tile(np.arange(n_row), n_word))
+
+
+@ins.timed('scan')
+def fuzzy_scan_compact(unknown_list, compact_list, jupyter=False, engine=None, workers=1, n_jobs=1,
+                       cache=None):
+    """This is a helper function for this module. It is the counterpart of fuzzy_scan for corpora in their compact
+    form (see compact_corpus). Each unique corpus word is only scored once, and its count is carried along so that
+    fuzzy_predict can weight the score distributions exactly as if every row had been scored.
+
+    :param unknown_list: This is a vector of words with an unknown quality ranking that we want to analyze and predict.
+    :param compact_list: This is a list of tuples (words, counts) as returned by compact_corpus, one per quality rank.
+    :param jupyter: This is a boolean that tells us if we are running in a jupyter nb. If so, we use a different tqdm
+        progress bar.
+    :param engine: This is an optional str ('rapidfuzz' or 'fuzzywuzzy') used to force a given scoring engine.
+    :param workers: This is the number of threads rapidfuzz is allowed to use (-1 uses all cores).
+    :param n_jobs: This is the number of processes the unknown words are split across (-1 uses all cores).
+    :param cache: This is an optional SimilarityCache, used to only score the pairs of words that were never seen.
+
+    :return: distrib: This is a long pandas df with one row per unknown word and unique corpus word, with the columns
+        word, rank (the name of the corpus), score and count.
+    """
+    # import necessary modules
+    import pandas as pd
+    import numpy as np
+
+    #note that if we are using a jupyter notebook we want to use a different tqdm call as it displays badly otherwise
+    if jupyter == True:
+        from tqdm import tqdm_notebook as tqdm
+    else:
+        from tqdm import tqdm
+
+    logger.info('analyzing %d unknown strings', len(unknown_list))
+
+    n_word = len(unknown_list)
     distrib = [] #initialize list to store loop vals
 
-    # loop over each unknown string
-    for x in tqdm(range(len(unknown_list)), desc="classifying unknown strings", leave=False):
-        unknown_str = unknown_list[x] #subset the list of strings to the current working string
-        print('analyzing...', unknown_str)
+    matrices = scan_matrices(unknown_list, [x[0] for x in compact_list], engine=engine, workers=workers, n_jobs=n_jobs,
+                             cache=cache)
+
+    for y in tqdm(range(len(compact_list)), desc="formatting distributions", leave=False):
+        words, counts = compact_list[y]
+        scores = matrices[y]
+
+        distrib.append(pd.DataFrame({'word': np.repeat(np.asarray(unknown_list, dtype=object), len(words)),
+                                     'rank': RANK_NAMES[y],
+                                     'score': scores.ravel(),
+                                     'count': np.tile(counts, n_word)}))
+
+    return (pd.concat(distrib, ignore_index=True))
+
+
+@ins.timed('scan', fused=True)
+def fuzzy_scan_predict(unknown_list, corpus_list, cutoff, dictionary, compact=False, engine=None, workers=1,
+                       n_jobs=1, cache=None, index=False, chunksize=1024):
+    """This is a helper function for this module. It fuses fuzzy_scan and fuzzy_predict: the scores of each chunk of
+    unknown words are reduced to the number of corpus words exceeding the cutoff as soon as they are computed, so the
+    long format distribution is never built. The predictions are identical to the ones of fuzzy_predict applied to the
+    output of fuzzy_scan, but the memory used only grows with the number of unknown words and unique corpus words.
+
+    :param unknown_list: This is a vector of words with an unknown quality ranking that we want to predict.
+    :param corpus_list: This is a list of vectors that contain all the words associated with each quality ranking level,
+        or a list of tuples (words, counts) as returned by compact_corpus if compact=True.
+    :param cutoff: This is the similarity score cutoff we think implies sufficient meaning in word similarity.
+    :param dictionary: This is a dictionary we can use to transform the rank names back into ordinal rank values.
+    :param compact: This is a boolean that tells us that the corpora are already in their compact form.
+    :param engine: This is an optional str ('rapidfuzz' or 'fuzzywuzzy') used to force a given scoring engine.
+    :param workers: This is the number of threads rapidfuzz is allowed to use within each process.
+    :param n_jobs: This is the number of processes the chunks of unknown words are split across (-1 uses all cores).
+    :param cache: This is an optional SimilarityCache, used to only score the pairs of words that were never seen.
+    :param index: This is a boolean that tells us to use a CorpusIndex (see model.fuzzy_index), which skips the pairs
+        that cannot reach the cutoff. It runs in the current process and does not use the cache.
+    :param chunksize: This is the number of unknown words scored at once, which bounds the memory of the score matrices.
+
+    :return: out: This is a pandas df with the probability of exceeding the cutoff for each rank and the prediction.
+    """
+    # import necessary modules
+    import os
+    import pandas as pd
+    import numpy as np
+    from multiprocessing import Pool
+
+    if compact != True:
+        corpus_list = compact_corpus(corpus_list)
+    var_list = list(dictionary.keys())
+    total = max([int(counts.sum()) for words, counts in corpus_list]) # the denominator fuzzy_predict uses
+
+    logger.info('predicting %d unknown strings', len(unknown_list))
+
+    if index == True:
+        import model.fuzzy_index as fi
+        exceed = fi.CorpusIndex(corpus_list, engine=engine).exceedance(unknown_list, cutoff)
+        return (predict_from_exceedance(exceed, total, var_list, dictionary))
+
+    if cache is not None:
+        if engine is not None and engine != cache.engine:
+            raise ValueError("The cache holds scores computed by " + cache.engine + ", not " + engine)
+        engine = cache.engine
+    if engine is None:
+        engine = default_engine()
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = os.cpu_count()
+
+    prepared = [prepare_strings(words) for words, counts in corpus_list]
+    # note that the score only depends on the processed string, so the counts are merged after processing
+    weights = [np.bincount(corpus_inv, weights=counts, minlength=len(choices))
+               for (choices, corpus_inv), (words, counts) in zip(prepared, corpus_list)]
+
+    chunks = [unknown_list[x:x + chunksize] for x in range(0, len(unknown_list), chunksize)]
+
+    if cache is None:
+        ins.count('pairs_scored', len(unknown_list) * sum([len(choices) for choices, corpus_inv in prepared]))
+    if cache is not None:
+        # the cached scan already splits the missing pairs across processes, so the chunks are reduced here
+        results = [] #initialize list to store loop vals
+        for chunk in chunks:
+            matrices = _scan_cached(chunk, prepared, engine, workers, n_jobs, cache)
+            results.append(np.column_stack([(matrices[y] > cutoff).dot(np.asarray(corpus_list[y][1], dtype=np.int64))
+                                            for y in range(len(prepared))]))
+    elif n_jobs == 1 or len(chunks) < 2:
+        results = [_exceed_prepared(chunk, prepared, weights, engine, workers, cutoff) for chunk in chunks]
+    else:
+        with Pool(processes=n_jobs, initializer=_init_exceed_worker,
+                  initargs=(prepared, weights, engine, workers, cutoff)) as pool:
+            results = pool.map(_exceed_worker, chunks, chunksize=1) # map returns the chunks in order
+
+    counts = np.concatenate(results) if results else np.zeros((0, len(corpus_list)), dtype=np.int64)
+    exceed = sort_words(pd.DataFrame(counts, columns=RANK_NAMES[:len(corpus_list)],
+                                     index=pd.Index(unknown_list, name='word')))
+
+    return (predict_from_exceedance(exceed, total, var_list, dictionary))
 
-        out = [] #initialize list to store loop vals
-        # loop over each corpus to compute similarity scores for all words in a given housing quality score
-        for y in range(len(corpus_list)):
-            print('~>corpus#', y)
-            corpus = corpus_list[y] #subset the list of corpora to the given corpus to compare against unknown word
 
-            scores = [] #initialize list to store loop vals
+def _init_exceed_worker(prepared, weights, engine, workers, cutoff):
+    """This is a helper function for fuzzy_scan_predict. It stores the prepared corpora and their weights in the
+    global state of the process, so that they only have to be sent to each process once.
+    """
+    global _EXCEED_STATE
+    _EXCEED_STATE = (prepared, weights, engine, workers, cutoff)
+
 
-            # loop over each word and compute the similarity score using fuzzywuzzy
-            for z in range(len(corpus)):
-                scores.append(fuzz.WRatio(unknown_str, corpus[z]))
+def _exceed_worker(unknown_chunk):
+    """This is a helper function for fuzzy_scan_predict. It reduces a chunk of unknown words to exceedance counts
+    against the corpora stored by _init_exceed_worker.
+    """
+    return (_exceed_prepared(unknown_chunk, *_EXCEED_STATE))
 
-            out.append(scores) # append scores to create a distribution for the entire corpus
 
-        # append distributions of scores
-        #TODO: make this call more flexible, currently the colnames are hard coded so this fx will not work for
-        #other classification exercises
-        distrib.append(pd.DataFrame({'word': unknown_str,
-                                     'natural': pd.Series(out[0]),
-                                     'rudimentary': pd.Series(out[1]),
-                                     'finished': pd.Series(out[2])
-                                     # note series method used to overcome differing lengths
-                                     }))
+def _exceed_prepared(unknown_chunk, prepared, weights, engine, workers, cutoff):
+    """This is a helper function for fuzzy_scan_predict. It scores a chunk of unknown words against each of the
+    prepared corpora, and returns an int array of shape (len(unknown_chunk), len(prepared)) holding the number of
+    corpus words (weighted by their counts) that score above the cutoff.
+    """
+    import numpy as np
+
+    queries, unknown_inv = prepare_strings(unknown_chunk)
+
+    out = np.zeros((len(queries), len(prepared)), dtype=np.int64)
+    for y in range(len(prepared)):
+        scores = score_prepared(queries, prepared[y][0], engine=engine, workers=workers)
+        out[:, y] = np.rint((scores > cutoff).dot(weights[y]))
+
+    return (out[unknown_inv])
+
+
+def apply_predictions(df, base_var, preds):
+    """This is a helper function for this module. It adds the predictions of each unknown word to the test rows of a
+    cross-validation df (train == 0). The rows are matched to the predictions through the integer codes of base_var
+    in the index of preds, rather than with a merge, and the output has the same rows and columns as
+    pd.merge(test, preds, left_on=base_var, right_on='word', how='left').
+
+    :param df: This is a pandas df with a train column, in which the test rows have an unknown rank.
+    :param base_var: This is a string indicating the variable whose string values were predicted.
+    :param preds: This is a pandas df of predictions indexed by word, as returned by fuzzy_predict.
+
+    :return: out: This is a pandas df of the test rows, with the columns of preds added.
+    """
+    import pandas as pd
 
-    return (pd.concat(distrib))
+    out = df[df['train'] == 0].reset_index(drop=True)
 
+    #code each test row by the position of its word in the predictions, -1 if it was not predicted
+    codes = pd.Categorical(out[base_var], categories=preds.index).codes
 
-def fuzzy_predict(df, var_list, grouping, cutoff, dictionary):
+    for col in preds.columns:
+        out[col] = pd.api.extensions.take(preds[col].values, codes, allow_fill=True)
+
+    return (out)
+
+
+@ins.timed('predict')
+def fuzzy_predict(df, var_list, grouping, cutoff, dictionary, weight=None):
     """This is a helper function for this module. It is used to predict the most likely ranking level for a given string
     based on the distribution of its similarity scores against each corpus from each ranking level. The cutoff level is
     used to determine which rank to predict, as the prediction will be based on which ranking level has the highest
@@ -108,9 +601,22 @@ def fuzzy_predict(df, var_list, grouping, cutoff, dictionary):
     :param grouping: This is a str value that specifies the column name that each distribtuion is grouped by.
     :param cutoff: This is the similarity score cutoff we think implies sufficient semantic meaning in word similarity.
     :param dictionary: This is a dictionary we can use to transform the column names back into an ordinal rank values.
+    :param weight: This is an optional str column name. If provided, df is expected to be the compact output of
+        fuzzy_scan_compact, and each score is weighted by the count stored in this column.
 
     :return: out: This is a pandas df which is a copy of the input df, but has a new column added of predicted rank.
     """
+    if weight is not None:
+        # sum the counts of the corpus words that exceed the cutoff for each word and rank
+        df = df.assign(exceed=(df['score'] > cutoff) * df[weight])
+        sums = df.groupby([grouping, 'rank'])[['exceed', weight]].sum()
+        exceed = sums['exceed'].unstack().reindex(columns=var_list).fillna(0).astype(int)
+
+        # note that the long format df is padded to the longest corpus, so that is the denominator of every rank
+        total = sums[weight].unstack().max(axis=1)
+
+        return (predict_from_exceedance(exceed, total, var_list, dictionary))
+
     # calculate the probability that a classification score exceeds cutoff
     out = df.groupby(grouping)[var_list].apply(lambda c: (c > cutoff).sum() / len(c))
 
@@ -119,6 +625,40 @@ def fuzzy_predict(df, var_list, grouping, cutoff, dictionary):
 
     return (out)
 
+def predict_from_exceedance(exceed, total, var_list, dictionary):
+    """This is a helper function for this module. It is used to turn the number of corpus words that score above the
+    cutoff into the same prediction df that fuzzy_predict returns.
+
+    :param exceed: This is a pandas df indexed by unknown word, with one int column per rank in var_list that counts
+        the corpus words exceeding the cutoff.
+    :param total: This is the denominator of the probabilities, either a scalar or a pandas series indexed like exceed.
+    :param var_list: This is a list of str column names, one for each rank.
+    :param dictionary: This is a dictionary we can use to transform the column names back into an ordinal rank values.
+
+    :return: out: This is a pandas df with the probability of exceeding the cutoff for each rank and the predicted rank.
+    """
+    # calculate the probability that a classification score exceeds cutoff
+    out = exceed[var_list].div(total, axis=0)
+    out.columns.name = None
+
+    # return column w/ max value and map to rank with dictionary
+    out['pred'] = out[var_list].idxmax(axis=1).map(dictionary)
+
+    return (out)
+
+def sort_words(exceed):
+    """This is a helper function for this module. It is used to order a df indexed by unknown word the way that
+    fuzzy_predict orders its output, by grouping on the words: the list of unknown words can mix strings with floats
+    (eg. NaN), which cannot be sorted with sort_index. Like in fuzzy_predict, the missing words are dropped and the
+    repeated words are only kept once.
+
+    :param exceed: This is a pandas df indexed by unknown word, with one row per word on the list of unknown words.
+
+    :return: exceed: This is the pandas df with one row per distinct word, in the order of fuzzy_predict.
+    """
+    # note that the rows of a repeated word are identical, so the first one is kept
+    return (exceed.groupby(level=exceed.index.name).first())
+
 def fuzzy_density(df, facet, var_list, color_list, variant="", cutoff=None):
     """This is a helper function for this module. It is used to generate density plots showing distributions of scores
     for each word, with the colors indicating each different quality ranking. A cutoff argument can be passed to draw a
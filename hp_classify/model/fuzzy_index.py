@@ -0,0 +1,157 @@
+import numpy as np
+import pandas as pd
+
+import instrument as ins
+import model.fuzzy as fz
+import prep.prep_tokens as tok
+
+
+class CorpusIndex(object):
+    """This is an index over the known-word corpora of the fuzzy model. fuzzy_predict only needs to know how many
+    corpus words score above the cutoff for each rank, so the index uses a cheap upper bound on the WRatio score of
+    every pair to skip the pairs that cannot reach the cutoff, and only computes the full score for the rest. The
+    exceedance counts it returns are exact.
+
+    The bound is built from the number of characters two processed strings have in common (c), read from
+    per-character inverted lists. Every component of WRatio matches at most c characters, so no component can score
+    above 2c / (c + n) where n is the length of the shorter string once its repeated tokens are removed. The only
+    exception is the partial token ratio, which reaches 100 (x 0.9 x 0.95) as soon as the strings share a token and
+    have very different lengths, so those pairs are looked up in per-token inverted lists and always kept.
+    """
+
+    def __init__(self, compact_list, engine=None):
+        """This function builds the index.
+
+        :param compact_list: This is a list of tuples (words, counts) as returned by fz.compact_corpus, one per rank.
+        :param engine: This is an optional str ('rapidfuzz' or 'fuzzywuzzy') used to force a given scoring engine.
+        """
+        if engine is None:
+            engine = fz.default_engine()
+        self.engine = engine
+
+        self.corpora = [] #initialize list to store loop vals
+        for words, counts in compact_list:
+            processed, inverse = fz.prepare_strings(words)
+            # note that the score only depends on the processed string, so the counts are merged after processing.
+            # distinct words can share a processed string (eg. 'brick' and 'Brick!'), so they are merged as well
+            codes, choices = pd.factorize(pd.Series(processed, dtype=object))
+            weights = np.bincount(codes[inverse], weights=counts, minlength=len(choices)).astype(np.int64)
+            self.corpora.append(_build_postings(list(choices), weights))
+
+        # the long format distribution is padded to the longest corpus, so that is the denominator of every rank
+        self.total = max([int(x['counts'].sum()) for x in self.corpora])
+
+        self.n_scored = 0
+        self.n_pruned = 0
+
+    def exceedance(self, unknown_list, cutoff):
+        """This function counts, for each unknown word and each rank, how many corpus words score above the cutoff.
+
+        :param unknown_list: This is a vector of words with an unknown quality ranking that we want to predict.
+        :param cutoff: This is the similarity score cutoff we think implies sufficient meaning in word similarity.
+
+        :return: exceed: This is a pandas df indexed by unknown word, with one int column of counts per rank.
+        """
+        # a rounded WRatio can only exceed the cutoff if the raw score is at least this high
+        threshold = np.floor(cutoff) + .5 - 1e-9
+        n_scored, n_pruned = self.n_scored, self.n_pruned
+
+        out = np.zeros((len(unknown_list), len(self.corpora)), dtype=np.int64)
+        for x in range(len(unknown_list)):
+            query = fz.process_string(unknown_list[x])
+            if len(query) == 0:
+                continue # an empty string scores 0 against everything
+
+            for y in range(len(self.corpora)):
+                corpus = self.corpora[y]
+                candidates = np.flatnonzero(_upper_bound(query, corpus) >= threshold)
+
+                self.n_scored += len(candidates)
+                self.n_pruned += len(corpus['counts']) - len(candidates)
+                if len(candidates) == 0:
+                    continue
+
+                choices = [corpus['strings'][z] for z in candidates]
+                scores = fz.score_prepared([query], choices, engine=self.engine, score_cutoff=threshold)[0]
+                out[x, y] = corpus['counts'][candidates][scores > cutoff].sum()
+
+        ins.count('pairs_scored', self.n_scored - n_scored)
+        ins.count('pairs_pruned', self.n_pruned - n_pruned)
+
+        exceed = pd.DataFrame(out, columns=fz.RANK_NAMES[:len(self.corpora)],
+                              index=pd.Index(unknown_list, name='word'))
+
+        return (fz.sort_words(exceed))
+
+    def predict(self, unknown_list, cutoff, dictionary):
+        """This function predicts the most likely rank of each unknown word. The output is identical to the one of
+        fz.fuzzy_predict applied to the full distribution of scores.
+
+        :param unknown_list: This is a vector of words with an unknown quality ranking that we want to predict.
+        :param cutoff: This is the similarity score cutoff we think implies sufficient meaning in word similarity.
+        :param dictionary: This is a dictionary we can use to transform the rank names back into ordinal rank values.
+
+        :return: out: This is a pandas df with the probability of exceeding the cutoff for each rank and the prediction.
+        """
+        exceed = self.exceedance(unknown_list, cutoff)
+
+        return (fz.predict_from_exceedance(exceed, self.total, list(exceed.columns), dictionary))
+
+
+def _build_postings(choices, counts):
+    """This is a helper function for CorpusIndex. It builds the inverted lists of a single corpus: the number of
+    occurrences of each character in each string, and the list of strings containing each token.
+    """
+    n = len(choices)
+    chars = {} #initialize dict to store loop vals
+    for x in range(n):
+        for char in set(choices[x]):
+            if char not in chars:
+                chars[char] = np.zeros(n, dtype=np.int16)
+            chars[char][x] = choices[x].count(char)
+
+    # note that the choices are unique processed strings, so the rows of the token table are the choices
+    tokens = tok.TokenTable(choices)
+
+    return {'strings': choices,
+            'counts': counts,
+            'lengths': np.array([len(x) for x in choices], dtype=np.int64),
+            'norm_lengths': tokens.set_lengths(),
+            'chars': chars,
+            'tokens': tokens.postings()}
+
+
+def _upper_bound(query, corpus):
+    """This is a helper function for CorpusIndex. It computes an upper bound on the WRatio score between a processed
+    query and every string of a corpus.
+    """
+    n = len(corpus['strings'])
+
+    # count the characters in common with every corpus string, using only the lists of the query's characters
+    common = np.zeros(n, dtype=np.int64)
+    for char in set(query):
+        if char in corpus['chars']:
+            common += np.minimum(corpus['chars'][char], query.count(char))
+
+    shorter = np.minimum(corpus['norm_lengths'], _set_length(query))
+    denom = common + shorter
+    bound = np.divide(200. * common, denom, out=np.zeros(n), where=denom > 0)
+
+    # strings that share a token and have very different lengths can reach the scaled partial token ratio
+    len_ratio = np.maximum(corpus['lengths'], len(query)) / np.maximum(np.minimum(corpus['lengths'], len(query)), 1)
+    shared = np.zeros(n, dtype=bool)
+    for token in set(query.split()):
+        if token in corpus['tokens']:
+            shared[corpus['tokens'][token]] = True
+    bound[shared & (len_ratio >= 1.5)] = np.maximum(bound[shared & (len_ratio >= 1.5)], 100 * .9 * .95)
+
+    return (np.minimum(bound, 100))
+
+
+def _set_length(text):
+    """This is a helper function for CorpusIndex. It returns the length of a string once its whitespace is collapsed
+    and its repeated tokens are dropped, which is the shortest form the token ratios of WRatio compare.
+    """
+    tokens = set(text.split())
+
+    return (sum([len(x) for x in tokens]) + max(len(tokens) - 1, 0))
@@ -9,28 +9,40 @@ import matplotlib.pyplot as plt
 import pandas as pd
 import seaborn as sn
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.externals import joblib
+try:
+    from sklearn.externals import joblib
+except ImportError:
+    import joblib # sklearn >= 0.23 no longer ships its own copy
 import sys
 sys.path.append('../hp_classify')
+import instrument as ins
 import prep.prep_data as prep
 
 
-def rfc_model(x, y, label):
+@ins.timed('fit')
+def rfc_model(x, y, label, save=True, n_jobs=1, **params):
     """This function builds a random forest model and saves the model as .sav in the current directory.
+    See model.rfc_search to tune the parameters of the model.
 
     :param x: Feature vector
     :param y: Label
     :param label: This is the label specifed under prediction
+    :param save: Set to False to skip writing the .sav file (default True)
+    :param n_jobs: This is the number of cores used to grow the trees (-1 uses all cores, default 1)
+    :param params: These are optional RandomForestClassifier parameters, eg. the best ones found by rfc_search
+        (default n_estimators=17, max_features=2)
 
     :return: RFC: Return the built model
     """
     #build model
-    RFC = RandomForestClassifier(n_estimators=17 , random_state=0, max_features=2)
+    params = dict(dict(n_estimators=17, random_state=0, max_features=2), **params)
+    RFC = RandomForestClassifier(n_jobs=n_jobs, **params)
     #data fitting
     RFC.fit(x, y)
     # save the model to directory
-    filename = 'finalized_'+label+'_model.sav'
-    joblib.dump(RFC, filename)
+    if save:
+        filename = 'finalized_'+label+'_model.sav'
+        joblib.dump(RFC, filename)
     return RFC
     
 def confusion_matrix(y, pred, plot=False):
@@ -0,0 +1,213 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import instrument as ins
+import prep.prep_data as prep
+
+logger = ins.get_logger(__name__)
+
+# folds used by the processes of rfc_search, set once by _init_search_worker
+_SEARCH_FOLDS = None
+
+
+@ins.timed('features')
+def build_folds(df, features, LABEL, n_folds=3, train_frac=.75, seed=0, cache_dir=None, meta_path=None):
+    """This function builds the feature matrices of each cross-validation fold once, so that every configuration of
+    the search is trained and tested on exactly the same data. Each fold is a random split of the rows into training
+    and test sets, drawn like prep.train_test_split draws it. If cache_dir is provided, the folds are stored there and
+    reloaded by the next call with the same data and arguments, instead of being rebuilt.
+
+    :param df: This is the dataframe of features and ranks, as returned by prep.ranking.
+    :param features: This is the list of specified features (see prep.extract_features).
+    :param LABEL: This is the label specified under prediction (eg. roof, wall, floor).
+    :param n_folds: This is the number of folds to build.
+    :param train_frac: This is the fraction of the rows used for training in each fold. Default = 75%
+    :param seed: This is the seed of the random splits. Fold #i uses seed + i.
+    :param cache_dir: This is an optional directory where the folds are cached as .npz files.
+    :param meta_path: This is an optional path to the meta.json used to encode iso3 (see prep.encode_features).
+
+    :return: folds: This is a list of dicts holding the float32 arrays x_train, x_test and the int arrays y_train,
+        y_test of each fold.
+    """
+    import hashlib
+
+    path = None
+    if cache_dir is not None:
+        # key the cache by the content of the data and by every argument that changes the folds
+        key = hashlib.sha1(pd.util.hash_pandas_object(df[features + [LABEL + '_rank']], index=False).values)
+        key.update(repr((features, LABEL, n_folds, train_frac, seed, meta_path)).encode())
+        path = os.path.join(cache_dir, 'folds_' + LABEL + '_' + key.hexdigest()[:16] + '.npz')
+
+        if os.path.exists(path):
+            logger.info('loading cached folds from %s', path)
+            with np.load(path) as cached:
+                return [dict((k, cached[k + '_' + str(i)]) for k in ['x_train', 'x_test', 'y_train', 'y_test'])
+                        for i in range(n_folds)]
+
+    # encode iso3 with meta.json, like the models are fed at inference time
+    x = prep.encode_features(df, features, meta_path=meta_path)
+    y = df[LABEL + '_rank'].values.astype(np.int8)
+
+    folds = [] #initialize list to store loop vals
+    for i in range(n_folds):
+        train = np.random.RandomState(seed + i).uniform(0, 1, len(df)) <= train_frac
+        folds.append({'x_train': x[train], 'x_test': x[~train], 'y_train': y[train], 'y_test': y[~train]})
+
+    if path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        arrays = dict((k + '_' + str(i), folds[i][k]) for i in range(n_folds) for k in folds[i])
+        tmp_path = path + '.' + str(os.getpid()) + '.tmp.npz'
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path) # note that the rename is atomic, so a reader never sees a partial file
+
+    return folds
+
+
+@ins.timed('search')
+def rfc_search(folds, param_grid, min_estimators=4, max_estimators=64, eta=3, n_jobs=-1, seed=0):
+    """This function searches the hyperparameters of the random forest with successive halving. Every configuration
+    is first trained with a small number of trees on every fold. Only the best 1/eta of the configurations are kept
+    for the next round, which trains eta times more trees, and so on until one configuration is left or the maximum
+    number of trees is reached. The (configuration, fold) fits of each round are run in a pool of processes.
+
+    :param folds: This is a list of folds as returned by build_folds.
+    :param param_grid: This is a dict of lists of RandomForestClassifier parameters (eg. {'max_features': [1, 2]}),
+        or a list of such dicts. Every combination is a configuration. n_estimators is set by the search.
+    :param min_estimators: This is the number of trees of the first round.
+    :param max_estimators: This is the largest number of trees of a round.
+    :param eta: This is the factor by which the number of configurations is divided (and the trees multiplied) at each
+        round.
+    :param n_jobs: This is the number of processes to run the fits in (-1 uses all cores, 1 runs them here).
+    :param seed: This is the random_state of every forest.
+
+    :return: results: This is a pandas df with one row per fit, with the columns config, round, n_estimators, fold,
+        accuracy, fit_time and predict_time, plus one column per parameter.
+    :return: summary: This is a pandas df with one row per configuration and round, with the mean accuracy over the
+        folds and the total time spent on its fits, sorted from the best configuration of the last round.
+    :return: best: This is a dict of the parameters of the best configuration, including n_estimators.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from sklearn.model_selection import ParameterGrid
+
+    configs = list(ParameterGrid(param_grid))
+    alive = list(range(len(configs)))
+
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = os.cpu_count()
+
+    executor = None
+    if n_jobs > 1:
+        # note that the folds are sent to each process once, when it starts
+        executor = ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_search_worker, initargs=(folds,))
+
+    rows = [] #initialize list to store loop vals
+    n_estimators = min_estimators
+    n_round = 0
+    try:
+        while True:
+            logger.info('round %d: %d configurations with %d trees', n_round, len(alive), n_estimators)
+
+            tasks = [(c, dict(configs[c], n_estimators=n_estimators, random_state=seed), f)
+                     for c in alive for f in range(len(folds))]
+            if executor is None:
+                fits = [_fit_config(task, folds) for task in tasks]
+            else:
+                fits = list(executor.map(_search_worker, tasks))
+
+            ins.count('fits', len(tasks))
+            for (c, params, f), (accuracy, fit_time, predict_time) in zip(tasks, fits):
+                rows.append(dict(configs[c], config=c, round=n_round, n_estimators=n_estimators, fold=f,
+                                 accuracy=accuracy, fit_time=fit_time, predict_time=predict_time))
+
+            if len(alive) == 1 or n_estimators * eta > max_estimators:
+                break
+
+            # keep the best 1/eta of the configurations (the first ones in case of a tie)
+            scores = pd.DataFrame(rows[-len(tasks):]).groupby('config')['accuracy'].mean()
+            ranked = scores.reindex(alive).sort_values(ascending=False, kind='mergesort')
+            alive = list(ranked.index[:max(1, int(np.ceil(len(alive) / eta)))])
+
+            n_estimators = n_estimators * eta
+            n_round = n_round + 1
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    results = pd.DataFrame(rows)
+    grouped = results.groupby(['round', 'config', 'n_estimators'])
+    summary = pd.DataFrame({'accuracy': grouped['accuracy'].mean(),
+                            'accuracy_std': grouped['accuracy'].std(),
+                            'fit_time': grouped['fit_time'].sum(),
+                            'predict_time': grouped['predict_time'].sum()}).reset_index()
+    summary = summary.sort_values(['round', 'accuracy'], ascending=[False, False], kind='mergesort')
+    summary = summary.reset_index(drop=True)
+
+    best = dict(configs[int(summary['config'].iloc[0])], n_estimators=int(summary['n_estimators'].iloc[0]))
+
+    return results, summary, best
+
+
+@ins.timed('fit')
+def rfc_train_best(x, y, best, n_jobs=-1, seed=0, filename=None):
+    """This function trains the final model with the best configuration found by rfc_search, on all the cores of the
+    machine, and only writes it to disk if a filename is provided.
+
+    :param x: Feature vector
+    :param y: Label
+    :param best: This is the dict of parameters returned by rfc_search.
+    :param n_jobs: This is the number of cores used to grow the trees (-1 uses all cores).
+    :param seed: This is the random_state of the forest.
+    :param filename: This is an optional path where the model is saved as a .sav file.
+
+    :return: RFC: Return the built model
+    """
+    from sklearn.ensemble import RandomForestClassifier
+    try:
+        from sklearn.externals import joblib
+    except ImportError:
+        import joblib # sklearn >= 0.23 no longer ships its own copy
+
+    RFC = RandomForestClassifier(n_jobs=n_jobs, **dict(dict(random_state=seed), **best))
+    RFC.fit(x, y)
+
+    if filename is not None:
+        joblib.dump(RFC, filename)
+
+    return RFC
+
+
+def _init_search_worker(folds):
+    """This is a helper function for rfc_search. It stores the folds in the global state of the process.
+    """
+    global _SEARCH_FOLDS
+    _SEARCH_FOLDS = folds
+
+
+def _search_worker(task):
+    """This is a helper function for rfc_search. It fits a configuration on a fold stored by _init_search_worker.
+    """
+    return _fit_config(task, _SEARCH_FOLDS)
+
+
+def _fit_config(task, folds):
+    """This is a helper function for rfc_search. It trains a single forest on the training set of a fold, and returns
+    its accuracy on the test set and the time spent fitting and predicting.
+    """
+    from sklearn.ensemble import RandomForestClassifier
+
+    c, params, f = task
+    fold = folds[f]
+
+    start = time.perf_counter()
+    RFC = RandomForestClassifier(n_jobs=1, **params)
+    RFC.fit(fold['x_train'], fold['y_train'])
+    fit_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    accuracy = float((RFC.predict(fold['x_test']) == fold['y_test']).mean())
+    predict_time = time.perf_counter() - start
+
+    return accuracy, fit_time, predict_time
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local prediction server for the roof/wall/floor random forest models.
+
+The models and the iso3 encoding of meta.json are loaded once when the server starts. Each request is put on a
+queue, and a single thread gathers the requests that arrive within a few milliseconds of each other into one batch,
+so that every model is called once per batch with a vectorized predict.
+
+usage: python model/rfc_serve.py --model-dir ../examples --data-dir ../data --port 8765
+
+    POST /predict/roof  {"records": [{"int_year": 2010, "housing_wall_num": 31, "housing_floor_num": 34,
+                                      "iso3": "BEN"}]}
+    GET  /metrics
+"""
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # when run as a script
+import instrument as ins
+
+logger = ins.get_logger(__name__)
+
+LABELS = ['roof', 'wall', 'floor']
+
+
+class ModelStore(object):
+    """This is the set of models served, along with the iso3 encoding used to build their features.
+    """
+
+    def __init__(self, models, iso_dict):
+        """This function creates the store.
+
+        :param models: This is a dict mapping each label (eg. roof) to a fitted model.
+        :param iso_dict: This is a dict mapping each iso3 code to its integer encoding (meta.json[3]).
+        """
+        self.models = models
+        self.iso_dict = iso_dict
+
+    @classmethod
+    def load(cls, model_dir, data_dir, labels=LABELS):
+        """This function loads the finalized_<label>_model.sav files saved by rfc_build.rfc_model and meta.json.
+
+        :param model_dir: This is the directory holding the .sav files. The labels without a file are not served.
+        :param data_dir: This is the data directory path, holding meta.json.
+        :param labels: This is the list of labels to load.
+
+        :return: store: This is the ModelStore.
+        """
+        try:
+            from sklearn.externals import joblib
+        except ImportError:
+            import joblib # sklearn >= 0.23 no longer ships its own copy
+
+        models = {} #initialize dict to store loop vals
+        for label in labels:
+            filename = os.path.join(model_dir, 'finalized_' + label + '_model.sav')
+            if os.path.exists(filename):
+                logger.info('loading %s', filename)
+                models[label] = joblib.load(filename)
+
+        #read in meta data json file , contains category encoding for iso3
+        with open(os.path.join(data_dir, 'meta.json')) as f:
+            meta_data = json.load(f)
+
+        return cls(models, meta_data[3])
+
+    def features(self, label, records):
+        """This function builds the feature matrix of a batch of records, in the order of the features that
+        prep.extract_features returns for the label: int_year, the _num columns of the two other labels, iso3, then
+        the ranks of the two other labels.
+
+        :param label: This is the label to predict.
+        :param records: This is a list of dicts, each holding int_year, iso3 and the _num codes of the other labels.
+
+        :return: x: This is a float numpy array with one row per record.
+        :return: valid: This is a boolean numpy array, False for the records that cannot be predicted (a code outside
+            10-35, an unknown iso3 or a missing field).
+        """
+        others = [x for x in LABELS if x != label]
+        num_cols = ['housing_' + x + '_num' for x in others]
+
+        x = np.full((len(records), 4 + len(others)), np.nan)
+        for i in range(len(records)):
+            record = records[i]
+            try:
+                x[i, 0] = float(record['int_year'])
+                x[i, 1:1 + len(others)] = [float(record[col]) for col in num_cols]
+                x[i, 1 + len(others)] = self.iso_dict[record['iso3']]
+            except (KeyError, TypeError, ValueError):
+                pass # the row is left missing, so it is flagged as invalid below
+
+        # rank the codes by the digit in tens, like prep.ranking, and flag the codes that it would drop
+        nums = x[:, 1:1 + len(others)]
+        x[:, 2 + len(others):] = np.floor(nums / 10)
+        valid = ~np.isnan(x).any(axis=1) & ((nums >= 10) & (nums <= 35)).all(axis=1)
+
+        return x, valid
+
+    def predict(self, label, records):
+        """This function predicts the rank of a batch of records with a single call of the model.
+
+        :param label: This is the label to predict.
+        :param records: This is a list of dicts (see features).
+
+        :return: preds: This is a list with the predicted rank of each record, or None if it cannot be predicted.
+        """
+        x, valid = self.features(label, records)
+
+        preds = [None] * len(records)
+        if valid.any():
+            ans = self.models[label].predict(x[valid])
+            for i, pred in zip(np.flatnonzero(valid), ans):
+                preds[i] = int(pred)
+
+        return preds
+
+
+class MicroBatcher(object):
+    """This is the queue of pending requests. A single thread takes the first request off the queue, waits at most
+    max_wait seconds for more of them (up to max_batch records), then predicts the whole batch with one call per label.
+    It also records the latency of each request and the size of each batch.
+    """
+
+    def __init__(self, store, max_batch=512, max_wait=.002, window=10000):
+        """This function creates the queue and starts its thread.
+
+        :param store: This is the ModelStore used to predict.
+        :param max_batch: This is the largest number of records predicted in a batch.
+        :param max_wait: This is the longest time, in seconds, that the first request of a batch waits for others.
+        :param window: This is the number of most recent requests whose latency is kept for the metrics.
+        """
+        self.store = store
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=window)
+        self.n_request = 0
+        self.n_record = 0
+        self.n_batch = 0
+        self.started = time.time()
+
+        self.thread = threading.Thread(target=self._run, name='micro-batcher')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, label, records):
+        """This function queues a request and waits for its predictions.
+
+        :param label: This is the label to predict.
+        :param records: This is a list of dicts (see ModelStore.features).
+
+        :return: preds: This is a list with the predicted rank of each record, or None if it cannot be predicted.
+        """
+        if label not in self.store.models:
+            class UnknownLabelException(Exception):
+                """Custom exception class.
+
+                This exception is raised when no model is loaded for the requested label.
+
+                """
+                pass
+
+            raise UnknownLabelException("No model loaded for " + str(label))
+
+        task = {'label': label, 'records': records, 'done': threading.Event(), 'start': time.perf_counter()}
+        self.queue.put(task)
+        task['done'].wait()
+
+        if 'error' in task:
+            raise task['error']
+
+        return task['preds']
+
+    def metrics(self):
+        """This function returns the latency and throughput metrics of the server.
+
+        :return: metrics: This is a dict of the metrics.
+        """
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            uptime = time.time() - self.started
+            metrics = {'uptime_s': uptime,
+                       'requests': self.n_request,
+                       'records': self.n_record,
+                       'batches': self.n_batch,
+                       'mean_batch_records': self.n_record / self.n_batch if self.n_batch else 0.,
+                       'requests_per_s': self.n_request / uptime if uptime > 0 else 0.,
+                       'records_per_s': self.n_record / uptime if uptime > 0 else 0.}
+
+        for q in [50, 95, 99]:
+            metrics['latency_p' + str(q) + '_ms'] = float(np.percentile(latencies, q)) if len(latencies) else None
+
+        return metrics
+
+    def _run(self):
+        """This is a helper function for MicroBatcher. It is the loop of the batching thread.
+        """
+        while True:
+            batch = [self.queue.get()]
+            n_record = len(batch[0]['records'])
+            deadline = time.perf_counter() + self.max_wait
+
+            # gather the requests that arrive before the deadline, up to max_batch records
+            while n_record < self.max_batch:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    task = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(task)
+                n_record += len(task['records'])
+
+            self._predict_batch(batch)
+
+    def _predict_batch(self, batch):
+        """This is a helper function for MicroBatcher. It predicts every request of a batch with one call per label,
+        then hands the predictions back to the waiting requests.
+        """
+        for label in set([x['label'] for x in batch]):
+            tasks = [x for x in batch if x['label'] == label]
+            records = [record for task in tasks for record in task['records']]
+            try:
+                preds = self.store.predict(label, records)
+            except Exception as error:
+                for task in tasks:
+                    task['error'] = error
+                continue
+
+            # split the predictions back between the requests, in order
+            start = 0
+            for task in tasks:
+                task['preds'] = preds[start:start + len(task['records'])]
+                start += len(task['records'])
+
+        end = time.perf_counter()
+        with self.lock:
+            self.n_batch += 1
+            for task in batch:
+                self.n_request += 1
+                self.n_record += len(task['records'])
+                self.latencies.append(end - task['start'])
+
+        for task in batch:
+            task['done'].set()
+
+
+def make_server(batcher, host='127.0.0.1', port=8765):
+    """This function builds the HTTP server. Each connection is handled in its own thread, which waits on the
+    MicroBatcher for its predictions.
+
+    :param batcher: This is the MicroBatcher used to predict.
+    :param host: This is the address to listen on. Default = localhost only.
+    :param port: This is the port to listen on (0 picks a free port).
+
+    :return: server: This is the ThreadingHTTPServer, not yet started (see serve_forever).
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class PredictionHandler(BaseHTTPRequestHandler):
+        """This is the handler of the requests: POST /predict/<label> and GET /metrics.
+        """
+        protocol_version = 'HTTP/1.1' # keep the connections alive between requests
+
+        def _reply(self, code, body):
+            data = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/metrics':
+                self._reply(200, batcher.metrics())
+            elif self.path == '/health':
+                self._reply(200, {'models': sorted(batcher.store.models)})
+            else:
+                self._reply(404, {'error': 'unknown path ' + self.path})
+
+        def do_POST(self):
+            if not self.path.startswith('/predict/'):
+                self._reply(404, {'error': 'unknown path ' + self.path})
+                return
+
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                records = body['records'] if 'records' in body else [body]
+                preds = batcher.submit(self.path[len('/predict/'):], records)
+            except Exception as error:
+                self._reply(400, {'error': type(error).__name__ + ': ' + str(error)})
+                return
+
+            self._reply(200, {'pred': preds})
+
+        def log_message(self, format, *args):
+            pass # the metrics endpoint replaces the per-request log
+
+    server = ThreadingHTTPServer((host, port), PredictionHandler)
+    server.daemon_threads = True
+
+    return server
+
+
+def main():
+    """This function starts the server from the command line.
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Serve the roof/wall/floor rank models on localhost.')
+    parser.add_argument('--model-dir', default='.', help='directory of the finalized_<label>_model.sav files')
+    parser.add_argument('--data-dir', default='../data', help='directory of meta.json')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--max-batch', type=int, default=512, help='largest number of records in a batch')
+    parser.add_argument('--max-wait-ms', type=float, default=2., help='longest wait for a batch to fill up')
+    args = parser.parse_args()
+
+    ins.configure_logging('INFO')
+    store = ModelStore.load(args.model_dir, args.data_dir)
+    batcher = MicroBatcher(store, max_batch=args.max_batch, max_wait=args.max_wait_ms / 1000)
+    server = make_server(batcher, host=args.host, port=args.port)
+
+    logger.info('serving %s on http://%s:%d', sorted(store.models), args.host, server.server_address[1])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import sqlite3
+
+import numpy as np
+
+import model.fuzzy as fz
+
+
+class SimilarityCache(object):
+    """This is a persistent store of the similarity scores between pairs of strings. It is used by the fuzzy scan to
+    only compute the pairs of words it has never seen before, so that repeated cross-validation runs, threshold sweeps
+    and reruns of the same analysis reuse the scores computed by the previous ones.
+
+    The scores are stored in a SQLite database, either on disk or in memory, and are keyed by the name and version of
+    the scorer and by the two processed strings.
+    """
+
+    def __init__(self, path=':memory:', engine=None, scorer='WRatio'):
+        """This function opens (or creates) the cache.
+
+        :param path: This is the path of the SQLite database file. Default = an in-memory database.
+        :param engine: This is the scoring engine ('rapidfuzz' or 'fuzzywuzzy') whose scores are stored. Scores stored
+            by another engine, or another version of it, are ignored. Default = fz.default_engine().
+        :param scorer: This is the name of the scoring function whose scores are stored.
+        """
+        if engine is None:
+            engine = fz.default_engine()
+
+        self.path = path
+        self.engine = engine
+        self.scorer = scorer
+        self.key = scorer + '/' + engine_version(engine)
+        self.hits = 0
+        self.misses = 0
+
+        # note that the timeout lets several processes wait for each other's writes to the same file
+        self.con = sqlite3.connect(path, timeout=60)
+        self.con.execute("CREATE TABLE IF NOT EXISTS scores (scorer TEXT, s1 TEXT, s2 TEXT, score INTEGER, "
+                         "PRIMARY KEY (scorer, s1, s2)) WITHOUT ROWID")
+
+    def get(self, s1, choices):
+        """This function looks up the scores between a string and a list of strings.
+
+        :param s1: This is the string that every choice is compared to.
+        :param choices: This is a list of strings.
+
+        :return: scores: This is an int numpy array holding the cached score of each choice, or -1 if it is missing.
+        """
+        known = dict(self.con.execute("SELECT s2, score FROM scores WHERE scorer = ? AND s1 = ?", (self.key, s1)))
+        scores = np.array([known.get(x, -1) for x in choices], dtype=np.int16)
+
+        n_hit = int((scores >= 0).sum())
+        self.hits += n_hit
+        self.misses += len(scores) - n_hit
+
+        return scores
+
+    def put(self, s1, choices, scores):
+        """This function stores the scores between a string and a list of strings.
+
+        :param s1: This is the string that every choice was compared to.
+        :param choices: This is a list of strings.
+        :param scores: This is a vector of the scores of each choice.
+        """
+        self.con.executemany("INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?)",
+                             [(self.key, s1, x, int(y)) for x, y in zip(choices, scores)])
+
+    def commit(self):
+        """This function writes the pending scores to the database.
+        """
+        self.con.commit()
+
+    def __len__(self):
+        return self.con.execute("SELECT COUNT(*) FROM scores WHERE scorer = ?", (self.key,)).fetchone()[0]
+
+    def close(self):
+        """This function commits the pending scores and closes the database.
+        """
+        self.con.commit()
+        self.con.close()
+
+
+def engine_version(engine):
+    """This is a helper function for this module. It returns the version string of a scoring engine, which is used
+    to key the cache so that an upgrade of the engine never reuses stale scores.
+
+    :param engine: This is a str ('rapidfuzz' or 'fuzzywuzzy') indicating the scoring engine.
+
+    :return: version: This is a str combining the name and version of the engine.
+    """
+    module = __import__(engine)
+
+    return engine + '-' + str(getattr(module, '__version__', 'unknown'))
@@ -0,0 +1,185 @@
+import numpy as np
+import pandas as pd
+
+import instrument as ins
+import model.fuzzy as fz
+
+logger = ins.get_logger(__name__)
+
+
+class TfidfIndex(object):
+    """This is a third scanning backend for the fuzzy model, next to the WRatio scores of fuzzy_scan and the WordNet
+    scores of semantic_similarity_scan. Every known word is vectorized once as a character n-gram TF-IDF vector, and
+    the similarity between two words is the cosine of their vectors, scaled to 0-100 like the WRatio scores. All the
+    unknown words are then scored against a corpus with a single sparse matrix product.
+
+    Note that the n-grams are taken within the words (char_wb), so a typo only changes the few n-grams around it.
+    """
+
+    def __init__(self, compact_list, ngram_range=(2, 4), chunksize=2048):
+        """This function vectorizes the corpora.
+
+        :param compact_list: This is a list of tuples (words, counts) as returned by fz.compact_corpus, one per rank.
+        :param ngram_range: This is a tuple of the shortest and longest character n-grams used to vectorize the words.
+        :param chunksize: This is the number of unknown words scored at once, which bounds the memory of the products.
+        """
+        from sklearn.feature_extraction.text import TfidfVectorizer
+
+        self.chunksize = chunksize
+
+        prepared = []
+        for words, counts in compact_list:
+            choices, inverse = fz.prepare_strings(words)
+            # note that the score only depends on the processed string, so the counts are merged after processing
+            weights = np.bincount(inverse, weights=counts, minlength=len(choices))
+            prepared.append((choices, weights))
+
+        # fit a single vocabulary and idf on the unique words of every corpus
+        self.vectorizer = TfidfVectorizer(analyzer='char_wb', ngram_range=ngram_range, lowercase=False,
+                                          dtype=np.float32)
+        self.vectorizer.fit(sorted(set([x for choices, weights in prepared for x in choices])))
+
+        self.corpora = [] #initialize list to store loop vals
+        for choices, weights in prepared:
+            # store the transposed matrix, so that each product is a plain csr x csc
+            self.corpora.append({'strings': np.asarray(choices, dtype=object),
+                                 'counts': weights,
+                                 'matrix': self.vectorizer.transform(choices).T.tocsc()})
+
+        # the long format distribution is padded to the longest corpus, so that is the denominator of every rank
+        self.total = max([int(x['counts'].sum()) for x in self.corpora])
+
+    def transform(self, unknown_list):
+        """This function vectorizes a list of unknown words.
+
+        :param unknown_list: This is a vector of words with an unknown quality ranking.
+
+        :return: queries: This is a scipy csr matrix with one row per unknown word.
+        """
+        return self.vectorizer.transform([fz.process_string(x) for x in unknown_list])
+
+    def score_matrices(self, unknown_list):
+        """This function computes the similarity scores between the unknown words and every word of each corpus.
+
+        :param unknown_list: This is a vector of words with an unknown quality ranking.
+
+        :return: matrices: This is a list of sparse matrices, one per rank, of shape len(unknown_list) x the number of
+            unique processed words of the corpus. The pairs that have no n-gram in common are not stored (score 0).
+        """
+        queries = self.transform(unknown_list)
+
+        return [queries.dot(corpus['matrix']) * 100 for corpus in self.corpora]
+
+    def exceedance(self, unknown_list, cutoff):
+        """This function counts, for each unknown word and each rank, how many corpus words score above the cutoff.
+
+        :param unknown_list: This is a vector of words with an unknown quality ranking that we want to predict.
+        :param cutoff: This is the similarity score cutoff (0-100) we think implies sufficient meaning in similarity.
+
+        :return: exceed: This is a pandas df indexed by unknown word, with one int column of counts per rank.
+        """
+        out = np.zeros((len(unknown_list), len(self.corpora)), dtype=np.int64)
+
+        for start in range(0, len(unknown_list), self.chunksize):
+            matrices = self.score_matrices(unknown_list[start:start + self.chunksize])
+            for y in range(len(self.corpora)):
+                # keep a 1 for each pair above the cutoff, then weight the pairs by the corpus counts in one product
+                exceed = matrices[y].tocsr()
+                exceed.data = (exceed.data > cutoff).astype(np.float64)
+                out[start:start + exceed.shape[0], y] = np.rint(exceed.dot(self.corpora[y]['counts']))
+
+        exceed = pd.DataFrame(out, columns=fz.RANK_NAMES[:len(self.corpora)],
+                              index=pd.Index(unknown_list, name='word'))
+
+        return (fz.sort_words(exceed))
+
+    @ins.timed('scan', engine='tfidf', fused=True)
+    def predict(self, unknown_list, cutoff, dictionary):
+        """This function predicts the most likely rank of each unknown word. The output is identical to the one of
+        fz.fuzzy_predict applied to the distribution returned by tfidf_scan.
+
+        :param unknown_list: This is a vector of words with an unknown quality ranking that we want to predict.
+        :param cutoff: This is the similarity score cutoff (0-100) we think implies sufficient meaning in similarity.
+        :param dictionary: This is a dictionary we can use to transform the rank names back into ordinal rank values.
+
+        :return: out: This is a pandas df with the probability of exceeding the cutoff for each rank and the prediction.
+        """
+        exceed = self.exceedance(unknown_list, cutoff)
+
+        return (fz.predict_from_exceedance(exceed, self.total, list(exceed.columns), dictionary))
+
+    def nearest(self, unknown_list, k=5):
+        """This function finds the k most similar corpus words of each rank for each unknown word.
+
+        :param unknown_list: This is a vector of words with an unknown quality ranking.
+        :param k: This is the number of neighbours to return per unknown word and rank.
+
+        :return: out: This is a long pandas df with the columns word, rank, match, score and count, sorted by word, rank
+            and decreasing score. The corpus words with no n-gram in common with the unknown word are never returned.
+        """
+        words, ranks, rows, cols = [], [], [], [] #initialize lists to store loop vals
+
+        for start in range(0, len(unknown_list), self.chunksize):
+            chunk = np.asarray(unknown_list[start:start + self.chunksize], dtype=object)
+            matrices = self.score_matrices(chunk)
+            for y in range(len(self.corpora)):
+                scores = matrices[y].tocsr()
+                for x in range(scores.shape[0]):
+                    lo, hi = scores.indptr[x], scores.indptr[x + 1]
+                    keep = np.arange(lo, hi)
+                    if hi - lo > k:
+                        keep = lo + np.argpartition(-scores.data[lo:hi], k - 1)[:k] # top k without a full sort
+                    rows.append(scores.data[keep])
+                    cols.append(scores.indices[keep])
+                    words.append(np.repeat(chunk[x], len(keep)))
+                    ranks.append(np.repeat(y, len(keep)))
+
+        ranks = np.concatenate(ranks) if ranks else np.zeros(0, dtype=np.int64)
+        cols = np.concatenate(cols) if cols else np.zeros(0, dtype=np.int64)
+        match = np.empty(len(cols), dtype=object)
+        count = np.zeros(len(cols), dtype=np.int64)
+        for y in range(len(self.corpora)):
+            match[ranks == y] = self.corpora[y]['strings'][cols[ranks == y]]
+            count[ranks == y] = self.corpora[y]['counts'][cols[ranks == y]]
+
+        out = pd.DataFrame({'word': np.concatenate(words) if words else np.zeros(0, dtype=object),
+                            'rank': np.asarray(fz.RANK_NAMES, dtype=object)[ranks],
+                            'match': match,
+                            'score': np.concatenate(rows) if rows else np.zeros(0, dtype=np.float32),
+                            'count': count})
+
+        return (out.sort_values(['word', 'rank', 'score'], ascending=[True, True, False], kind='mergesort')
+                .reset_index(drop=True))
+
+
+@ins.timed('scan', engine='tfidf')
+def tfidf_scan(unknown_list, compact_list, index=None):
+    """This function is the counterpart of fz.fuzzy_scan_compact for the TF-IDF backend. It returns the distribution
+    of the scores of each unknown word against every unique corpus word, in the compact long format, so that
+    fz.fuzzy_predict can be used on it with weight='count'. Use TfidfIndex.predict to get the predictions directly
+    without building the full distribution.
+
+    :param unknown_list: This is a vector of words with an unknown quality ranking that we want to analyze and predict.
+    :param compact_list: This is a list of tuples (words, counts) as returned by fz.compact_corpus, one per rank.
+    :param index: This is an optional TfidfIndex already built from compact_list.
+
+    :return: distrib: This is a long pandas df with one row per unknown word and unique processed corpus word, with the
+        columns word, rank (the name of the corpus), score and count.
+    """
+    if index is None:
+        index = TfidfIndex(compact_list)
+
+    logger.info('analyzing %d unknown strings', len(unknown_list))
+
+    n_word = len(unknown_list)
+    matrices = index.score_matrices(unknown_list)
+    distrib = [] #initialize list to store loop vals
+
+    for y in range(len(index.corpora)):
+        counts = index.corpora[y]['counts'].astype(np.int64)
+        distrib.append(pd.DataFrame({'word': np.repeat(np.asarray(unknown_list, dtype=object), len(counts)),
+                                     'rank': fz.RANK_NAMES[y],
+                                     'score': np.asarray(matrices[y].todense()).ravel(),
+                                     'count': np.tile(counts, n_word)}))
+
+    return (pd.concat(distrib, ignore_index=True))
@@ -1,4 +1,9 @@
 
+import instrument as ins
+
+logger = ins.get_logger(__name__)
+
+
 #define necessary helper functions
 def cv_censor_col(df, colname, pct=.2, weight_var=None, reps=5):
     """This function is used to create pandas dfs where a specified % of the values in a column have been censored
@@ -14,38 +19,109 @@ def cv_censor_col(df, colname, pct=.2, weight_var=None, reps=5):
     :return: df_clean: This function returns a pandas df where the garbage codes have been replaced with NaN.
     """
     
+    #note that the folds only store which rows were censored, the dfs are built one at a time from the original
+    out = [fold.to_frame() for fold in cv_censor_index(df, colname, pct=pct, weight_var=weight_var, reps=reps)]
+
+    #return the list of sampled dfs
+    return(out)
+
+def cv_censor_index(df, colname, pct=.2, weight_var=None, reps=5):
+    """This function is a lightweight version of cv_censor_col. Instead of returning a full copy of the df for each
+    rep, it returns a CensoredFold that only stores which rows were censored, and builds the censored column and the
+    train flag on demand. The rows are drawn exactly like cv_censor_col draws them.
+
+    :param df: This is a pandas df that has a column that you want to censor and later predict.
+    :param colname: This is a string indicating the name of a column that you want to censor and later predict.
+    :param pct: This is a value between 0-1 that indicates the fraction of values you want to censor. Default = 20%
+    :param weight_var: This is a string indicating the column name is used to weighted the sample. Default = No weight.
+    :param reps: This is an integer indicating the number of different training datasets to create. Default = 5x
+
+    :return: out: This is a list of CensoredFold objects, one per rep.
+    """
+
     #import packages
     import pandas as pd
     import numpy as np
-    
+
+    #sample positions from an empty df, which draws the same rows as sampling the full df without copying it
+    positions = pd.DataFrame(index=pd.RangeIndex(len(df)))
+    weights = None if weight_var is None else df[weight_var].values
+
     out = []
-    
+
     for x in range(reps):
-            
-        print("sampling df, iteration #", x)
-    
-        #first archive your old column in order to test later
-        new_df = df.copy()
-        new_df[colname + '_og'] = new_df[colname]
-        new_df['train'] = 1 #set column to specify whether training or test data
-
-        #draw a weighted sample if weight var is specified
-        if weight_var != None:
-            df_censor = new_df.sample(frac=pct, weights=weight_var)
-        else:
-            df_censor = new_df.sample(frac=pct)
-            
-        #now replace the sampled column with missing values in order to try and predict
-        #note that replacement is only done on the sampled indices
-        df_censor['train'] = 0 #note that this sample is no longer training data (it is test)
-        df_censor[colname] = "replace_me"
-        new_df.update(df_censor, overwrite=True)
-        new_df[colname].replace("replace_me", np.nan, inplace=True)
-        #TODO unsure if this is pythonic method but it seems like df.update won't replace values with NaN, 
-        #as such, need to do this workaround
-        
-        #store the result (df with columns censored)
-        out.append(new_df)
-    
-    #return the list of sampled dfs
-    return(out)
\ No newline at end of file
+
+        logger.debug("sampling df, iteration # %d", x)
+
+        censored = np.zeros(len(df), dtype=bool)
+        censored[positions.sample(frac=pct, weights=weights).index.values] = True
+
+        out.append(CensoredFold(df, colname, censored))
+
+    return(out)
+
+
+class CensoredFold(object):
+    """This is a single cross-validation rep of a df, where a fraction of the values of a column have been censored.
+    It only holds a reference to the original df and a boolean mask of the censored rows, and builds the censored
+    column, the archived original column and the train flag as numpy arrays when they are needed.
+    """
+
+    def __init__(self, df, colname, censored):
+        """This function creates the fold.
+
+        :param df: This is the original pandas df, which is never modified.
+        :param colname: This is a string indicating the name of the censored column.
+        :param censored: This is a boolean numpy array, True for each row that is censored (i.e. the test data).
+        """
+        self.df = df
+        self.colname = colname
+        self.censored = censored
+
+    @property
+    def train(self):
+        """This is an int numpy array, 1 for the training rows and 0 for the censored (test) rows."""
+        import numpy as np
+
+        return (~self.censored).astype(np.int64)
+
+    @property
+    def test_index(self):
+        """This is an int numpy array of the positions of the censored (test) rows."""
+        import numpy as np
+
+        return np.flatnonzero(self.censored)
+
+    def censored_col(self):
+        """This function builds the censored column, where the values of the test rows are replaced with NaN.
+
+        :return: col: This is a numpy array with the values of the column, or NaN for the censored rows.
+        """
+        import numpy as np
+
+        col = self.df[self.colname].values
+        col = col.astype(object) if col.dtype.kind not in 'fc' else col.copy()
+        col[self.censored] = np.nan
+
+        return col
+
+    def to_frame(self, columns=None):
+        """This function materializes the fold as a pandas df, in the same format that cv_censor_col returns.
+
+        :param columns: This is an optional list of the columns of the original df to keep. Default = all columns.
+
+        :return: new_df: This is a pandas df with the censored column, its archived original and the train flag.
+        """
+        if columns is None:
+            columns = list(self.df.columns)
+        columns = [x for x in columns if x != self.colname] # the censored column is added back below
+
+        new_df = self.df[columns].copy()
+        new_df[self.colname] = self.censored_col()
+        new_df[self.colname + '_og'] = self.df[self.colname].values
+        new_df['train'] = self.train
+
+        # keep the original column order, followed by the archived column and the train flag
+        order = [x for x in self.df.columns if x in columns or x == self.colname]
+
+        return new_df[order + [self.colname + '_og', 'train']]
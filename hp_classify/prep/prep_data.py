@@ -1,7 +1,28 @@
-import timeit
+import re
 import numpy as np
 import pandas as pd
 
+import instrument as ins
+
+logger = ins.get_logger(__name__)
+
+
+# precompiled patterns used by clean_text, which must be applied in this order
+# note that these are kept as separate passes, as removing one code can reveal another (eg "<f<ff>1>")
+RE_ERRORS = [re.compile(x) for x in [r"\<ff>", r"\<fb>", r"\<a\d>", r"\<c\d>", r"\<d\d>", r"\<e\d>", r"\<f\d>"]]
+RE_BRACKET = re.compile(r"\[.]")
+RE_NUM_DOT = re.compile(r"\d+\.")
+RE_DIGITS = re.compile(r"\d+")
+RE_SPACES = re.compile(' +')
+
+# remove the characters [\], ['] and ["], then replace the other punctuation characters with spaces, in a single pass
+PUNCT_FILTERS = '!"\'#$%&()*+,-./:;<=>?@[\\]^_`{|}~\t\n'
+TRANSLATE_MAP = str.maketrans(dict([(c, " ") for c in PUNCT_FILTERS] + [(c, None) for c in '\\\'"']))
+
+# version of the cleaning rules above, which is part of the cache key used by read_then_clean_cached
+# note that this must be bumped whenever clean_text is modified, otherwise stale caches will be reused
+CLEAN_VERSION = 1
+
 
 # define necessary helper functions
 def clean_text(text):
@@ -18,48 +39,61 @@ def clean_text(text):
 
     :return: text: This function returns a cleaned version of the input text.
     """
-    # import necessary modules
-    import re
-
     # force all vals in series to string
     text = str(text)
 
     # first remove uppercase
     text = text.lower()
 
-    # remove common errors
-    text = re.sub(r"\[.]", "", text)
-    text = re.sub(r"\<ff>", "", text)
-    text = re.sub(r"\<fb>", "", text)
-    text = re.sub(r"\<a\d>", "", text)
-    text = re.sub(r"\<c\d>", "", text)
-    text = re.sub(r"\<d\d>", "", text)
-    text = re.sub(r"\<e\d>", "", text)
-    text = re.sub(r"\<f\d>", "", text)
-    text = re.sub(r"\d+\.", "", text)
-
-    # remove the characters [\], ['] and ["]
-    text = re.sub(r"\\", "", text)
-    text = re.sub(r"\'", "", text)
-    text = re.sub(r"\"", "", text)
-
-    # replace punctuation characters with spaces
-    filters = '!"\'#$%&()*+,-./:;<=>?@[\\]^_`{|}~\t\n'
-    translate_dict = dict((c, " ") for c in filters)
-    translate_map = str.maketrans(translate_dict)
-    text = text.translate(translate_map)
+    # remove common errors, skipping the patterns that cannot match
+    if '[' in text:
+        text = RE_BRACKET.sub("", text)
+    if '<' in text:
+        for pattern in RE_ERRORS:
+            text = pattern.sub("", text)
+    if '.' in text:
+        text = RE_NUM_DOT.sub("", text)
+
+    # remove the characters [\], ['] and ["] and replace punctuation characters with spaces
+    text = text.translate(TRANSLATE_MAP)
 
     # remove any remaining digit codes
-    text = re.sub(r"\d+", "", text)
+    text = RE_DIGITS.sub("", text)
 
     # remove any leading/trailing/duplicate whitespace
-    text = re.sub(' +', ' ', text.strip())
+    text = RE_SPACES.sub(' ', text.strip())
 
     return text
 
 
+def clean_series(series):
+    """This function is used to clean a whole column of text with clean_text. Survey string columns only hold a few
+    distinct values, so each unique value is only cleaned once and the results are mapped back onto every row. The
+    output is identical to series.apply(clean_text).
+
+    :param series: This is a pandas series of text values that need to be cleaned.
+
+    :return: series: This function returns a pandas series with the cleaned version of each value.
+    """
+    # import necessary modules
+    import pandas as pd
+    import numpy as np
+
+    codes, uniques = pd.factorize(series)
+    cleaned = np.array([clean_text(x) for x in uniques] + [''], dtype=object)
+    out = cleaned[codes] # note that missing values get code -1, which is filled in below
+
+    # clean_text only depends on str(value), so missing values are grouped by their str
+    missing = codes < 0
+    if missing.any():
+        na_str, na_inv = np.unique(np.asarray(series.values[missing]).astype(str), return_inverse=True)
+        out[missing] = np.array([clean_text(x) for x in na_str], dtype=object)[na_inv.ravel()]
+
+    return pd.Series(out, index=series.index, name=series.name)
+
+
 # define master function
-def read_then_clean(file_path, vars_to_clean, filter_series=None):
+def read_then_clean(file_path, vars_to_clean, filter_series=None, usecols=None):
     """This is the master function for this module. It uses the previously defined helper functions,
     in order to output a clean dataset for user. It reads in a selected .csv file from a given filepath,
     and applies the previously defined cleaning functions to a list of variables provided by user.
@@ -69,6 +103,8 @@ def read_then_clean(file_path, vars_to_clean, filter_series=None):
     :param file_path: This is a string indicating which file that you want to read in.
     :param vars_to_clean: This is a list of strings that indicate which columns you want to clean.
     :param filter_series: This is a list of strings that indicate which survey series to keep.
+    :param usecols: This is an optional list of the columns to read, so that the other columns are never parsed.
+        Default = all columns.
 
     :return: df_clean: This is a pandas df that has columns of text values that have been cleaned using the helper
         function.
@@ -78,17 +114,19 @@ def read_then_clean(file_path, vars_to_clean, filter_series=None):
     import numpy as np
 
     # read in your data
-    print("~begin reading")
-    df_raw = pd.read_csv(file_path, low_memory=False)
+    logger.info("~begin reading")
+    with ins.stage('read', file=file_path):
+        df_raw = pd.read_csv(file_path, low_memory=False, usecols=usecols)
     min_nrow = len(df_raw)  # save the row count to test after cleaning and verify that rows are not being dropped
-    print("data read!")
+    logger.info("data read!")
 
     # cleanup
-    print("~begin cleaning")
-    df_clean = df_raw.copy()
-    for var in vars_to_clean:
-        df_clean[var] = df_clean[var].apply(clean_text)
-    print("data clean!")
+    logger.info("~begin cleaning")
+    with ins.stage('clean'):
+        df_clean = df_raw.copy()
+        for var in vars_to_clean:
+            df_clean[var] = clean_series(df_clean[var])
+    logger.info("data clean!")
 
     # Verify that the minimum rowcount continues to be met
     if len(df_clean) < min_nrow:
@@ -104,14 +142,181 @@ def read_then_clean(file_path, vars_to_clean, filter_series=None):
 
     # Filter data if filter arguments are provided by user
     if filter_series != None:
-        print("~applying filter")
+        logger.info("~applying filter")
         df_clean = df_clean[df_clean['survey_series'].isin(filter_series)]
+        ins.count('rows_dropped', min_nrow - len(df_clean))
 
     # output a clean dataset
     return df_clean
 
 
+def read_then_clean_chunks(file_path, vars_to_clean, filter_series=None, chunksize=100000):
+    """This is the streaming version of read_then_clean. It reads the selected .csv file in chunks of rows, and cleans
+    and filters each chunk before reading the next one, so that memory use is bounded by the chunk size rather than
+    by the size of the file. The chunks are yielded one at a time.
+
+    :param file_path: This is a string indicating which file that you want to read in.
+    :param vars_to_clean: This is a list of strings that indicate which columns you want to clean.
+    :param filter_series: This is a list of strings that indicate which survey series to keep.
+    :param chunksize: This is the number of rows to read in and clean at a time.
+
+    :return: df_clean: This is a generator of pandas dfs, each holding the cleaned (and filtered) rows of one chunk.
+    """
+    # import necessary modules
+    import pandas as pd
+
+    logger.info("~begin streaming")
+    n_read = 0
+    n_kept = 0
+    for df_chunk in pd.read_csv(file_path, chunksize=chunksize, low_memory=False):
+        min_nrow = len(df_chunk)  # save the row count to test after cleaning and verify that rows are not being dropped
+        n_read += min_nrow
+
+        # note that the chunk is already a fresh df, so it can be cleaned in place
+        with ins.stage('clean', chunk=True):
+            for var in vars_to_clean:
+                df_chunk[var] = clean_series(df_chunk[var])
+
+        # Verify that the minimum rowcount continues to be met
+        if len(df_chunk) < min_nrow:
+            class RowCountException(Exception):
+                """Custom exception class.
+
+                This exception is raised when the minimum row is unmet.
+
+                """
+                pass
+
+            raise RowCountException("Minimum number of rows were not returned after cleaning. Data is being lost!")
+
+        # Filter data if filter arguments are provided by user
+        if filter_series != None:
+            df_chunk = df_chunk[df_chunk['survey_series'].isin(filter_series)]
+
+        n_kept += len(df_chunk)
+        ins.count('rows_dropped', min_nrow - len(df_chunk))
+        yield df_chunk
+
+    logger.info("data clean! %d rows read, %d rows kept", n_read, n_kept)
+
+
+def stream_then_clean(file_path, out_path, vars_to_clean, filter_series=None, chunksize=100000):
+    """This function uses read_then_clean_chunks in order to clean a .csv file that is too large to fit in memory,
+    and writes the cleaned rows to a new .csv file one chunk at a time.
+
+    :param file_path: This is a string indicating which file that you want to read in.
+    :param out_path: This is a string indicating the .csv file that you want to write the clean data to.
+    :param vars_to_clean: This is a list of strings that indicate which columns you want to clean.
+    :param filter_series: This is a list of strings that indicate which survey series to keep.
+    :param chunksize: This is the number of rows to read in and clean at a time.
+
+    :return: n_row: This is the number of rows that were written to out_path.
+    """
+    n_row = 0
+    header = True
+    for df_chunk in read_then_clean_chunks(file_path, vars_to_clean, filter_series, chunksize):
+        df_chunk.to_csv(out_path, mode='w' if header else 'a', header=header, index=False)
+        header = False
+        n_row += len(df_chunk)
+
+    logger.info("clean data written to %s", out_path)
+
+    return n_row
+
+
+def read_then_clean_cached(file_path, vars_to_clean, filter_series=None, columns=None, cache_dir=None,
+                           hash_file=False):
+    """This function is a cached version of read_then_clean. The first call cleans the .csv file and stores the clean
+    df as a parquet file, where each string column is dictionary encoded. Later calls with the same arguments read the
+    parquet file back with a memory map instead of parsing and cleaning the .csv again.
+
+    The cache key combines the size and modification time of the source file (or a hash of its content), the list of
+    variables to clean, the survey filter, the selected columns and CLEAN_VERSION. Note that string columns are
+    returned as pandas categoricals, and that object columns of mixed types are stored as strings.
+
+    :param file_path: This is a string indicating which file that you want to read in.
+    :param vars_to_clean: This is a list of strings that indicate which columns you want to clean.
+    :param filter_series: This is a list of strings that indicate which survey series to keep.
+    :param columns: This is an optional list of the columns to keep. Default = all columns.
+    :param cache_dir: This is the directory where the parquet files are stored. Default = a "cache" directory next to
+        the source file.
+    :param hash_file: This is a boolean that tells us to key the cache on a hash of the file content rather than on
+        its size and modification time.
+
+    :return: df_clean: This is a pandas df that has columns of text values that have been cleaned using the helper
+        function.
+    """
+    # import necessary modules
+    import os
+    import json
+    import hashlib
+    import tempfile
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    file_path = os.path.abspath(file_path)
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(file_path), 'cache')
+
+    # build the cache key from the source file and the cleaning arguments
+    stat = os.stat(file_path)
+    if hash_file == True:
+        digest = hashlib.sha1()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        source = digest.hexdigest()
+    else:
+        source = [stat.st_size, stat.st_mtime_ns]
+
+    key = json.dumps({'file': file_path, 'source': source, 'vars': list(vars_to_clean),
+                      'filter': None if filter_series is None else list(filter_series),
+                      'columns': None if columns is None else list(columns), 'version': CLEAN_VERSION})
+    key = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    cache_path = os.path.join(cache_dir, name + '_' + key + '.parquet')
+
+    if not os.path.exists(cache_path):
+        logger.info("~no cache found, building %s", cache_path)
+        usecols = None
+        if columns is not None:
+            # only parse the selected columns, plus the ones needed to clean and filter the rows
+            needed = list(vars_to_clean) + ([] if filter_series is None else ['survey_series'])
+            usecols = list(columns) + [x for x in needed if x not in columns]
+        df_clean = read_then_clean(file_path, vars_to_clean, filter_series, usecols=usecols)
+        if columns is not None:
+            df_clean = df_clean[columns]
+
+        # dictionary encode the string columns, forcing mixed type columns to strings so that they can be stored
+        df_clean = df_clean.copy()
+        for var in df_clean.columns:
+            if df_clean[var].dtype == object or str(df_clean[var].dtype) in ['string', 'str']:
+                col = df_clean[var]
+                df_clean[var] = col.where(col.isnull(), col.astype(str)).astype('category')
+
+        # write to a temporary file first, so that an interrupted write never leaves a corrupt cache behind
+        # note that each writer gets its own temporary file, so that processes building the same cache at the same
+        # time never write to the same file, and the last one to finish replaces the cache with a complete copy
+        os.makedirs(cache_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=cache_dir, prefix=os.path.basename(cache_path) + '.', suffix='.tmp',
+                                         delete=False) as f:
+            tmp_path = f.name
+        try:
+            pq.write_table(pa.Table.from_pandas(df_clean), tmp_path)
+            os.replace(tmp_path, cache_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    logger.info("~reading cache %s", cache_path)
+    with ins.stage('read', file=cache_path, cached=True):
+        return pq.read_table(cache_path, memory_map=True).to_pandas()
+
+
 # define function to replace meaningless values with NaNs
+@ins.timed('clean')
 def remove_garbage_codes(df, vars_to_clean, garbage_list):
     """This helper function is used to remove garbage values from a pandas df, replacing them with NaN.
     TODO: ?
@@ -133,17 +338,18 @@ def remove_garbage_codes(df, vars_to_clean, garbage_list):
     for string in garbage_list:
         garb_dict[string] = np.nan
 
-    print(garb_dict)
+    logger.debug("garbage values: %s", garb_dict)
 
     for var in vars_to_clean:
-        print("removing garbage from ", var)
-        df_clean[var].replace(garb_dict, inplace=True)
+        logger.debug("removing garbage from %s", var)
+        df_clean[var] = df_clean[var].replace(garb_dict) # note that an inplace replace on the column can be a no-op
 
     # output a clean dataset
     return df_clean
 
 
 # define function to replace meaningless values with NaNs
+@ins.timed('rank')
 def extract_ranking(df, vars_to_clean):
     """This helper function is used to extract the ordinal rankings from numerical coding.
     TODO: ?
@@ -160,14 +366,39 @@ def extract_ranking(df, vars_to_clean):
     df_out = df.copy()
 
     for var in vars_to_clean:
-        print("defining ranking for ", var)
+        logger.debug("defining ranking for %s", var)
         newcol = re.sub("_num", "_rank", var)
-        df_out[newcol] = df_out[var].astype(str).str[0]
+        df_out[newcol] = first_char(df_out[var])
 
     # output a clean dataset
     return df_out
 
 
+def first_char(series):
+    """This helper function returns the first character of the string value of each row of a series, exactly like
+    series.astype(str).str[0], but only converts each distinct value once.
+
+    :param series: This is a pandas series.
+    :return: out: This function returns a pandas series of the first characters, with the same index.
+    """
+    # import necessary modules
+    import pandas as pd
+
+    codes, uniques = pd.factorize(series)
+    if len(uniques) == 0:
+        return series.astype(str).str[0]
+    firsts = pd.Series(uniques, dtype=series.dtype).astype(str).str[0]
+
+    out = firsts.take(codes.clip(0))
+    out.index = series.index
+
+    # the missing values are not among the uniques, so they go through the original conversion
+    if (codes < 0).any():
+        out[codes < 0] = series[codes < 0].astype(str).str[0].values
+
+    return out
+
+
 def load_data(file_name):
     """This helper function is used to load a dataset from a selected csv file.
     It monitors the runtime of the loading process and also truncates the dataset
@@ -177,27 +408,99 @@ def load_data(file_name):
     :param file_name: This is the file name of the csv file to load in for processing
     :return: df: This function returns a dataframe with specified columns and no missing data
     """
-    # define start time
-    start = timeit.default_timer()
+    # record the runtime of the loading process
+    with ins.stage('read', file=file_name) as record:
+        df = pd.read_csv(file_name, low_memory=False)
+        n_read = len(df)
+        # truncate process if the dataframe to specified columns and remove missing data
+        attr = ['int_year',
+                'housing_roof_num', 'housing_wall_num', 'housing_floor_num', 'iso3']
+
+        df = df[attr]
+        df = df[df['housing_wall_num'] != 0]
+        df = df[df['housing_roof_num'] != 0]
+        df = df[df['housing_floor_num'] != 0]
+        df.dropna()
+        ins.count('rows_dropped', n_read - len(df))
+
+    logger.info("Runtime:{:.2f} sec".format(record['wall_s']))
+
+    return df
+
+
+# columns read by the typed loader, and the dtypes they are parsed into (iso3 is added from meta.json)
+LOAD_DTYPES = {'int_year': np.float32,
+               'housing_roof_num': np.float32,
+               'housing_wall_num': np.float32,
+               'housing_floor_num': np.float32}
+
+
+def iso3_dtype(meta_path=None):
+    """This helper function builds the categorical dtype of the iso3 column from the fixed encoding of meta.json, so
+    that the category codes of a country are the same in every dataset, at training and at inference time.
+
+    :param meta_path: This is an optional path to meta.json. Default = the meta.json of the data directory.
+    :return: dtype: This function returns a pandas CategoricalDtype whose codes are the meta.json iso3 values.
+    """
+    import json
+    import os
+
+    if meta_path is None:
+        meta_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data', 'meta.json')
+    with open(meta_path) as f:
+        iso_dict = json.load(f)[3]
 
-    df = pd.read_csv(file_name, low_memory=False)
-    # truncate process if the dataframe to specified columns and remove missing data
-    attr = ['int_year',
-            'housing_roof_num', 'housing_wall_num', 'housing_floor_num', 'iso3']
+    # note that the meta.json values are 0..n-1, so sorting the codes by value makes them the category codes
+    return pd.CategoricalDtype(sorted(iso_dict, key=iso_dict.get))
 
-    df = df[attr]
-    df = df[df['housing_wall_num'] != 0]
-    df = df[df['housing_roof_num'] != 0]
-    df = df[df['housing_floor_num'] != 0]
-    df.dropna()
 
-    # define end time
-    stop = timeit.default_timer()
-    print("Runtime:{:.2f} sec".format(stop - start))
+def load_data_typed(file_name, meta_path=None, chunksize=500000, engine='c'):
+    """This function is a typed version of load_data. Only the five training attributes are read, and they are parsed
+    straight into compact dtypes: int16 year and material codes, and an iso3 category based on meta.json. The rows
+    with a code of 0 or a missing value (including the '?' and '.' codes, and countries missing from meta.json) are
+    dropped with a single mask, chunk by chunk as the file is read, so that the full file is never held in memory.
+
+    :param file_name: This is the file name of the csv file to load in for processing
+    :param meta_path: This is an optional path to meta.json. Default = the meta.json of the data directory.
+    :param chunksize: This is the number of rows parsed at once by the c engine.
+    :param engine: This is the csv parser, either 'c' (chunked) or 'pyarrow' (multithreaded, reads the whole file).
+    :return: df: This function returns a dataframe with specified columns and no missing data
+    """
+    # record the runtime of the loading process
+    with ins.stage('read', file=file_name, engine=engine) as record:
+        df = _load_data_typed(file_name, meta_path, chunksize, engine)
+
+    logger.info("Runtime:{:.2f} sec".format(record['wall_s']))
 
     return df
 
 
+def _load_data_typed(file_name, meta_path, chunksize, engine):
+    """This is a helper function for load_data_typed. It reads and filters the file.
+    """
+    iso3 = iso3_dtype(meta_path)
+    dtypes = dict(LOAD_DTYPES, iso3='category')
+    attr = ['int_year', 'housing_roof_num', 'housing_wall_num', 'housing_floor_num', 'iso3']
+    codes = ['housing_roof_num', 'housing_wall_num', 'housing_floor_num']
+
+    def filter_chunk(chunk):
+        # recode the categories read into the meta.json ones, the countries missing from meta.json become NaN
+        recode = np.append(iso3.categories.get_indexer(chunk['iso3'].cat.categories), -1)
+        chunk['iso3'] = pd.Categorical.from_codes(recode[chunk['iso3'].cat.codes.values], categories=iso3.categories)
+        keep = chunk[attr].notnull().all(axis=1).values & (chunk[codes].values != 0).all(axis=1)
+        ins.count('rows_dropped', len(keep) - keep.sum())
+        return chunk[keep]
+
+    read_args = dict(usecols=attr, dtype=dtypes, na_values=['?', '.'])
+    if engine == 'pyarrow':
+        chunks = [filter_chunk(pd.read_csv(file_name, engine='pyarrow', **read_args))]
+    else:
+        chunks = [filter_chunk(x) for x in pd.read_csv(file_name, chunksize=chunksize, **read_args)]
+
+    df = pd.concat(chunks) if len(chunks) > 1 else chunks[0]
+    return df[attr].astype(dict((col, np.int16) for col in ['int_year'] + codes))
+
+
 def cleaning_block(df, word):
     """This helper function filters out special characters within number columns, and convert numbers from str to int.
 
@@ -212,21 +515,47 @@ def cleaning_block(df, word):
     df.loc[:, 'housing_' + word + '_num'] = pd.to_numeric(df.loc[:, 'housing_' + word + '_num'])
 
 
+@ins.timed('rank')
+def rank_columns(df, vals):
+    """This function ranks the _num columns of every category at once by the digit in tens. All the codes are parsed
+    in one pass, the ranks are computed with an integer division, and the rows with a code smaller than 10 or greater
+    than 35 (or that is not a number, eg. '?' or '.') in any of the columns are dropped with a single combined mask.
+
+    :param df: This is a dataframe read to be ranked.
+    :param vals: This is a list of category names (eg. roof, wall, floor) that is specified to be ranked.
+    :return: df_out: This function returns a pandas df with the valid rows, the numeric _num cols and the int8
+        ordinal rank cols added.
+    """
+    nums = [pd.to_numeric(df['housing_' + val + '_num'], errors='coerce').values for val in vals]
+
+    # keep the rows where every code is within 10-35, note that NaN fails both comparisons
+    valid = np.ones(len(df), dtype=bool)
+    for num in nums:
+        valid &= (num >= 10) & (num <= 35)
+
+    df_out = df[valid].copy()
+    ins.count('rows_dropped', len(df) - len(df_out))
+
+    for val, num in zip(vals, nums):
+        num = num[valid]
+        # the valid codes fit in a small int, unless they are not whole numbers
+        if np.array_equal(num, np.floor(num)):
+            num = num.astype(np.int16)
+        df_out['housing_' + val + '_num'] = num
+        df_out[val + '_rank'] = (num // 10).astype(np.int8)
+
+    return df_out
+
+
 def ranking(df, vals):
     """This helper function ranks the _num columns by the digit in tens, excluding the numbers smaller than 10
-    or greater than 35, which are considered as invalid or missing values.
+    or greater than 35, which are considered as invalid or missing values. See rank_columns.
 
     :param df: This is a dataframe read to be ranked.
     :param vals: This is a list of category names (eg. roof, wall, floor) that is specified to be ranked.
     :return: df: This function returns a pandas df with the ordinal rank cols added to the read in datafame.
     """
-    for val in vals:
-        cleaning_block(df, val)
-        df = df[(df['housing_' + val + '_num'] <= 35) & (df['housing_' + val + '_num'] >= 10)]
-        df.loc[:, val + '_rank'] = (df['housing_' + val + '_num'] / 10).apply(np.floor)
-        df.loc[df[val + '_rank'] == 0, val + '_rank'] = 0
-        df.loc[df[val + '_rank'] >= 4, val + '_rank'] = 4
-    return df
+    return rank_columns(df, vals)
 
 
 def extract_features(df, LABEL):
@@ -246,44 +575,147 @@ def extract_features(df, LABEL):
 
 def shuffle_redistribute(df, LABEL, Redistribute=True):
     """This helper function generalizes the distribution of the data set with respect to the three ranks (1,2,3),
-    then it shuffles the data set to unbiased.
+    then it shuffles the data set to unbiased. See balanced_sample.
 
     :param df: This is a dtaframe read in to shuffle and redistribute
     :param LABEL: This is the label specified under prediction
     :param Redistribute: set True for data redistribution (default True)
-
     :return:
         df (pandas df): Returns the modified dataframe
         rank_dist: This is a list of the number of data within each rank(1,2,3)
     """
     if Redistribute:
-        # split the dataframe to three subsets grouped by rank 1,2,3,
-        rank1 = df[df[LABEL + '_rank'] == 1]
-        rank2 = df[df[LABEL + '_rank'] == 2]
-        rank3 = df[df[LABEL + '_rank'] == 3]
-
-        list_for_rank_df = [rank1, rank2, rank3]
-        new_list = []
-
-        # determine the smallest dataframe grouped by rank 1,2,3
-        base = min(len(rank1), len(rank2), len(rank3))
-
-        # redistribution procees by dividing the portion based on the smallest dataset
-        for rank in list_for_rank_df:
-            if len(rank) != base:
-                rank.loc[:, 'rand_num'] = np.random.uniform(0, 1, len(rank))
-                rank = rank[rank['rand_num'] <= base / len(rank)]
-                rank = rank.drop(columns='rand_num')
-            new_list.append(rank)
-        # concat the three sub dataframes
-        df = pd.concat(new_list)
+        return balanced_sample(df, LABEL)
+
+    # randomly shuffle the rows of the overall dataframe
+    df = df.take(np.random.permutation(len(df))).reset_index(drop=True)
+
     # count the total amount of data of each rank 1,2,3
     rank_dist = df.groupby(LABEL + '_rank').size().tolist()
-    # randomly shuffle the rows of the overall dataframe
-    df = df.sample(frac=1).reset_index(drop=True)
+
     return df, rank_dist
 
 
+def _random_state(random_state):
+    """This is a helper function for this module. It returns the random number generator to draw from.
+
+    :param random_state: This is either None, an int seed, or a numpy RandomState (or Generator).
+    :return: rng: This is the numpy random module when random_state is None, so that the draws come from the global
+        state and np.random.seed makes them reproducible, otherwise a RandomState (or the generator passed).
+    """
+    if random_state is None:
+        return np.random
+    if isinstance(random_state, (int, np.integer)):
+        return np.random.RandomState(random_state)
+
+    return random_state
+
+
+def balanced_index(labels, ranks=(1, 2, 3), per_rank=None, random_state=None):
+    """This helper function draws the positions of a sample with exactly the same number of rows of each rank, and
+    shuffles them. Only the positions are drawn, so the rows can then be gathered in a single pass.
+
+    :param labels: This is a numpy array of the rank of each row.
+    :param ranks: This is the list of ranks to balance. The rows of other ranks are never drawn.
+    :param per_rank: This is an optional number of rows to draw per rank. Default = the number of rows of the
+        smallest rank, which is also the largest value allowed.
+    :param random_state: This is an optional int seed, or numpy RandomState (or Generator). Default = the global
+        numpy random state.
+    :return: index: This function returns an int numpy array of the shuffled positions of the sampled rows.
+    """
+    rng = _random_state(random_state)
+
+    groups = [np.flatnonzero(labels == rank) for rank in ranks]
+    base = min([len(x) for x in groups])
+    if per_rank is not None:
+        base = min(base, per_rank)
+
+    index = np.concatenate([rng.choice(x, base, replace=False) for x in groups])
+
+    return rng.permutation(index)
+
+
+@ins.timed('sample')
+def balanced_sample(df, LABEL, ranks=(1, 2, 3), per_rank=None, random_state=None):
+    """This helper function returns a shuffled sample of the data set with exactly the same number of rows of each
+    rank (the number of rows of the smallest rank, or per_rank).
+
+    :param df: This is a dtaframe read in to shuffle and redistribute
+    :param LABEL: This is the label specified under prediction
+    :param ranks: This is the list of ranks to balance.
+    :param per_rank: This is an optional number of rows to draw per rank.
+    :param random_state: This is an optional int seed, or numpy RandomState (or Generator). Default = the global
+        numpy random state.
+    :return:
+        df (pandas df): Returns the sampled dataframe
+        rank_dist: This is a list of the number of data within each rank(1,2,3)
+    """
+    index = balanced_index(df[LABEL + '_rank'].values, ranks=ranks, per_rank=per_rank, random_state=random_state)
+
+    # gather the sampled rows in a single pass
+    ins.count('rows_dropped', len(df) - len(index))
+    df = df.take(index).reset_index(drop=True)
+
+    return df, [len(index) // len(ranks)] * len(ranks)
+
+
+def reservoir_balanced_sample(chunks, LABEL, per_rank, ranks=(1, 2, 3), random_state=None):
+    """This helper function is the streaming version of balanced_sample, for data sets that do not fit in memory.
+    It keeps a uniform random sample of at most per_rank rows of each rank (reservoir sampling) while the chunks are
+    read, so that only one chunk and the samples are held in memory at a time. The samples are then cut to the size
+    of the smallest one, so that the ranks are exactly balanced, and shuffled.
+
+    :param chunks: This is an iterable of dataframes, eg. read_csv(..., chunksize=n) or read_then_clean_chunks.
+    :param LABEL: This is the label specified under prediction
+    :param per_rank: This is the largest number of rows kept per rank.
+    :param ranks: This is the list of ranks to balance.
+    :param random_state: This is an optional int seed, or numpy RandomState (or Generator). Default = the global
+        numpy random state.
+    :return:
+        df (pandas df): Returns the sampled dataframe
+        rank_dist: This is a list of the number of data within each rank(1,2,3)
+    """
+    rng = _random_state(random_state)
+
+    reservoirs = [None] * len(ranks)
+    seen = [0] * len(ranks)
+
+    for chunk in chunks:
+        labels = chunk[LABEL + '_rank'].values
+        for r in range(len(ranks)):
+            rows = chunk[labels == ranks[r]]
+            if len(rows) == 0:
+                continue
+
+            # row j of the chunk is the t-th row of this rank: it fills slot t while the reservoir is not full, then
+            # replaces a random slot with probability per_rank / (t + 1)
+            t = seen[r] + np.arange(len(rows))
+            slots = np.where(t < per_rank, t, np.floor(rng.uniform(size=len(rows)) * (t + 1)).astype(np.int64))
+            seen[r] += len(rows)
+
+            # when several rows of the chunk go to the same slot, the last one wins, like in the sequential algorithm
+            last = len(slots) - 1 - np.unique(slots[::-1], return_index=True)[1]
+            last = np.sort(last[slots[last] < per_rank])
+
+            if reservoirs[r] is None:
+                reservoirs[r] = rows.iloc[last]
+            else:
+                replaced = np.zeros(len(reservoirs[r]), dtype=bool)
+                taken = slots[last]
+                replaced[taken[taken < len(reservoirs[r])]] = True
+                # note that the order of the reservoir does not matter, as every slot is equally likely to be replaced
+                reservoirs[r] = pd.concat([reservoirs[r][~replaced], rows.iloc[last]])
+
+    samples = [x if x is not None else pd.DataFrame() for x in reservoirs]
+    base = min([len(x) for x in samples])
+
+    # cut every sample to the size of the smallest one, then gather and shuffle in a single pass
+    df = pd.concat([x.take(rng.choice(len(x), base, replace=False)) for x in samples])
+    df = df.take(rng.permutation(len(df))).reset_index(drop=True)
+
+    return df, [base] * len(ranks)
+
+
 def train_test_split(df, features, LABEL):
     """This function splits the dataframe to random testing and training set with 75% and 25%each.
 
@@ -310,3 +742,80 @@ def train_test_split(df, features, LABEL):
     y_train = train[LABEL + '_rank'].values.astype(int)
     y_test = test[LABEL + '_rank'].values.astype(int)
     return x_train, x_test, y_train, y_test
+
+
+def encode_features(df, features, rows=None, meta_path=None):
+    """This helper function encodes the features of the random forest model into a single C-contiguous float32
+    matrix, without modifying the dataframe. iso3 is encoded with the fixed meta.json mapping (see iso3_dtype), which
+    is also the one used at inference time, so the codes do not depend on the rows or on their order.
+
+    :param df: This is the dataframe of features.
+    :param features: This is the list of specified features
+    :param rows: This is an optional int numpy array of the positions of the rows to encode, in order.
+        Default = every row.
+    :param meta_path: This is an optional path to meta.json. Default = the meta.json of the data directory.
+    :return: x: This function returns a float32 numpy array with one row per row encoded and one column per feature.
+    """
+    n_row = len(df) if rows is None else len(rows)
+    x = np.empty((n_row, len(features)), dtype=np.float32)
+
+    for j in range(len(features)):
+        col = df[features[j]]
+        if features[j] == 'iso3':
+            # note that the categories are matched by value, so an iso3 column that is already categorical is recoded,
+            # and the unknown or missing countries get -1
+            codes = iso3_dtype(meta_path).categories.get_indexer(np.asarray(col, dtype=object))
+            if ((codes < 0) & col.notnull().values).any():
+                class UnknownCountryException(Exception):
+                    """Custom exception class.
+
+                    This exception is raised when an iso3 code is missing from meta.json.
+
+                    """
+                    pass
+
+                unknown = sorted(set(col[(codes < 0) & col.notnull().values].astype(str)))
+                raise UnknownCountryException("iso3 codes missing from meta.json: " + ', '.join(unknown[:10]))
+            values = np.where(codes < 0, np.nan, codes)
+        else:
+            values = col.values
+        # fill the column in the requested row order, so the rows are only gathered once
+        x[:, j] = values if rows is None else np.asarray(values)[rows]
+
+    return x
+
+
+@ins.timed('features')
+def build_feature_matrix(df, features, LABEL, train_frac=.75, random_state=None, meta_path=None):
+    """This function splits the dataframe to random training and testing sets like train_test_split, but returns them
+    as numpy arrays ready for the random forest model, and leaves the dataframe untouched.
+
+    The rows are drawn like train_test_split draws them, then encoded (see encode_features) into a single
+    C-contiguous float32 matrix with the training rows first, so that the training and testing sets are views of that
+    matrix rather than copies.
+
+    :param df: This is the dataframe to be split
+    :param features: This is the list of specified features
+    :param LABEL: This is the label specified under prediction
+    :param train_frac: This is the fraction of the rows used for training. Default = 75%
+    :param random_state: This is an optional int seed, or numpy RandomState (or Generator). Default = the global
+        numpy random state.
+    :param meta_path: This is an optional path to meta.json. Default = the meta.json of the data directory.
+
+    :return:
+        x_train: This is the returned train dataset
+        x_test: This is the returned test dataset
+        y_train: This is the returned training label
+        y_test: This is the returned testing label
+    """
+    rng = _random_state(random_state)
+
+    # assign a random float from 0~1 to each row with uniform distribution, True = training set
+    train = rng.uniform(0, 1, len(df)) <= train_frac
+    rows = np.concatenate([np.flatnonzero(train), np.flatnonzero(~train)])
+    n_train = int(train.sum())
+
+    x = encode_features(df, features, rows=rows, meta_path=meta_path)
+    y = df[LABEL + '_rank'].values[rows].astype(np.int8)
+
+    return x[:n_train], x[n_train:], y[:n_train], y[n_train:]
@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+
+
+class TokenTable(object):
+    """This is the tokenization of a column of strings, shared by the semantic and fuzzy modules. Each distinct string
+    is only split once, and its distinct non-empty tokens are stored as token ids in a compressed sparse row layout:
+    the token ids of unique string i are indices[indptr[i]:indptr[i + 1]]. The memory used therefore grows with the
+    number of unique strings and tokens, and never with the number of rows.
+    """
+
+    def __init__(self, values, sep=' '):
+        """This function tokenizes a column of strings.
+
+        :param values: This is a pandas series (or a vector) of strings. Missing values have no tokens.
+        :param sep: This is the string separating the tokens. Default = a space.
+        """
+        self.codes, uniques = pd.factorize(pd.Series(values))
+        self.uniques = np.asarray(uniques, dtype=object)
+
+        vocab = {} #token -> token id
+        indptr = [0]
+        indices = []
+        for text in self.uniques:
+            for token in dict.fromkeys(str(text).split(sep)): #distinct tokens, in order of appearance
+                if token:
+                    indices.append(vocab.setdefault(token, len(vocab)))
+            indptr.append(len(indices))
+
+        self.vocab = np.array(list(vocab), dtype=object)
+        self.indptr = np.array(indptr, dtype=np.int64)
+        self.indices = np.array(indices, dtype=np.int64)
+
+    @property
+    def n_tokens(self):
+        """This is an int numpy array holding the number of distinct tokens of each unique string."""
+        return np.diff(self.indptr)
+
+    def tokens(self, i):
+        """This function returns the distinct tokens of a unique string.
+
+        :param i: This is the position of the string in uniques.
+
+        :return: tokens: This is a list of the tokens of the string.
+        """
+        return list(self.vocab[self.indices[self.indptr[i]:self.indptr[i + 1]]])
+
+    def row_counts(self):
+        """This function returns the number of distinct tokens of each row of the original column.
+
+        :return: counts: This is an int numpy array, 0 for the missing values.
+        """
+        return np.where(self.codes >= 0, self.n_tokens[self.codes], 0)
+
+    def set_lengths(self):
+        """This function returns the length of each unique string once its separators are collapsed and its repeated
+        tokens are dropped.
+
+        :return: lengths: This is an int numpy array of the lengths.
+        """
+        token_lengths = np.array([len(x) for x in self.vocab], dtype=np.int64)
+        # sum the lengths by owner, so that the strings without tokens get 0 wherever they are
+        owners = np.repeat(np.arange(len(self.uniques)), self.n_tokens)
+        total = np.bincount(owners, weights=token_lengths[self.indices], minlength=len(self.uniques)).astype(np.int64)
+
+        return total + np.maximum(self.n_tokens - 1, 0)
+
+    def postings(self):
+        """This function inverts the table, listing the unique strings that contain each token.
+
+        :return: postings: This is a dictionary mapping each token to an int numpy array of positions in uniques.
+        """
+        owners = np.repeat(np.arange(len(self.uniques)), self.n_tokens)
+        order = np.argsort(self.indices, kind='stable')
+        bounds = np.searchsorted(self.indices[order], np.arange(len(self.vocab) + 1))
+
+        return dict((self.vocab[x], owners[order[bounds[x]:bounds[x + 1]]]) for x in range(len(self.vocab)))
+
+    def to_csr(self):
+        """This function returns the table as a scipy sparse matrix of unique strings x tokens.
+
+        :return: matrix: This is a scipy csr_matrix holding a 1 for each token of each unique string.
+        """
+        from scipy.sparse import csr_matrix
+
+        return csr_matrix((np.ones(len(self.indices), dtype=np.int8), self.indices, self.indptr),
+                          shape=(len(self.uniques), len(self.vocab)))
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Synthetic survey data generator.
+
+The housing materials and their codes are taken from the roof, floor and wall dictionaries of meta.json, and the
+countries from its iso3 table. The rows are drawn chunk by chunk, so that datasets of any size (10k to 100M rows) can
+be written to a chunked CSV file or to a Parquet file without ever being held in memory.
+
+Each material column is drawn from a pool of spellings built once per label: the canonical material names, with
+Zipf-distributed frequencies, plus a few misspelled and French variants of each name, and garbage answers
+(eg. 'other', with a 96-99 code). A fraction of the rows is left unknown, ie. the material is described but its code
+is an unranked one, so that the fuzzy model has something to predict.
+
+Note that the unknown rows are recorded with code 96, like the 'other' garbage answer. This is how the surveys record
+an "other (specify)" answer, where the material is written out in the text column, so the simulated data has the
+same ambiguity as the real data: the code alone cannot tell a garbage 'other' from an unknown material. Both get the
+garbage rank 9, which remove_garbage_codes turns into NaN, and it is the text that tells them apart: the garbage
+strings given to remove_garbage_codes (eg. 'other') are removed too, so the described materials are left as the
+unknown words of build_corpus.
+
+usage: python prep/simulate.py --rows 100000 --out ../data/example_data.csv
+"""
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # when run as a script
+import instrument as ins
+
+logger = ins.get_logger(__name__)
+
+# order of the material dictionaries in meta.json
+META_LABELS = ['roof', 'floor', 'wall']
+
+# garbage answers and the codes they are recorded with, removed by prep.remove_garbage_codes
+GARBAGE = [('other', 96), ('not a dejure resident', 97), ('not dejure resident', 97), ('dont know', 98),
+           ('missing', 99)]
+
+# code of the rows whose material is described but not ranked, ie. the "other (specify)" code of the surveys, which is
+# shared with the 'other' garbage answer (see the module docstring)
+UNKNOWN_CODE = 96
+
+# word by word translations used to build the French variants of the material names
+FRENCH = {'bamboo': 'bambou', 'bricks': 'briques', 'brick': 'brique', 'cardboard': 'carton', 'cement': 'ciment',
+          'concrete': 'beton', 'dirt': 'terre', 'earth': 'terre', 'grass': 'herbe', 'leaves': 'feuilles',
+          'metal': 'metal', 'mud': 'boue', 'palm': 'palme', 'planks': 'planches', 'plastic': 'plastique',
+          'sand': 'sable', 'sheets': 'toles', 'stone': 'pierre', 'stones': 'pierres', 'straw': 'paille',
+          'thatch': 'chaume', 'tiles': 'tuiles', 'wood': 'bois', 'with': 'avec', 'and': 'et', 'no': 'sans',
+          'walls': 'murs', 'roof': 'toit', 'floor': 'sol', 'tin': 'fer blanc', 'iron': 'fer', 'adobe': 'adobe',
+          'carpet': 'tapis', 'covered': 'couvert', 'uncovered': 'non couvert', 'polished': 'poli'}
+
+SURVEY_SERIES = ['MACRO_DHS', 'MACRO_MIS', 'MACRO_AIS', 'IPUMS_CENSUS']
+
+LETTERS = np.array(list('abcdefghijklmnopqrstuvwxyz'))
+
+
+def load_meta(meta_path=None):
+    """This function reads the material dictionaries and the iso3 table of meta.json.
+
+    :param meta_path: This is an optional path to meta.json. Default = the meta.json of the data directory.
+
+    :return: vocabularies: This is a dict mapping each label (roof, floor, wall) to a dict of material -> int code.
+    :return: iso3: This is the list of iso3 codes.
+    """
+    if meta_path is None:
+        meta_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data', 'meta.json')
+    with open(meta_path) as f:
+        meta_data = json.load(f)
+
+    vocabularies = dict((META_LABELS[i], dict((k, int(v)) for k, v in meta_data[i].items()))
+                        for i in range(len(META_LABELS)))
+
+    return vocabularies, list(meta_data[3])
+
+
+def zipf_weights(n, a=1.1):
+    """This helper function returns the normalized frequencies of a Zipf law.
+
+    :param n: This is the number of items.
+    :param a: This is the exponent of the law, the higher the more frequent the most common items.
+
+    :return: weights: This is a float numpy array of n probabilities, in decreasing order.
+    """
+    weights = 1 / np.arange(1, n + 1) ** a
+
+    return weights / weights.sum()
+
+
+def misspell(word, rng):
+    """This helper function returns a misspelled copy of a word: a letter is dropped, doubled, swapped with the next
+    one or replaced by a random letter.
+
+    :param word: This is the string to misspell.
+    :param rng: This is a numpy RandomState.
+
+    :return: typo: This is the misspelled string.
+    """
+    if len(word) < 2:
+        return word + rng.choice(LETTERS)
+
+    i = rng.randint(len(word) - 1)
+    edit = rng.randint(4)
+    if edit == 0:
+        return word[:i] + word[i + 1:]
+    elif edit == 1:
+        return word[:i] + word[i] + word[i:]
+    elif edit == 2:
+        return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+    return word[:i] + rng.choice(LETTERS) + word[i + 1:]
+
+
+def translate(word):
+    """This helper function returns the French variant of a material name, or None if no word of it is translated.
+    """
+    tokens = word.split(' ')
+    french = [FRENCH.get(x, x) for x in tokens]
+
+    return ' '.join(french) if french != tokens else None
+
+
+def draw(cdf, n, rng):
+    """This helper function draws n positions from a cumulative distribution, in a single vectorized search.
+    """
+    return np.minimum(np.searchsorted(cdf, rng.uniform(size=n), side='right'), len(cdf) - 1)
+
+
+class SurveySimulator(object):
+    """This is a generator of survey-shaped datasets, with the columns survey_series, iso3, int_year and
+    housing_<label>, housing_<label>_num for each material label.
+
+    The spellings of each label are drawn from a fixed pool built once, so that drawing a chunk of rows only takes a
+    few vectorized draws per column, whatever its size.
+    """
+
+    def __init__(self, meta_path=None, seed=0, zipf_a=1.1, typo_rate=.05, french_rate=.05, garbage_rate=.02,
+                 unknown_rate=.1, missing_rate=.01, n_typos=3, years=(1990, 2018)):
+        """This function builds the pools of spellings.
+
+        :param meta_path: This is an optional path to meta.json. Default = the meta.json of the data directory.
+        :param seed: This is the seed of the pools and of the rows. The same seed and chunksize write the same data.
+        :param zipf_a: This is the exponent of the Zipf law of the material and country frequencies.
+        :param typo_rate: This is the fraction of the material answers that are misspelled.
+        :param french_rate: This is the fraction of the material answers that are in French (when a translation
+            exists).
+        :param garbage_rate: This is the fraction of the material answers that are garbage (eg. other).
+        :param unknown_rate: This is the fraction of the material answers recorded with the unranked code 96.
+        :param missing_rate: This is the fraction of the material answers that are missing (both text and code).
+        :param n_typos: This is the number of distinct misspellings of each material name.
+        :param years: This is the range of the survey years.
+        """
+        self.seed = seed
+        self.unknown_rate = unknown_rate
+        self.missing_rate = missing_rate
+        self.years = years
+
+        rng = np.random.RandomState(seed)
+        vocabularies, iso3 = load_meta(meta_path)
+
+        self.pools = {} #initialize dict to store loop vals
+        for label in META_LABELS:
+            words = sorted(vocabularies[label])
+            weights = zipf_weights(len(words), zipf_a)[rng.permutation(len(words))] # shuffle the popular materials
+
+            strings, codes, probs = [], [], []
+            for word, weight in zip(words, weights):
+                # note that the variants that are already materials of the vocabulary are left out, so that every
+                # spelling has a single code
+                french = translate(word)
+                if french in vocabularies[label]:
+                    french = None
+                share = 1 - typo_rate - (french_rate if french is not None else 0)
+                strings.append(word)
+                codes.append(vocabularies[label][word])
+                probs.append(weight * share)
+                typos = [misspell(word, rng) for x in range(n_typos)]
+                for typo in dict.fromkeys([x for x in typos if x not in vocabularies[label]]):
+                    strings.append(typo)
+                    codes.append(vocabularies[label][word])
+                    probs.append(weight * typo_rate / n_typos)
+                if french is not None:
+                    strings.append(french)
+                    codes.append(vocabularies[label][word])
+                    probs.append(weight * french_rate)
+
+            # the garbage answers are added on top, and every probability is then scaled back down
+            probs = np.array(probs) * (1 - garbage_rate)
+            strings.extend([x[0] for x in GARBAGE])
+            codes.extend([x[1] for x in GARBAGE])
+            probs = np.append(probs, np.full(len(GARBAGE), garbage_rate / len(GARBAGE)))
+
+            self.pools[label] = {'strings': np.array(strings, dtype=object),
+                                 'codes': np.array(codes, dtype=np.float64),
+                                 'cdf': np.cumsum(probs / probs.sum())}
+
+        self.iso3 = np.array(iso3, dtype=object)[rng.permutation(len(iso3))]
+        self.iso3_cdf = np.cumsum(zipf_weights(len(iso3), zipf_a))
+
+    def chunk(self, n_rows, number=0):
+        """This function draws a chunk of rows.
+
+        :param n_rows: This is the number of rows to draw.
+        :param number: This is the number of the chunk, which seeds its draws together with the seed of the simulator.
+
+        :return: df: This is a pandas df of survey rows.
+        """
+        rng = np.random.RandomState([self.seed, number])
+
+        # every row of a survey shares its country, year and series, so draw the surveys first
+        n_survey = max(1, n_rows // 2000)
+        survey = rng.randint(n_survey, size=n_rows)
+        iso3 = self.iso3[draw(self.iso3_cdf, n_survey, rng)]
+        year = rng.randint(self.years[0], self.years[1] + 1, n_survey)
+        series = np.array(SURVEY_SERIES, dtype=object)[rng.randint(len(SURVEY_SERIES), size=n_survey)]
+
+        df = pd.DataFrame({'survey_series': series[survey], 'iso3': iso3[survey], 'int_year': year[survey]})
+
+        for label in META_LABELS:
+            pool = self.pools[label]
+            pick = draw(pool['cdf'], n_rows, rng)
+            text = pool['strings'][pick]
+            code = pool['codes'][pick]
+
+            code[rng.uniform(size=n_rows) < self.unknown_rate] = UNKNOWN_CODE
+            missing = rng.uniform(size=n_rows) < self.missing_rate
+            text[missing] = np.nan
+            code[missing] = np.nan
+
+            df['housing_' + label] = text
+            df['housing_' + label + '_num'] = code
+
+        return df
+
+    def write(self, out_path, n_rows, chunksize=1000000, file_format=None):
+        """This function writes a dataset chunk by chunk.
+
+        :param out_path: This is the path of the file to write.
+        :param n_rows: This is the number of rows to write.
+        :param chunksize: This is the number of rows drawn and written at once, which bounds the memory used.
+        :param file_format: This is either 'csv' or 'parquet'. Default = guessed from the extension of out_path.
+
+        :return: n_rows: This is the number of rows written.
+        """
+        if file_format is None:
+            file_format = 'parquet' if out_path.endswith(('.parquet', '.pq')) else 'csv'
+
+        writer = None
+        try:
+            for number, start in enumerate(range(0, n_rows, chunksize)):
+                df = self.chunk(min(chunksize, n_rows - start), number)
+                logger.debug('writing rows %d to %d', start, start + len(df))
+
+                if file_format == 'parquet':
+                    import pyarrow as pa
+                    import pyarrow.parquet as pq
+
+                    table = pa.Table.from_pandas(df, preserve_index=False)
+                    if writer is None:
+                        writer = pq.ParquetWriter(out_path, table.schema)
+                    writer.write_table(table) # one row group per chunk
+                else:
+                    df.to_csv(out_path, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+        finally:
+            if writer is not None:
+                writer.close()
+
+        logger.info('%d rows written to %s', n_rows, out_path)
+
+        return n_rows
+
+
+def main():
+    """This function writes a synthetic dataset from the command line.
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Write a synthetic survey dataset built from meta.json.')
+    parser.add_argument('--rows', type=int, default=10000, help='number of rows to write')
+    parser.add_argument('--out', default='example_data.csv', help='output path, .csv or .parquet')
+    parser.add_argument('--format', default=None, choices=['csv', 'parquet'], help='default: from the extension')
+    parser.add_argument('--chunksize', type=int, default=1000000, help='rows drawn and written at once')
+    parser.add_argument('--meta', default=None, help='path to meta.json')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--typo-rate', type=float, default=.05)
+    parser.add_argument('--french-rate', type=float, default=.05)
+    parser.add_argument('--garbage-rate', type=float, default=.02)
+    parser.add_argument('--unknown-rate', type=float, default=.1)
+    args = parser.parse_args()
+
+    ins.configure_logging('INFO')
+    simulator = SurveySimulator(meta_path=args.meta, seed=args.seed, typo_rate=args.typo_rate,
+                                french_rate=args.french_rate, garbage_rate=args.garbage_rate,
+                                unknown_rate=args.unknown_rate)
+    simulator.write(args.out, args.rows, chunksize=args.chunksize, file_format=args.format)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,67 +1,176 @@
 # %load most_similar_material.py
+import numpy as np
+
+import instrument as ins
+
+logger = ins.get_logger(__name__)
+
+# matcher used by the processes of MaterialMatcher.match_many, built once per process by _init_match_worker
+_MATCHER = None
+
+
+class NoneException(Exception):
+    """Custom exception class.
+    This exception is raised when there is no synonym found.
+    """
+    pass
+
+
 def most_similar_material(input_word, vocabulary):
     """This function takes an "unknown"  word (i.e. a word outside our "dictionnary")
     as input and look for the most similar word within a list of words (our "dictionnary").
 
+    Note that this builds a new MaterialMatcher on each call. To match many words against the same vocabulary, build
+    the MaterialMatcher once and use its match or match_many functions.
+
     :param input_word: This is a string whose meaning is ambiguous and therefore needs to be matched with a word
         within our dictionnary.
     :param vocabulary: This is a list of the words included in our vocabulary, i.e we know their rank
     :return: most_similar_word: This function returns the most similar word within our list of words.
     """
-    #import packages
-    import nltk
-    from nltk.corpus import wordnet as wn
+    return(MaterialMatcher(vocabulary).match(input_word))
+
+
+class MaterialMatcher(object):
+    """This is an index of a vocabulary of known materials, used to find the material with the closest meaning to
+    an unknown word. The synsets of the vocabulary are looked up once, and the words that share exactly the same
+    synsets are grouped in a reverse index, as they are equally similar to any unknown word.
+
+    The similarity between an unknown word and a known word is the highest path similarity between any of their
+    synsets, and the match is the group of words with the highest similarity (the first one in the vocabulary in case
+    of a tie).
+    """
+
+    def __init__(self, vocabulary, synsets=None):
+        """This function builds the index.
+
+        :param vocabulary: This is a list of the words included in our vocabulary, i.e we know their rank
+        :param synsets: This is an optional function returning the list of synsets of a word. Default = wn.synsets
+        """
+        self.vocabulary = list(vocabulary)
+        self.synsets = synsets # kept to rebuild the matcher in other processes
+
+        if synsets is None:
+            from nltk.corpus import wordnet as wn
+            synsets = wn.synsets
+        self.lookup = synsets
+
+        # reverse index: synsets of a word -> the words of the vocabulary with exactly these synsets, in order
+        self.reverse = {}
+        for word in dict.fromkeys(self.vocabulary):
+            self.reverse.setdefault(tuple(self.lookup(word)), []).append(word)
+
+        # the groups with no synsets can never match, so they are left out of the arrays below
+        self.groups = [x for x in self.reverse if len(x) > 0]
+
+        # list each distinct synset once, and store the synsets of each group as positions in that list (CSR layout)
+        positions = {}
+        members = []
+        for group in self.groups:
+            members.extend([positions.setdefault(x, len(positions)) for x in group])
+        self.synset_list = list(positions)
+        self.members = np.array(members, dtype=np.int64)
+        self.indptr = np.cumsum([0] + [len(x) for x in self.groups])[:-1]
+
+    def scores(self, input_word):
+        """This function computes the similarity between an unknown word and each group of words of the vocabulary.
+
+        :param input_word: This is the string to match.
+
+        :return: scores: This is a float numpy array with the score of each group (-inf if there is no path at all).
+        """
+        sims = np.full(len(self.synset_list), -np.inf)
+        for s1 in self.lookup(input_word):
+            #note that each synset of the vocabulary is only compared once, whatever the number of words sharing it
+            for y in range(len(self.synset_list)):
+                sim = s1.path_similarity(self.synset_list[y])
+                if sim is not None and sim > sims[y]:
+                    sims[y] = sim
+
+        if len(self.groups) == 0:
+            return sims[:0]
 
-    # Verify that the input_word is a string
+        return np.maximum.reduceat(sims[self.members], self.indptr)
+
+    def match(self, input_word):
+        """This function finds the words of the vocabulary with the closest meaning to an unknown word.
+
+        :param input_word: This is a string whose meaning is ambiguous and therefore needs to be matched with a word
+            within our dictionnary.
+        :return: most_similar_word: This is a list of the most similar words within the vocabulary.
+        """
+        # Verify that the input_word is a string
+        if type(input_word) is not str:
+            class TypeException(Exception):
+                """Custom exception class.
+                This exception is raised when the input word is not a string.
+                """
+                pass
+
+            raise TypeException("The input word is not a string!")
+
+        scores = self.scores(input_word)
+
+        # We want to make sure we actually found a synonym
+        if len(scores) == 0 or scores.max() <= 0:
+            raise NoneException("No synonym found for this material")
+
+        # argmax returns the first group with the highest score
+        return(list(self.reverse[self.groups[int(np.argmax(scores))]]))
+
+    def match_many(self, input_words, n_jobs=1, chunksize=64):
+        """This function finds the most similar words of the vocabulary for a batch of unknown words.
+
+        :param input_words: This is a list or a pandas series of unknown words.
+        :param n_jobs: This is the number of processes used to match the words (-1 uses all cores). Each process
+            builds its own matcher once, and the distinct words are split between them.
+        :param chunksize: This is the number of words sent to a process at once.
+        :return: matches: This is a pandas series with the list of most similar words for each unknown word, or None
+            if the word is not a string or no synonym was found. It has the same index as input_words, if it is a series.
+        """
+        import os
+        import pandas as pd
+        from multiprocessing import Pool
+
+        words = input_words if isinstance(input_words, pd.Series) else pd.Series(list(input_words))
+        uniques = list(pd.unique(words.values)) # each distinct word is only matched once
+
+        if n_jobs is None or n_jobs < 1:
+            n_jobs = os.cpu_count()
+
+        if n_jobs == 1 or len(uniques) <= chunksize:
+            results = [_match_or_none(self, x) for x in uniques]
+        else:
+            logger.info('matching %d words in %d processes', len(uniques), n_jobs)
+            with Pool(n_jobs, initializer=_init_match_worker, initargs=(self.vocabulary, self.synsets)) as pool:
+                results = pool.map(_match_worker, uniques, chunksize=chunksize)
+
+        lookup = dict(zip(uniques, results))
+
+        return pd.Series([lookup[x] for x in words.values], index=words.index, dtype=object)
+
+
+def _match_or_none(matcher, input_word):
+    """This is a helper function for MaterialMatcher.match_many. It returns the match of a word, or None if the word is
+    not a string or has no synonym.
+    """
     if type(input_word) is not str:
-        class TypeException(Exception):
-            """Custom exception class.
-            This exception is raised when the input word is not a string.
-            """
-            pass
-
-        raise TypeException("The input word is not a string!")
-
-    # first, store each word of the vocabulary and its different meanings in a dictionary
-    vocabulary_wn = []
-    d = {}
-    for x in vocabulary:
-        vocabulary_wn.append(wn.synsets(x))
-        d[x] = wn.synsets(x)
-
-    # then, we define a function returning a key when we call its value
-    def getKeysByValue(dictOfElements, valueToFind):
-        listOfKeys = list()
-        listOfItems = dictOfElements.items()
-        for item  in listOfItems:
-            if item[1] == valueToFind:
-                listOfKeys.append(item[0])
-        return  listOfKeys
-
-    # finally, we loop through the different meanings of our new word
-    # we compare them to the different meanings of our vocabulary
-    s_list = []
-    s1 = wn.synsets(input_word)
-    maximum = 0
-    synonym = None
-    for s2 in vocabulary_wn:
-        for word1 in s1:
-            best = [word1.path_similarity(word2) for word2 in s2 if word1.path_similarity(word2) is not None]
-            b = pd.Series(best).max()
-            s_list.append(b)
-            if max(s_list) > maximum:
-                maximum = max(s_list)
-                synonym = s2
-
-    # We want to make sure we actually found a synonym
-    if synonym is None:
-        class NoneException(Exception):
-            """Custom exception class.
-            This exception is raised when there is no synonym found.
-            """
-            pass
-
-        raise NoneException("No synonym found for this material")
-
-    # We return the word with the closest meaning according to wod2vec
-    return(getKeysByValue(d,synonym))
+        return None
+
+    try:
+        return matcher.match(input_word)
+    except NoneException:
+        return None
+
+
+def _init_match_worker(vocabulary, synsets):
+    """This is a helper function for MaterialMatcher.match_many. It builds the matcher of the process once.
+    """
+    global _MATCHER
+    _MATCHER = MaterialMatcher(vocabulary, synsets=synsets)
+
+
+def _match_worker(input_word):
+    """This is a helper function for MaterialMatcher.match_many. It matches a single word in a worker process.
+    """
+    return _match_or_none(_MATCHER, input_word)
@@ -1,3 +1,10 @@
+from functools import lru_cache
+
+import instrument as ins
+
+logger = ins.get_logger(__name__)
+
+
 def filter_one_word_materials(df, base_var):
     
     """This function takes an input dataframe and returns a subset of it, where all materials described with more than one word
@@ -11,17 +18,96 @@ def filter_one_word_materials(df, base_var):
 
     """
     
-    df_one_word = df[base_var].str.get_dummies(sep=' ').T
-    df['count_word'] = df_one_word.sum()
+    import prep.prep_tokens as tok
+
+    #count the distinct words of each row, splitting each distinct material only once
+    df['count_word'] = tok.TokenTable(df[base_var]).row_counts()
     
-    if(1 not in df_one_word.sum()):
+    if not (df['count_word'] == 1).any():
+        class NoOneWordException(Exception):
+            """Custom exception class.
+
+            This exception is raised when no material is described with one word.
+
+            """
+            pass
+
         raise NoOneWordException("No material with only one word!")
 
     subset = df [df.count_word == 1]
         
     return(subset)
 
-def check_if_english(df, base_var):
+@lru_cache(maxsize=None)
+def load_lexicon(name, meta_path=None):
+    """This function loads a lexicon, i.e. the set of words of a language, that can be used to check whether the
+    materials of a survey are actual words. Each lexicon is only loaded once, and then kept in memory.
+
+    The english lexicon is the nltk words corpus. The french lexicon is built from the material labels of meta.json:
+    it is made of the words of the labels that are not english words. Note that this is a heuristic, as the labels
+    also contain a few words of other languages (e.g. portuguese) and typos, but it covers the french surveys.
+
+    :param name: This is a string indicating the lexicon to load ('english' or 'french').
+    :param meta_path: This is an optional path to meta.json. Default = the meta.json of the data directory.
+
+    :return: lexicon: This is a frozenset of the words of the lexicon.
+    """
+    if name == 'english':
+        from nltk.corpus import words
+        return frozenset(words.words())
+
+    elif name == 'french':
+        import json
+        import os
+
+        if meta_path is None:
+            meta_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data', 'meta.json')
+        with open(meta_path) as f:
+            meta_data = json.load(f)
+
+        #the first three dictionaries map the roof, floor and wall material labels to their codes
+        tokens = set()
+        for labels in meta_data[:3]:
+            for label in labels:
+                tokens.update(label.split())
+
+        return frozenset(tokens - load_lexicon('english'))
+
+    else:
+        class LexiconException(Exception):
+            """Custom exception class.
+
+            This exception is raised when the lexicon requested is not available.
+
+            """
+            pass
+
+        raise LexiconException("Unknown lexicon: " + str(name) + ", choose 'english' or 'french'")
+
+def is_in_lexicon(values, lexicons=('english',)):
+    """This function checks, for each value of a column, whether it is a word of one of the lexicons. Each distinct
+    value is only looked up once.
+
+    :param values: This is a pandas series (or a vector) of strings.
+    :param lexicons: This is a list of lexicon names (see load_lexicon), or of sets of words. Default = english only.
+
+    :return: in_lexicon: This is a boolean numpy array indicating, for each value, whether it belongs to a lexicon.
+    """
+    import pandas as pd
+    import numpy as np
+
+    lexicon_sets = [load_lexicon(x) if isinstance(x, str) else x for x in lexicons]
+
+    codes, uniques = pd.factorize(pd.Series(values))
+    found = np.array([any([x in lexicon for lexicon in lexicon_sets]) for x in uniques], dtype=bool)
+
+    #missing values (code -1) are never words
+    in_lexicon = np.zeros(len(codes), dtype=bool)
+    in_lexicon[codes >= 0] = found[codes[codes >= 0]]
+
+    return in_lexicon
+
+def check_if_english(df, base_var, lexicons=('english',)):
 
     """This function goes through a dataframe and verifies if, within the column of interest, all materials correspond to
     actual english words. As we match materials on their semantic similarity, we want to ensure that we drop typos and foreign words.
@@ -29,25 +115,133 @@ def check_if_english(df, base_var):
 
     :param df: This is a cleaned dataframe containing all the information from the surveys.
     :param base_var: The variable of interest for which some materials are unknown.
+    :param lexicons: This is an optional list of lexicons to accept (see load_lexicon), e.g. ('english', 'french')
+     to also keep the materials of the french surveys. Default = english only.
 
-    :return english_material: it returns a list of boolean indicating for each row, whether the material in base_var is described
-     using a word in english.
+    :return english_material: it returns a list of the materials in base_var that are described using a word of the
+     lexicons, in order of appearance.
 
     """
-    from nltk.corpus import words
-    from itertools import compress
+    list_material = df[base_var].unique()
 
-    list_material = df[base_var].unique().tolist()
+    english_material = list(list_material[is_in_lexicon(list_material, lexicons)])
 
-    boolean = []
-    for x in range(len(list_material)):
-        boolean.append(list_material[x] in words.words())
+    return(english_material)
 
-    english_material = list(compress(list_material, boolean))
+# scorer shared by every call that does not pass its own, so that its caches persist across corpora and cv runs
+_DEFAULT_SCORER = None
+
+# number of entries kept by each cache of a SemanticScorer, so that a long lived scorer does not grow without bound
+SCORER_CACHE_SIZE = 100000
 
-    return(english_material)
 
-def semantic_similarity_scan(unknown_list, corpus_list):
+class SemanticScorer(object):
+    """This is the scoring engine of the semantic similarity scan. The score between two strings is the sum of the
+    path similarities between every pair of their WordNet synsets. The scorer looks up the synsets of each distinct
+    string only once, computes the similarity of each pair of synsets only once, and remembers the score of each pair
+    of strings, so that it can be reused across unknown words, corpora and cross-validation runs.
+
+    Each cache keeps at most max_size entries, and forgets the least recently used ones first.
+    """
+
+    def __init__(self, synsets=None, max_size=None):
+        """This function creates an empty scorer.
+
+        :param synsets: This is an optional function returning the list of synsets of a string. Default = wn.synsets
+        :param max_size: This is the number of entries kept by each cache. Default = SCORER_CACHE_SIZE
+        """
+        from collections import OrderedDict
+
+        if synsets is None:
+            from nltk.corpus import wordnet as wn
+            synsets = wn.synsets
+
+        self.lookup = synsets
+        self.max_size = SCORER_CACHE_SIZE if max_size is None else max_size
+        self.synset_cache = OrderedDict() #string -> tuple of synsets
+        self.pair_cache = OrderedDict() #(synset, synset) -> path similarity, or None
+        self.score_cache = OrderedDict() #(string, string) -> score
+        self.n_scored = 0 #number of pairs of strings scored, ie. missing from the score cache
+
+    def _cached(self, cache, key, compute):
+        """This is a helper function for this class. It returns the value of a key from one of the caches, computing
+        and storing it if it is missing, and drops the least recently used entry when the cache is full.
+        """
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+
+        value = compute()
+        cache[key] = value
+        if len(cache) > self.max_size:
+            cache.popitem(last=False)
+
+        return value
+
+    def synsets(self, text):
+        """This function returns the synsets of a string, looking them up the first time the string is seen.
+
+        :param text: This is a string.
+
+        :return: syns: This is a tuple of the synsets of the string.
+        """
+        return self._cached(self.synset_cache, text, lambda: tuple(self.lookup(text)))
+
+    def similarity(self, s1, s2):
+        """This function returns the path similarity between two synsets, computing it the first time the pair is seen.
+
+        :param s1: This is the synset of the unknown word.
+        :param s2: This is the synset of the known word.
+
+        :return: sim: This is the path similarity of the pair, or None if there is no path between them.
+        """
+        return self._cached(self.pair_cache, (s1, s2), lambda: s1.path_similarity(s2))
+
+    def score(self, unknown_str, known_str):
+        """This function computes the semantic similarity score between an unknown word and a known word.
+
+        :param unknown_str: This is the string whose rank is unknown.
+        :param known_str: This is a string whose rank is known.
+
+        :return: score: This is the sum of the path similarities between all the synsets of the two strings.
+        """
+        def compute():
+            self.n_scored += 1
+            list_syn = self.synsets(known_str)
+            score = 0
+            #note that the sum is done in the same order as before, so that the float scores are identical
+            for s1 in self.synsets(unknown_str):
+                sims = [self.similarity(s1, s2) for s2 in list_syn]
+                score = score + sum([sim for sim in sims if sim is not None])
+            return score
+
+        return self._cached(self.score_cache, (unknown_str, known_str), compute)
+
+    def score_corpus(self, unknown_str, corpus):
+        """This function computes the scores between an unknown word and every word of a corpus.
+
+        :param unknown_str: This is the string whose rank is unknown.
+        :param corpus: This is a list of strings whose rank is known.
+
+        :return: scores: This is a list of the scores of each word of the corpus.
+        """
+        return [self.score(unknown_str, known_str) for known_str in corpus]
+
+
+def default_scorer():
+    """This is a helper function for this module. It returns the SemanticScorer shared by every call of
+    semantic_similarity_scan that does not pass its own scorer, creating it on first use.
+
+    :return: scorer: This is the shared SemanticScorer.
+    """
+    global _DEFAULT_SCORER
+    if _DEFAULT_SCORER is None:
+        _DEFAULT_SCORER = SemanticScorer()
+
+    return _DEFAULT_SCORER
+
+@ins.timed('scan', engine='semantic')
+def semantic_similarity_scan(unknown_list, corpus_list, scorer=None):
 
     """This function takes a list of materials for which the rank is unknown (i.e. a word outside our "dictionnary")
     as input and calculates a score of semantic similarity with each word of the list of known material (our "dictionnary").
@@ -55,6 +249,8 @@ def semantic_similarity_scan(unknown_list, corpus_list):
     :param df: unknown_list: This is a list of strings whose rank is unknown
     :param corpus_list: This is a list of the strings for which the rank is known. The strings are classified
      within one of three categories of materials.
+    :param scorer: This is an optional SemanticScorer whose caches are used and filled by the scan. Default = a scorer
+     shared by every call, so that the synsets and scores computed by a previous call are reused.
 
     :return distrib: The distribution of the similarity scores between each unknown material in the unknown list and known material
      in the corpus_list.
@@ -62,36 +258,22 @@ def semantic_similarity_scan(unknown_list, corpus_list):
     """
 
     import pandas as pd
-    import numpy as np
-    import nltk
-    from nltk.corpus import wordnet as wn
-    from fuzzywuzzy import fuzz
-    from fuzzywuzzy import process
+
+    if scorer is None:
+        scorer = default_scorer()
+    n_scored = scorer.n_scored
 
     distrib = []
 
         #loop over each unknown string
     for x in range(len(unknown_list)):
         unknown_str = unknown_list[x]
-        print('analyzing...', unknown_str)
-        unknw_syn = wn.synsets(unknown_str)
+        logger.debug('analyzing... %s', unknown_str)
         out = []
         #loop over each corpus to compute similarity scores for all words in a given housing quality score
         for y in range(len(corpus_list)):
-            print('~>corpus#', y)
-            corpus = corpus_list[y]
-
-
-            scores = []
-                #loop over each word and compute the similarity score
-            for z in range(len(corpus)): #tqdm=progress bar
-                list_syn = wn.synsets(corpus[z])
-                score = 0
-                for s1 in unknw_syn:
-                    score = score + sum([s1.path_similarity(s2) for s2 in list_syn if s1.path_similarity(s2) is not None])
-                scores.append(score)
-
-            out.append(scores) #append scores to create a distribution for the entire corpus
+            logger.debug('~>corpus# %d', y)
+            out.append(scorer.score_corpus(unknown_str, corpus_list[y])) #distribution for the entire corpus
 
             #append distributions of scores
         distrib.append(pd.DataFrame({'word': unknown_str,
@@ -99,8 +281,15 @@ def semantic_similarity_scan(unknown_list, corpus_list):
                                     'rudimentary':pd.Series(out[1]),
                                     'finished':pd.Series(out[2]) #note series method used to overcome differing lengths
                                     }))
+
+    #the pairs that were not in the cache when they were needed were scored by the scan
+    n_scored = scorer.n_scored - n_scored
+    ins.count('pairs_scored', n_scored)
+    ins.count('cache_hits', len(unknown_list) * sum([len(x) for x in corpus_list]) - n_scored)
+
     return(pd.concat(distrib))
 
+@ins.timed('cv', engine='semantic')
 def fuzzy_semantic_cv(cv_list, base_var, rank_dictionary, subset=None, threshold=.5):
 
     #import packages
@@ -123,11 +312,12 @@ def fuzzy_semantic_cv(cv_list, base_var, rank_dictionary, subset=None, threshold
     
     #create lists to store loop outputs
     cv_distrib = []
+    scorer = sem.SemanticScorer() #shared by every cv run, so each pair of words is only scored once
     
     #loop over each cross validation:
     for i in range(len(cv_list)):
         
-        print('working on cv loop #', i)
+        logger.debug('working on cv loop # %d', i)
         df = cv_list[i].copy() #subset the cv list to the current df
 
         #build corpus of known and unknown strings
@@ -140,7 +330,7 @@ def fuzzy_semantic_cv(cv_list, base_var, rank_dictionary, subset=None, threshold
             idk_strings = idk_strings[subset]
         
         #find distribution of scores for each string
-        distrib = sem.semantic_similarity_scan(idk_strings, str_list_unique)
+        distrib = sem.semantic_similarity_scan(idk_strings, str_list_unique, scorer=scorer)
         
         #append results to prep for next loop
         cv_distrib.append(distrib)
@@ -1,3 +1,8 @@
+import instrument as ins
+
+logger = ins.get_logger(__name__)
+
+
 def semantic_similarity_scan(unknown_list, corpus_list):
     """This function takes a list of materials for which the rank is unknown (i.e. a word outside our "dictionnary")
     as input and calculates a score of semantic similarity with each word of the list of known material (our "dictionnary").
@@ -21,12 +26,12 @@ def semantic_similarity_scan(unknown_list, corpus_list):
         #loop over each unknown string
     for x in range(len(unknown_list)):
         unknown_str = unknown_list[x]
-        print('analyzing...', unknown_str)
+        logger.debug('analyzing... %s', unknown_str)
         unknw_syn = wn.synsets(unknown_str)
         out = []
         #loop over each corpus to compute similarity scores for all words in a given housing quality score
         for y in range(len(corpus_list)):
-            print('~>corpus#', y)
+            logger.debug('~>corpus# %d', y)
             corpus = corpus_list[y]
 
 
@@ -0,0 +1,159 @@
+#write tests
+"""This is a module used to test the cross-validation functions, including fuzzy_cv and fuzzy_cv_parallel.
+
+fuzzy_cv_parallel runs each cross-validation df in a separate process. Here, it is tested by verifying that it returns
+exactly the same results, in the same order, as the serial fuzzy_cv.
+
+cv_censor_index returns lightweight folds instead of full copies of the df. Here, it is tested by verifying that the
+folds censor the expected rows, and give the same cross-validation results as the dfs they stand for.
+"""
+# import packages
+import pytest
+import pandas as pd
+import numpy as np
+
+#import custom modules fpr testing
+import sys
+sys.path.append('.')
+import model.cv as fzcv
+import prep.prep_cv as pcv
+
+#set globals for tests
+PRED_DICT = {'natural':'1', 'rudimentary':'2', 'finished':'3'} #map categories back to ranks
+
+#simulate a df in which some of the known words are censored in each cross-validation run
+DF_SIM = pd.DataFrame({'piggy': ['straw', 'straws', 'stick', 'sticks', 'brick', 'bricks', 'brickz', 'stickz'] * 5,
+                       'piggy_rank_og': ['1', '1', '2', '2', '3', '3', '3', '2'] * 5})
+
+def simulate_cv(reps):
+    """This function builds a list of cross-validation dfs from the simulated df, censoring a different set of rows in
+    each of them.
+    """
+    cv_list = []
+    for x in range(reps):
+        df = DF_SIM.copy()
+        df['train'] = np.where(np.arange(len(df)) % reps == x, 0, 1)
+        df['piggy_rank'] = np.where(df['train'] == 1, df['piggy_rank_og'], np.nan)
+        cv_list.append(df)
+
+    return cv_list
+
+def test_fuzzy_cv_parallel():
+    """This function tests that running the cross-validation dfs in parallel returns the same four lists as fuzzy_cv.
+    """
+    cv_list = simulate_cv(3)
+
+    serial = fzcv.fuzzy_cv(cv_list, 'piggy', PRED_DICT)
+    parallel = fzcv.fuzzy_cv_parallel(cv_list, 'piggy', PRED_DICT, n_jobs=2)
+
+    for serial_list, parallel_list in zip(serial, parallel):
+        assert len(serial_list) == len(parallel_list) == len(cv_list)
+        for x, y in zip(serial_list, parallel_list):
+            pd.testing.assert_frame_equal(x, y)
+
+
+def censor_reference(df, colname, pct, reps):
+    """This function is a copy of the original cv_censor_col, which censored a full copy of the df with update() and a
+    placeholder value. It is kept as an independent reference for the folds. Note that the placeholder is replaced by
+    assignment, because an inplace replace on the column is a no-op under copy-on-write pandas.
+    """
+    out = []
+    for x in range(reps):
+        new_df = df.copy()
+        new_df[colname + '_og'] = new_df[colname]
+        new_df['train'] = 1
+
+        df_censor = new_df.sample(frac=pct)
+        df_censor['train'] = 0
+        df_censor[colname] = "replace_me"
+        new_df.update(df_censor, overwrite=True)
+        new_df[colname] = new_df[colname].replace("replace_me", np.nan)
+
+        out.append(new_df)
+
+    return out
+
+def test_cv_censor_index():
+    """This function tests that each fold censors the expected fraction of rows, and that its df matches the one built
+    by the original update() based censoring from the same random draws.
+    """
+    df = DF_SIM.rename(columns={'piggy_rank_og': 'piggy_rank'})
+
+    np.random.seed(0)
+    folds = pcv.cv_censor_index(df, 'piggy_rank', pct=.25, reps=2)
+    np.random.seed(0)
+    frames = pcv.cv_censor_col(df, 'piggy_rank', pct=.25, reps=2)
+    np.random.seed(0)
+    expected = censor_reference(df, 'piggy_rank', pct=.25, reps=2)
+
+    for fold, frame, reference in zip(folds, frames, expected):
+        assert fold.censored.sum() == len(df) // 4
+        assert (fold.train == 1 - fold.censored).all()
+        assert df.equals(fold.df) #the original df is never modified
+
+        #the same rows should be censored, with the same values in every column
+        assert (fold.censored == (reference['train'] == 0).values).all()
+        pd.testing.assert_frame_equal(frame, reference)
+        pd.testing.assert_frame_equal(fold.to_frame(), frame)
+        assert frame.loc[frame['train'] == 0, 'piggy_rank'].isnull().all()
+        assert (frame['piggy_rank_og'] == df['piggy_rank']).all()
+
+def test_fuzzy_cv_folds():
+    """This function tests that running fuzzy_cv on lightweight folds gives the same predictions as running it on the
+    dfs they stand for.
+    """
+    df = DF_SIM.rename(columns={'piggy_rank_og': 'piggy_rank'})
+
+    np.random.seed(0)
+    folds = pcv.cv_censor_index(df, 'piggy_rank', pct=.25, reps=2)
+    frames = [fold.to_frame() for fold in folds]
+
+    from_folds = fzcv.fuzzy_cv(folds, 'piggy', PRED_DICT)
+    from_frames = fzcv.fuzzy_cv(frames, 'piggy', PRED_DICT)
+
+    for x, y in zip(from_folds[1], from_frames[1]):
+        pd.testing.assert_frame_equal(x, y)
+    for x, y in zip(from_folds[3], from_frames[3]):
+        pd.testing.assert_frame_equal(x, y)
+
+def test_fuzzy_cv_fused():
+    """This function tests that the fused mode returns the same predictions and test rows as the default mode, and
+    that the test rows get the same columns as the merge they replace.
+    """
+    cv_list = simulate_cv(3)
+
+    default = fzcv.fuzzy_cv(cv_list, 'piggy', PRED_DICT)
+    fused = fzcv.fuzzy_cv(cv_list, 'piggy', PRED_DICT, fused=True)
+    parallel = fzcv.fuzzy_cv_parallel(cv_list, 'piggy', PRED_DICT, n_jobs=2, fused=True)
+
+    assert fused[0] == [None] * 3 #the distributions are never built
+    for x in range(3):
+        pd.testing.assert_frame_equal(fused[1][x], default[1][x])
+        pd.testing.assert_frame_equal(fused[2][x], default[2][x])
+        pd.testing.assert_frame_equal(fused[3][x], default[3][x])
+        pd.testing.assert_frame_equal(parallel[3][x], default[3][x])
+
+def test_fuzzy_cv_engine(monkeypatch):
+    """This function tests that the scoring engine chosen for the cv runs is passed down to the scans, in every mode
+    and in the worker processes.
+    """
+    import model.fuzzy as fz
+
+    cv_list = simulate_cv(2)
+    monkeypatch.delenv('HP_FUZZY_ENGINE', raising=False)
+
+    #an unknown engine should reach the scoring function whatever the mode
+    for options in [{}, {'compact': True}, {'fused': True}]:
+        with pytest.raises(ValueError, match='bogus'):
+            fzcv.fuzzy_cv(cv_list, 'piggy', PRED_DICT, engine='bogus', **options)
+    with pytest.raises(ValueError, match='bogus'):
+        fzcv.fuzzy_cv_parallel(cv_list, 'piggy', PRED_DICT, n_jobs=2, engine='bogus')
+
+    #the runs with rapidfuzz should match the scans with rapidfuzz, in the current process and in the workers
+    serial = fzcv.fuzzy_cv(cv_list, 'piggy', PRED_DICT, engine='rapidfuzz')
+    parallel = fzcv.fuzzy_cv_parallel(cv_list, 'piggy', PRED_DICT, n_jobs=2, engine='rapidfuzz', fused=True)
+    for x in range(2):
+        expected = fz.fuzzy_scan(serial[0][x]['word'].unique(), fz.build_corpus(cv_list[x], 'piggy', 'piggy_rank',
+                                                                               ['1', '2', '3'])[0], engine='rapidfuzz')
+        pd.testing.assert_frame_equal(serial[0][x], expected)
+        pd.testing.assert_frame_equal(parallel[3][x], serial[3][x])
@@ -0,0 +1,277 @@
+#write tests
+"""This is a module used to test the scoring engine behind the fuzzy model, including score_matrix and the
+fuzzy_scan wrapper built on top of it.
+
+score_matrix computes the whole matrix of similarity scores between a list of unknown words and a corpus in one call.
+Here, this functionality is tested by comparing it against pairwise calls to fuzzywuzzy, and by verifying that
+fuzzy_scan still returns the long format df that fuzzy_predict expects.
+
+CorpusIndex skips the pairs of words that cannot reach the similarity cutoff. Here, it is tested by verifying that its
+predictions are identical to the ones computed from the full distribution of scores.
+
+SimilarityCache stores the scores of the pairs of words that were already compared. Here, it is tested by verifying
+that a cached scan returns the same scores and only computes the pairs that it has never seen.
+
+TfidfIndex scores the unknown words with a sparse product of character n-gram TF-IDF vectors. Here, it is tested by
+verifying that its predictions match fuzzy_predict on its full distribution, and that typos find their known word.
+"""
+# import packages
+import pytest
+import pandas as pd
+import numpy as np
+
+#import custom modules fpr testing
+import sys
+sys.path.append('.')
+import model.fuzzy as fz
+import model.fuzzy_index as fi
+import model.sim_cache as sc
+import model.tfidf as tf
+
+#set globals for tests
+STRAWS = np.array(['straw', 'straws', 'straw', 'grass'], dtype=object)
+STICKS = np.array(['stick', 'sticks', 'wood planks'], dtype=object)
+BRICKS = np.array(['brick', 'bricks', 'cement bricks', 'brick', 'cement', 'cement'], dtype=object)
+UNKNOWN = np.array(['brickz', 'stickz', 'strawz', 'Cément!'], dtype=object)
+
+RANK_DICT = {'natural':1, 'rudimentary':2, 'finished':3}
+
+def test_score_matrix():
+    """This function tests that the score matrix has the expected shape and that each score matches the WRatio that
+    fuzzywuzzy computes for the same pair of words.
+    """
+    from fuzzywuzzy import fuzz
+
+    scores = fz.score_matrix(UNKNOWN, BRICKS, engine='fuzzywuzzy')
+
+    #the output matrix should be unknown x corpus
+    assert scores.shape == (len(UNKNOWN), len(BRICKS)), "score matrix is not the correct shape"
+
+    #every score should match the one computed by the pairwise function
+    for x in range(len(UNKNOWN)):
+        for y in range(len(BRICKS)):
+            assert scores[x, y] == fuzz.WRatio(UNKNOWN[x], BRICKS[y]), "score matrix does not match WRatio"
+
+def test_default_engine(monkeypatch):
+    """This function tests that fuzzywuzzy stays the default scoring engine, and measures how often the scores of
+    rapidfuzz, which has to be asked for, disagree with it on random pairs of words.
+    """
+    monkeypatch.delenv('HP_FUZZY_ENGINE', raising=False)
+    assert fz.default_engine() == 'fuzzywuzzy'
+    monkeypatch.setenv('HP_FUZZY_ENGINE', 'rapidfuzz')
+    assert fz.default_engine() == 'rapidfuzz'
+    monkeypatch.setenv('HP_FUZZY_ENGINE', 'levenshtein')
+    with pytest.raises(ValueError):
+        fz.default_engine()
+    monkeypatch.delenv('HP_FUZZY_ENGINE')
+
+    #the default scores should be the ones of fuzzywuzzy, including on a pair where the engines disagree a lot
+    pair = fz.score_matrix(['gstone tiled'], ['xg'])
+    assert pair[0, 0] == 14
+    assert fz.score_matrix(['gstone tiled'], ['xg'], engine='rapidfuzz')[0, 0] == 60
+
+    #build random words from material names, with typos
+    rng = np.random.RandomState(0)
+    words = ['straw', 'stick', 'brick', 'cement', 'stone', 'tiled', 'wood planks', 'mud', 'zinc', 'thatch']
+    def noisy():
+        word = ' '.join(rng.choice(words, rng.randint(1, 3)))
+        i = rng.randint(len(word))
+        return word[:i] + rng.choice(list('abcdefghijklmnopqrstuvwxyz')) + word[i + 1:]
+    unknown = [noisy() for x in range(60)]
+    corpus = [noisy() for x in range(60)]
+
+    fuzzywuzzy = fz.score_matrix(unknown, corpus).astype(int)
+    rapidfuzz = fz.score_matrix(unknown, corpus, engine='rapidfuzz').astype(int)
+
+    #the engines should disagree on a sizeable share of the pairs, and some pairs should cross the cutoff
+    differ = (fuzzywuzzy != rapidfuzz).mean()
+    cross = ((fuzzywuzzy > 75) != (rapidfuzz > 75)).mean()
+    assert .2 < differ < .6, "unexpected share of different scores: " + str(differ)
+    assert 0 < cross < .1, "unexpected share of pairs crossing the cutoff: " + str(cross)
+    assert np.abs(fuzzywuzzy - rapidfuzz).max() > 10
+
+def test_fuzzy_scan_format():
+    """This function tests that fuzzy_scan returns the long format df, padded to the length of the longest corpus.
+    """
+    corpus_list = [STRAWS, STICKS, BRICKS]
+    distrib = fz.fuzzy_scan(UNKNOWN, corpus_list)
+
+    #the output df should have one block per unknown word, as long as the longest corpus
+    assert len(distrib) == len(UNKNOWN) * len(BRICKS), "the output distribution df is not the correct length"
+    assert list(distrib.columns) == ['word'] + fz.RANK_NAMES, "the output distribution df has the wrong columns"
+
+    #the shorter corpora should be padded with NaN
+    assert distrib['rudimentary'].isnull().sum() == len(UNKNOWN) * (len(BRICKS) - len(STICKS))
+
+    #predict class based on probability of exceeding similarity cutoff of 75
+    preds = fz.fuzzy_predict(distrib, fz.RANK_NAMES, 'word', 75, RANK_DICT)
+    assert preds.loc['brickz', 'pred'] == 3
+    assert preds.loc['stickz', 'pred'] == 2
+    assert preds.loc['strawz', 'pred'] == 1
+
+def test_compact_corpus():
+    """This function tests that the compact form of each corpus keeps every unique word with its count, and that the
+    predictions made from the compact scan are identical to the ones made from the full scan.
+    """
+    corpus_list = [STRAWS, STICKS, BRICKS]
+    compact_list = fz.compact_corpus(corpus_list)
+
+    #each compact corpus should hold each unique word once, and the counts should add up to the corpus length
+    for corpus, (words, counts) in zip(corpus_list, compact_list):
+        assert len(words) == len(set(corpus)), "compact corpus contains duplicate words"
+        assert counts.sum() == len(corpus), "compact corpus counts do not add up to the corpus length"
+
+    #the predictions should match the ones made from the full distribution for every cutoff
+    distrib = fz.fuzzy_scan(UNKNOWN, corpus_list)
+    distrib_compact = fz.fuzzy_scan_compact(UNKNOWN, compact_list)
+    for cutoff in [50, 75, 90]:
+        preds = fz.fuzzy_predict(distrib, fz.RANK_NAMES, 'word', cutoff, RANK_DICT)
+        preds_compact = fz.fuzzy_predict(distrib_compact, fz.RANK_NAMES, 'word', cutoff, RANK_DICT, weight='count')
+        pd.testing.assert_frame_equal(preds, preds_compact)
+
+def test_parallel_scan():
+    """This function tests that splitting the unknown words across a pool of processes returns exactly the same
+    distribution, in the same order, as the serial scan.
+    """
+    corpus_list = [STRAWS, STICKS, BRICKS]
+    unknown = np.concatenate([UNKNOWN, STRAWS, STICKS, BRICKS])
+
+    distrib = fz.fuzzy_scan(unknown, corpus_list)
+    distrib_parallel = fz.fuzzy_scan(unknown, corpus_list, n_jobs=3)
+
+    pd.testing.assert_frame_equal(distrib, distrib_parallel)
+
+def test_corpus_index():
+    """This function tests that the pruned index returns exactly the same predictions as the full scan, and that it
+    actually skips some of the pairs.
+    """
+    compact_list = fz.compact_corpus([STRAWS, STICKS, BRICKS])
+    unknown = np.concatenate([UNKNOWN, ['mud bricks', 'cement blocks', 'bamboo sticks', 'zinc']])
+
+    index = fi.CorpusIndex(compact_list)
+    distrib = fz.fuzzy_scan_compact(unknown, compact_list)
+
+    for cutoff in [50, 75, 90]:
+        preds = fz.fuzzy_predict(distrib, fz.RANK_NAMES, 'word', cutoff, RANK_DICT, weight='count')
+        pd.testing.assert_frame_equal(preds, index.predict(unknown, cutoff, RANK_DICT))
+
+    assert index.n_pruned > 0, "the index did not skip any pair"
+
+def test_corpus_index_variants():
+    """This function tests that the index merges the words that only differ by their case or punctuation, which are
+    the same string once processed, and still returns the predictions of the full scan.
+    """
+    corpus_list = [np.array(['straw', 'Straw', 'grass'], dtype=object), np.array(['stick'], dtype=object),
+                   np.array(['brick', 'Brick!', 'cement'], dtype=object)]
+    compact_list = fz.compact_corpus(corpus_list)
+    unknown = np.array(['strw', 'brik'], dtype=object)
+
+    index = fi.CorpusIndex(compact_list)
+    assert [len(x['strings']) for x in index.corpora] == [2, 1, 2], "the processed variants were not merged"
+    assert [int(x['counts'].sum()) for x in index.corpora] == [3, 1, 3], "the counts of the variants were lost"
+
+    distrib = fz.fuzzy_scan(unknown, corpus_list)
+    for cutoff in [50, 75, 90]:
+        expected = fz.fuzzy_predict(distrib, fz.RANK_NAMES, 'word', cutoff, RANK_DICT)
+        pd.testing.assert_frame_equal(index.predict(unknown, cutoff, RANK_DICT), expected)
+        result = fz.fuzzy_scan_predict(unknown, compact_list, cutoff, RANK_DICT, compact=True, index=True)
+        pd.testing.assert_frame_equal(result, expected)
+
+def test_similarity_cache(tmp_path):
+    """This function tests that scanning through the cache returns the same distribution as the regular scan, and that
+    a second scan, even from a new connection to the same database, finds every pair in the cache.
+    """
+    corpus_list = [STRAWS, STICKS, BRICKS]
+    path = str(tmp_path / 'scores.sqlite')
+
+    cache = sc.SimilarityCache(path)
+    distrib = fz.fuzzy_scan(UNKNOWN, corpus_list)
+    pd.testing.assert_frame_equal(distrib, fz.fuzzy_scan(UNKNOWN, corpus_list, cache=cache))
+
+    #each distinct pair of processed words should have been stored once
+    assert cache.hits == 0
+    assert len(cache) == len(UNKNOWN) * len(set(np.concatenate(corpus_list)))
+    cache.close()
+
+    #a new connection should find every pair, including when scanning in parallel
+    cache = sc.SimilarityCache(path)
+    pd.testing.assert_frame_equal(distrib, fz.fuzzy_scan(UNKNOWN, corpus_list, cache=cache, n_jobs=2))
+    assert cache.misses == 0, "pairs were scored again"
+
+def test_similarity_cache_variants(tmp_path):
+    """This function tests that unknown words that share a processed string all get their scores from an empty cache,
+    and that the cached predictions match the uncached ones.
+    """
+    corpus_list = [STRAWS, STICKS, BRICKS]
+    unknown = np.array(['Brick!', 'brick', 'cement', 'cement ', 'Straw', 'strawz'], dtype=object)
+
+    cache = sc.SimilarityCache(str(tmp_path / 'scores.sqlite'))
+    distrib = fz.fuzzy_scan(unknown, corpus_list)
+    pd.testing.assert_frame_equal(distrib, fz.fuzzy_scan(unknown, corpus_list, cache=cache))
+
+    cache = sc.SimilarityCache(str(tmp_path / 'predict.sqlite'))
+    for cutoff in [50, 75, 90]:
+        expected = fz.fuzzy_predict(distrib, fz.RANK_NAMES, 'word', cutoff, RANK_DICT)
+        pd.testing.assert_frame_equal(fz.fuzzy_scan_predict(unknown, corpus_list, cutoff, RANK_DICT, cache=cache),
+                                      expected)
+
+def test_tfidf_index():
+    """This function tests that the TF-IDF predictions match fuzzy_predict applied to the full distribution of scores,
+    and that the nearest known word of each misspelled word is the word it was misspelled from.
+    """
+    compact = fz.compact_corpus([STRAWS, STICKS, BRICKS])
+    index = tf.TfidfIndex(compact, chunksize=3) #chunks smaller than the list of unknown words
+    distrib = tf.tfidf_scan(UNKNOWN, compact, index=index)
+
+    assert len(distrib) == len(UNKNOWN) * sum([len(x[0]) for x in compact])
+    for cutoff in [10, 50, 80]:
+        expected = fz.fuzzy_predict(distrib, fz.RANK_NAMES, 'word', cutoff, RANK_DICT, weight='count')
+        pd.testing.assert_frame_equal(index.predict(UNKNOWN, cutoff, RANK_DICT), expected)
+
+    nearest = index.nearest(UNKNOWN, k=1)
+    best = nearest.sort_values('score').groupby('word')['match'].last()
+    assert best.to_dict() == {'brickz': 'brick', 'stickz': 'stick', 'strawz': 'straw', 'Cément!': 'cement'}
+    assert nearest.groupby(['word', 'rank']).size().max() == 1
+
+def test_fuzzy_scan_predict(tmp_path):
+    """This function tests that the fused scan returns the predictions of fuzzy_predict on the full distribution, in
+    chunks, in parallel, through the corpus index and through the similarity cache.
+    """
+    corpus_list = [STRAWS, STICKS, BRICKS]
+    unknown = np.concatenate([UNKNOWN, ['brick', 'wood']]).astype(object)
+    cache = sc.SimilarityCache(str(tmp_path / 'scores.db'))
+
+    for cutoff in [50, 75, 90]:
+        expected = fz.fuzzy_predict(fz.fuzzy_scan(unknown, corpus_list), fz.RANK_NAMES, 'word', cutoff, RANK_DICT)
+        for options in [{}, {'chunksize': 2}, {'chunksize': 2, 'n_jobs': 2}, {'index': True}, {'cache': cache}]:
+            result = fz.fuzzy_scan_predict(unknown, corpus_list, cutoff, RANK_DICT, **options)
+            pd.testing.assert_frame_equal(result, expected)
+
+def test_fuzzy_scan_predict_mixed_types():
+    """This function tests that the fused scan handles a list of unknown words that mixes strings with floats and
+    missing values, and repeats some words, like fuzzy_predict does.
+    """
+    corpus_list = [STRAWS, STICKS, BRICKS]
+    unknown = np.array(['brickz', np.nan, 'strawz', 1.5, 'brick', 'strawz'], dtype=object)
+
+    for cutoff in [50, 75]:
+        expected = fz.fuzzy_predict(fz.fuzzy_scan(unknown, corpus_list), fz.RANK_NAMES, 'word', cutoff, RANK_DICT)
+        for options in [{}, {'chunksize': 2, 'n_jobs': 2}]:
+            result = fz.fuzzy_scan_predict(unknown, corpus_list, cutoff, RANK_DICT, **options)
+            pd.testing.assert_frame_equal(result, expected)
+
+def test_index_mixed_types():
+    """This function tests that the corpus index and the TF-IDF index handle a list of unknown words that mixes
+    strings with floats and missing values, like fuzzy_predict does.
+    """
+    compact = fz.compact_corpus([STRAWS, STICKS, BRICKS])
+    unknown = np.array(['brickz', np.nan, 'strawz', 1.5, 'brick', 'strawz'], dtype=object)
+
+    distrib = fz.fuzzy_scan_compact(unknown, compact)
+    expected = fz.fuzzy_predict(distrib, fz.RANK_NAMES, 'word', 75, RANK_DICT, weight='count')
+    pd.testing.assert_frame_equal(fi.CorpusIndex(compact).predict(unknown, 75, RANK_DICT), expected)
+
+    index = tf.TfidfIndex(compact)
+    distrib = tf.tfidf_scan(unknown, compact, index=index)
+    expected = fz.fuzzy_predict(distrib, fz.RANK_NAMES, 'word', 50, RANK_DICT, weight='count')
+    pd.testing.assert_frame_equal(index.predict(unknown, 50, RANK_DICT), expected)
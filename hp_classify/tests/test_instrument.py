@@ -0,0 +1,140 @@
+#write tests
+"""This is a module used to test the instrumentation of the pipeline, including Recorder, configure_logging and the
+counters recorded by the fuzzy and prep modules.
+
+Recorder records the wall time, CPU time and memory of each stage, and the work counted inside it. Here, it is tested by
+running nested stages, by verifying that the profiling switches write their outputs, that the metrics can be dumped as
+JSON, and that the pipeline functions count the pairs they score and the rows they drop.
+"""
+# import packages
+import io
+import json
+import logging
+import pstats
+import time
+
+import pytest
+import pandas as pd
+import numpy as np
+
+#import custom modules fpr testing
+import sys
+sys.path.append('.')
+import instrument as ins
+import model.fuzzy as fz
+import prep.prep_data as prep
+
+def test_stage():
+    """This function tests that nested stages are timed, and that the counters go to the innermost stage."""
+    rec = ins.Recorder()
+
+    with rec.stage('outer', file='x.csv') as outer:
+        rec.count('rows_dropped', 3)
+        with rec.stage('inner'):
+            time.sleep(.01)
+            rec.count('pairs_scored', 10)
+        with rec.stage('inner'):
+            rec.count('pairs_scored', 5)
+
+    assert outer['file'] == 'x.csv' and outer['parent'] is None
+    assert outer['wall_s'] >= .01 and outer['cpu_s'] >= 0
+    assert outer['counters'] == {'rows_dropped': 3}
+    assert [x['parent'] for x in rec.records] == ['outer', 'outer', None]
+
+    summary = rec.summary()
+    assert summary['inner']['calls'] == 2 and summary['outer']['calls'] == 1
+    assert summary['inner']['counters'] == {'pairs_scored': 15}
+    assert rec.counters == {'rows_dropped': 3, 'pairs_scored': 15}
+    if ins.peak_rss() is not None:
+        assert summary['outer']['peak_rss'] > 0
+
+def test_stage_error():
+    """This function tests that a stage is recorded even when its block raises."""
+    rec = ins.Recorder()
+
+    with pytest.raises(ValueError):
+        with rec.stage('read'):
+            raise ValueError('bad file')
+
+    assert rec.summary()['read']['calls'] == 1
+
+def test_timed_and_records_bound():
+    """This function tests the decorator, and that only the most recent records are kept."""
+    rec = ins.Recorder(max_records=5)
+
+    @rec.timed('scan', engine='test')
+    def scan(x):
+        """Docstring of scan."""
+        return x * 2
+
+    assert [scan(x) for x in range(8)] == [x * 2 for x in range(8)]
+    assert scan.__doc__ == 'Docstring of scan.'
+    assert len(rec.records) == 5 and rec.summary()['scan']['calls'] == 8
+    assert rec.records[0]['engine'] == 'test' and rec.records[0]['function'].endswith('.scan')
+
+def test_profile_switches(tmp_path):
+    """This function tests that the profiled stage writes a cProfile file and the traced stage its memory peak."""
+    rec = ins.Recorder()
+    rec.configure(profile=['fit'], trace_memory=['clean'], profile_dir=str(tmp_path))
+
+    with rec.stage('fit') as fit:
+        sorted(np.random.uniform(size=1000))
+    with rec.stage('clean') as clean:
+        x = np.ones(1000000)
+    with rec.stage('read') as read:
+        pass
+
+    assert pstats.Stats(fit['profile']).total_calls > 0
+    assert clean['traced_peak'] >= x.nbytes and len(clean['traced_top']) > 0
+    assert 'profile' not in read and 'traced_peak' not in read
+
+def test_dump(tmp_path):
+    """This function tests that the metrics are written as JSON."""
+    rec = ins.Recorder()
+    with rec.stage('predict'):
+        rec.count('pairs_scored', 7)
+
+    path = rec.dump(str(tmp_path / 'metrics.json'))
+    with open(path) as f:
+        metrics = json.load(f)
+
+    assert metrics['counters'] == {'pairs_scored': 7}
+    assert metrics['stages']['predict']['calls'] == 1
+    assert metrics['records'][0]['stage'] == 'predict'
+    assert set(['started', 'duration_s', 'argv', 'peak_rss']) <= set(metrics['run'])
+
+def test_configure_logging():
+    """This function tests that the messages of the package are sent to the stream, above the level chosen."""
+    stream = io.StringIO()
+    ins.configure_logging('INFO', stream=stream)
+    try:
+        ins.get_logger('test').info('shown')
+        ins.get_logger('test').debug('hidden')
+        ins.configure_logging('INFO', stream=stream) #a second call does not duplicate the messages
+        ins.get_logger('test').info('once')
+    finally:
+        root = logging.getLogger(ins.LOGGER_NAME)
+        for handler in [x for x in root.handlers if getattr(x, '_hp_classify', False)]:
+            root.removeHandler(handler)
+        root.setLevel(logging.NOTSET)
+
+    assert 'shown' in stream.getvalue() and 'hidden' not in stream.getvalue()
+    assert stream.getvalue().count('once') == 1
+
+def test_pipeline_counters():
+    """This function tests that the pipeline records its stages, the pairs it scores and the rows it drops."""
+    ins.reset()
+
+    df_sim = pd.DataFrame({'piggy': ['straw', 'straws', 'stick', 'sticks', 'brick', 'bricks', 'brickz'],
+                           'piggy_rank': [1, 1, 2, 2, 3, 3, np.nan]})
+    str_list, idk_strings = fz.build_corpus(df_sim, 'piggy', 'piggy_rank', [1, 2, 3])
+    fz.fuzzy_scan(idk_strings, str_list)
+
+    df_num = pd.DataFrame({'housing_roof_num': [11, 22, 99, 0], 'housing_wall_num': [31, 33, 12, '?']})
+    prep.rank_columns(df_num, ['roof', 'wall'])
+
+    summary = ins.summary()
+    assert summary['corpus']['calls'] == 1
+    assert summary['scan']['counters']['pairs_scored'] == 1 * 6
+    assert summary['rank']['counters']['rows_dropped'] == 2
+    ins.reset()
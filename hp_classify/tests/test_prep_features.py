@@ -0,0 +1,171 @@
+#write tests
+"""This is a module used to test the functions that prepare the features of the random forest model, including
+rank_columns and extract_ranking.
+
+rank_columns ranks every _num column at once. Here, it is tested by comparing it to the column by column ranking it
+replaces, and by verifying that invalid codes are dropped. extract_ranking is tested by verifying that it still returns
+the first digit of each code as a string.
+"""
+# import packages
+import pytest
+import pandas as pd
+import numpy as np
+import warnings
+
+#import custom modules fpr testing
+import sys
+sys.path.append('.')
+import prep.prep_data as prep
+
+#simulate a df of numeric codes, some of which are out of range or missing
+RNG = np.random.RandomState(0)
+N_ROW = 1000
+DF_SIM = pd.DataFrame({'int_year': RNG.randint(1990, 2015, N_ROW),
+                       'housing_roof_num': RNG.randint(0, 99, N_ROW).astype(float),
+                       'housing_wall_num': RNG.randint(5, 40, N_ROW),
+                       'housing_floor_num': RNG.randint(5, 40, N_ROW).astype(float),
+                       'iso3': RNG.choice(['BEN', 'NGA', 'PER'], N_ROW)})
+DF_SIM.loc[::7, 'housing_roof_num'] = np.nan
+
+def test_rank_columns():
+    """This function tests that the ranks and the rows kept match the column by column ranking."""
+    ranked = prep.rank_columns(DF_SIM, ['roof', 'wall', 'floor'])
+
+    expected = DF_SIM.copy()
+    for val in ['roof', 'wall', 'floor']:
+        num = expected['housing_' + val + '_num']
+        expected = expected[(num <= 35) & (num >= 10)]
+        expected[val + '_rank'] = np.floor(expected['housing_' + val + '_num'] / 10)
+
+    assert list(ranked.index) == list(expected.index)
+    for val in ['roof', 'wall', 'floor']:
+        assert ranked[val + '_rank'].dtype == np.int8
+        assert (ranked[val + '_rank'].values == expected[val + '_rank'].values).all()
+        assert ranked['housing_' + val + '_num'].between(10, 35).all()
+    assert len(DF_SIM.columns) == 5 #the input df is not modified
+
+def test_rank_columns_strings():
+    """This function tests that codes that are not numbers are dropped."""
+    df = pd.DataFrame({'housing_roof_num': ['31', '?', '.', '12', '9'], 'housing_wall_num': ['21'] * 5})
+
+    ranked = prep.ranking(df, ['roof', 'wall'])
+
+    assert list(ranked.index) == [0, 3]
+    assert list(ranked['roof_rank']) == [3, 1]
+
+def test_extract_ranking():
+    """This function tests that the rank is the first character of each code, as a string."""
+    df = pd.DataFrame({'housing_roof_num': ['31', '12', np.nan, '?', '31']})
+
+    ranked = prep.extract_ranking(df, ['housing_roof_num'])
+
+    assert list(ranked['housing_roof_rank'].iloc[[0, 1, 3, 4]]) == ['3', '1', '?', '3']
+    expected = df['housing_roof_num'].astype(str).str[0] #the missing code is converted the same way as before
+    pd.testing.assert_series_equal(ranked['housing_roof_rank'], expected, check_names=False)
+
+@pytest.fixture
+def survey_csv(tmp_path):
+    """This fixture writes a small survey extract, with extra columns, invalid codes and an unknown country."""
+    df = DF_SIM.copy()
+    df['housing_roof'] = 'metal'
+    df['hhweight'] = 1.5
+    df = df.astype({'housing_wall_num': object})
+    df.loc[3, 'housing_wall_num'] = '?'
+    df.loc[4, 'housing_floor_num'] = 0
+    df.loc[5, 'iso3'] = 'XXX'
+    path = str(tmp_path / 'survey.csv')
+    df.to_csv(path, index=False)
+
+    return path
+
+@pytest.mark.parametrize('engine', ['c', 'pyarrow'])
+def test_load_data_typed(survey_csv, engine):
+    """This function tests that only the valid rows of the training attributes are read, in compact dtypes, and that
+    iso3 is encoded with the meta.json codes."""
+    import json
+    iso_dict = json.load(open('../data/meta.json'))[3]
+
+    df = prep.load_data_typed(survey_csv, chunksize=100, engine=engine)
+
+    assert list(df.columns) == ['int_year', 'housing_roof_num', 'housing_wall_num', 'housing_floor_num', 'iso3']
+    assert df['int_year'].dtype == np.int16 and df['housing_wall_num'].dtype == np.int16
+    assert (df['iso3'].cat.codes == df['iso3'].astype(str).map(iso_dict)).all()
+
+    expected = DF_SIM.dropna()
+    expected = expected[(expected[['housing_roof_num', 'housing_wall_num', 'housing_floor_num']] != 0).all(axis=1)]
+    assert list(df.index) == [x for x in expected.index if x not in [3, 4, 5]]
+
+def test_balanced_sample():
+    """This function tests that the sample has exactly the same number of rows of each rank, all drawn from the data."""
+    ranked = prep.rank_columns(DF_SIM, ['roof', 'wall', 'floor']).reset_index(drop=True)
+    ranked['row'] = np.arange(len(ranked))
+
+    sample, rank_dist = prep.balanced_sample(ranked, 'wall', random_state=1)
+    counts = sample.groupby('wall_rank').size()
+
+    assert rank_dist == [counts.min()] * 3
+    assert list(counts) == rank_dist
+    assert sample['row'].is_unique
+    assert sample.drop(columns='row').equals(ranked.iloc[sample['row']].drop(columns='row').reset_index(drop=True))
+
+    #the same seed draws the same sample, and per_rank caps it
+    again, _ = prep.balanced_sample(ranked, 'wall', random_state=1)
+    assert again.equals(sample)
+    capped, rank_dist = prep.balanced_sample(ranked, 'wall', per_rank=5, random_state=0)
+    assert rank_dist == [5] * 3 and len(capped) == 15
+
+def test_reservoir_balanced_sample():
+    """This function tests that the streaming sample is balanced, and that every row has the same chance to be kept."""
+    ranked = prep.rank_columns(DF_SIM, ['roof', 'wall', 'floor']).reset_index(drop=True)
+    ranked['row'] = np.arange(len(ranked))
+    chunks = lambda: (ranked.iloc[i:i + 37] for i in range(0, len(ranked), 37))
+
+    sample, rank_dist = prep.reservoir_balanced_sample(chunks(), 'wall', per_rank=10, random_state=2)
+    assert rank_dist == [10] * 3
+    assert list(sample.groupby('wall_rank').size()) == rank_dist
+    assert sample['row'].is_unique
+    assert (ranked.iloc[sample['row']]['wall_rank'].values == sample['wall_rank'].values).all()
+
+    #the rows of the first and of the last chunks are kept about as often
+    rng = np.random.RandomState(3)
+    kept = np.zeros(len(ranked))
+    for i in range(200):
+        sample, _ = prep.reservoir_balanced_sample(chunks(), 'wall', per_rank=10, random_state=rng)
+        kept[sample['row'].values] += 1
+    rank1 = np.flatnonzero(ranked['wall_rank'].values == 1)
+    half = len(rank1) // 2
+    assert abs(kept[rank1[:half]].mean() - kept[rank1[half:]].mean()) < .25 * kept[rank1].mean()
+
+def test_build_feature_matrix():
+    """This function tests that the splits are views of a single float32 matrix, that iso3 is encoded with meta.json,
+    and that the dataframe is left untouched."""
+    ranked = prep.rank_columns(DF_SIM, ['roof', 'wall', 'floor']).reset_index(drop=True)
+    features = prep.extract_features(ranked, 'roof')
+    before = ranked.copy()
+
+    x_train, x_test, y_train, y_test = prep.build_feature_matrix(ranked, features, 'roof', random_state=0)
+
+    assert ranked.equals(before)
+    assert x_train.dtype == np.float32 and y_train.dtype == np.int8
+    assert x_train.base is x_test.base and x_train.base.flags['C_CONTIGUOUS']
+    assert len(x_train) + len(x_test) == len(ranked) and len(y_train) == len(x_train)
+
+    #the rows are drawn like train_test_split draws them
+    train = np.random.RandomState(0).uniform(0, 1, len(ranked)) <= .75
+    expected = ranked[features].copy()
+    expected['iso3'] = expected['iso3'].map({'BEN': 6, 'NGA': 63, 'PER': 67})
+    assert (x_train == expected[train].values.astype(np.float32)).all()
+    assert (x_test == expected[~train].values.astype(np.float32)).all()
+    assert (y_test == ranked['roof_rank'].values[~train]).all()
+
+def test_build_feature_matrix_unknown_iso3():
+    """This function tests that a country missing from meta.json raises an exception."""
+    ranked = prep.rank_columns(DF_SIM, ['roof', 'wall', 'floor']).reset_index(drop=True)
+    ranked.loc[0, 'iso3'] = 'XXX'
+
+    #the unknown code should be found without going through a deprecated pandas path
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        with pytest.raises(Exception, match='XXX') as error:
+            prep.build_feature_matrix(ranked, prep.extract_features(ranked, 'roof'), 'roof', random_state=0)
+    assert type(error.value).__name__ == 'UnknownCountryException'
@@ -0,0 +1,157 @@
+#write tests
+"""This is a module used to test the functions of "prep_data.py" that are built to scale to large survey extracts,
+including clean_series, read_then_clean_chunks, stream_then_clean and read_then_clean_cached.
+
+clean_series cleans a whole column by only cleaning its unique values once. It is tested by verifying that its output
+is identical to applying clean_text to every row.
+
+read_then_clean_chunks is a streaming version of read_then_clean, and stream_then_clean uses it to write a clean copy
+of a csv one chunk at a time. These functions are tested by writing a small simulated survey csv and verifying that
+they return exactly the same data as read_then_clean.
+
+read_then_clean_cached stores the clean df as parquet and reads it back on later calls. It is tested by verifying that
+the cached df holds the same values as read_then_clean, and that the cache is rebuilt when the source file changes.
+"""
+# import packages
+import pytest
+import pandas as pd
+import numpy as np
+
+#import custom modules fpr testing
+import sys
+sys.path.append('.')
+import prep.prep_data as prep
+
+#set globals for tests
+CLEAN_COLS = ['housing_roof', 'housing_wall', 'housing_floor']
+SVY_FILTER = ['MACRO_DHS']
+
+DIGITS = str([str(x) for x in range(100 + 1)])
+PUNCT = '!"\'#$%&()*+,-./:;<=>?@[\\]^_`{|}~\t\n'
+SPACE = '     '
+
+@pytest.fixture
+def csv_path(tmp_path):
+    """This function writes a small simulated survey csv with messy string values and returns its path.
+    """
+    n = 103
+    df_sim = pd.DataFrame({'survey_series': np.where(np.arange(n) % 3 == 0, 'MACRO_MIS', 'MACRO_DHS'),
+                           'housing_roof': ['Metal <ff> ' + str(x) for x in range(n)],
+                           'housing_wall': ['[.]Cement  bricks!'] * n,
+                           'housing_floor': ['13. Earth, sand'] * (n - 1) + [np.nan],
+                           'housing_roof_num': np.arange(n) % 40})
+    path = tmp_path / 'housing_sim.csv'
+    df_sim.to_csv(path, index=False)
+
+    return str(path)
+
+def test_clean_series():
+    """This function tests that cleaning the unique values of a column gives the same output as clean_text.
+    """
+    series = pd.Series([DIGITS, PUNCT, SPACE, 'Metal <ff>', '<f<ff>1>', '12.[.]Tiles', None, np.nan, 31.0, DIGITS],
+                       index=range(10, 20), name='housing_roof')
+
+    pd.testing.assert_series_equal(prep.clean_series(series), series.apply(prep.clean_text))
+
+def test_read_then_clean_chunks(csv_path):
+    """This function tests that streaming the csv in chunks returns the same clean df as reading it all at once.
+    """
+    df = prep.read_then_clean(csv_path, CLEAN_COLS, SVY_FILTER)
+    chunks = list(prep.read_then_clean_chunks(csv_path, CLEAN_COLS, SVY_FILTER, chunksize=10))
+
+    #each chunk should be at most as long as the chunk size
+    assert max([len(x) for x in chunks]) <= 10, "chunks are longer than the chunk size"
+
+    pd.testing.assert_frame_equal(df, pd.concat(chunks))
+
+def test_stream_then_clean(csv_path, tmp_path):
+    """This function tests that the csv written one chunk at a time contains the same data as read_then_clean.
+    """
+    out_path = str(tmp_path / 'housing_clean.csv')
+    n_row = prep.stream_then_clean(csv_path, out_path, CLEAN_COLS, SVY_FILTER, chunksize=10)
+
+    df = prep.read_then_clean(csv_path, CLEAN_COLS, SVY_FILTER)
+    assert n_row == len(df), "stream_then_clean did not write every row"
+
+    #note that the output is read back without its index, which read_then_clean keeps from the raw csv
+    pd.testing.assert_frame_equal(df.reset_index(drop=True), pd.read_csv(out_path))
+
+def test_read_then_clean_cached(csv_path, tmp_path, monkeypatch):
+    """This function tests that the cached df holds the same values as read_then_clean, that a second call reads the
+    cache instead of the csv, and that modifying the csv invalidates the cache.
+    """
+    import os
+
+    cache_dir = str(tmp_path / 'cache')
+    df = prep.read_then_clean(csv_path, CLEAN_COLS, SVY_FILTER)
+    df_cached = prep.read_then_clean_cached(csv_path, CLEAN_COLS, SVY_FILTER, cache_dir=cache_dir)
+
+    #the string columns are returned as categoricals, but should hold the same values
+    for x in df.columns:
+        assert df[x].astype(object).equals(df_cached[x].astype(object)), "cached column does not match"
+    assert (df.index == df_cached.index).all(), "cached df does not have the same index"
+
+    #a second call should hit the cache without reading the csv or rewriting the parquet file
+    cache_path = os.path.join(cache_dir, os.listdir(cache_dir)[0])
+    mtime = os.stat(cache_path).st_mtime_ns
+    monkeypatch.setattr(pd, 'read_csv', lambda *args, **kwargs: pytest.fail("the csv was read again"))
+    prep.read_then_clean_cached(csv_path, CLEAN_COLS, SVY_FILTER, cache_dir=cache_dir)
+    monkeypatch.undo()
+    assert os.listdir(cache_dir) == [os.path.basename(cache_path)], "the cache was not reused"
+    assert os.stat(cache_path).st_mtime_ns == mtime, "the cache was rewritten"
+
+    #a modified csv should build a new one
+
+    pd.read_csv(csv_path).head(50).to_csv(csv_path, index=False)
+    df_cached = prep.read_then_clean_cached(csv_path, CLEAN_COLS, SVY_FILTER, cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == 2, "the cache was not invalidated"
+    assert len(df_cached) == len(prep.read_then_clean(csv_path, CLEAN_COLS, SVY_FILTER))
+
+def test_read_then_clean_cached_columns(csv_path, tmp_path, monkeypatch):
+    """This function tests that selecting columns only parses the selected columns, and the ones needed to clean and
+    filter the rows, when the cache is built.
+    """
+    read_csv = pd.read_csv
+    usecols = []
+    def spy(*args, **kwargs):
+        usecols.append(kwargs.get('usecols'))
+        return read_csv(*args, **kwargs)
+    monkeypatch.setattr(pd, 'read_csv', spy)
+
+    columns = ['housing_roof_num', 'housing_roof']
+    df_cached = prep.read_then_clean_cached(csv_path, ['housing_roof'], SVY_FILTER, columns=columns,
+                                            cache_dir=str(tmp_path / 'cache'))
+    assert set(usecols[0]) == set(['housing_roof_num', 'housing_roof', 'survey_series'])
+
+    monkeypatch.undo()
+    df = prep.read_then_clean(csv_path, ['housing_roof'], SVY_FILTER)[columns]
+    assert list(df_cached.columns) == columns
+    for x in columns:
+        assert df[x].astype(object).equals(df_cached[x].astype(object)), "cached column does not match"
+
+def test_read_then_clean_cached_concurrent(csv_path, tmp_path, monkeypatch):
+    """This function tests that several writers building the same cache at the same time each write to their own
+    temporary file, so that every call returns the clean df and no temporary file is left behind.
+    """
+    import os
+    import pyarrow.parquet as pq
+    from multiprocessing.pool import ThreadPool
+
+    cache_dir = str(tmp_path / 'cache')
+    tmp_paths = []
+    write_table = pq.write_table
+    def spy(table, where, **kwargs):
+        tmp_paths.append(where)
+        return write_table(table, where, **kwargs)
+
+    monkeypatch.setattr(pq, 'write_table', spy)
+    with ThreadPool(4) as pool:
+        results = pool.map(lambda x: prep.read_then_clean_cached(csv_path, CLEAN_COLS, SVY_FILTER, cache_dir=cache_dir),
+                           range(4))
+    monkeypatch.undo()
+
+    df = prep.read_then_clean(csv_path, CLEAN_COLS, SVY_FILTER)
+    for df_cached in results:
+        assert df['housing_roof'].astype(object).equals(df_cached['housing_roof'].astype(object))
+    assert len(set(tmp_paths)) == len(tmp_paths), "two writers shared a temporary file"
+    assert [x for x in os.listdir(cache_dir) if x.endswith('.parquet')] == os.listdir(cache_dir)
@@ -0,0 +1,62 @@
+#write tests
+"""This is a module used to test the TokenTable tokenization layer shared by the semantic and fuzzy modules.
+
+The tests verify that the sparse table holds the same word counts as the dense indicator matrix it replaces, and that
+its inverted lists and lengths match the ones computed one string at a time.
+"""
+# import packages
+import pytest
+import pandas as pd
+import numpy as np
+
+#import custom modules fpr testing
+import sys
+sys.path.append('.')
+import prep.prep_tokens as tok
+
+VALUES = pd.Series(['wood planks', 'wood', np.nan, 'mud and mud', 'wood', 'cement bricks', 'bricks'])
+
+def test_row_counts():
+    """This function tests that the number of words of each row matches the dense indicator matrix."""
+    table = tok.TokenTable(VALUES)
+    dense = VALUES.str.get_dummies(sep=' ').sum(axis=1).values
+
+    assert (table.row_counts() == dense).all()
+    assert len(table.uniques) == 5 #each distinct string is only split once
+
+def test_tokens_and_postings():
+    """This function tests the tokens of each string, and the inverted lists of each token."""
+    table = tok.TokenTable(VALUES)
+
+    assert table.tokens(2) == ['mud', 'and']
+    assert list(table.set_lengths()) == [len('wood planks'), len('wood'), len('mud and'), len('cement bricks'),
+                                         len('bricks')]
+
+    postings = table.postings()
+    assert set(postings) == set(['wood', 'planks', 'mud', 'and', 'cement', 'bricks'])
+    assert list(postings['wood']) == [0, 1]
+    assert list(postings['bricks']) == [3, 4]
+
+    assert (table.to_csr().sum(axis=1).A1 == table.n_tokens).all()
+
+def test_set_lengths_empty():
+    """This function tests that the strings without tokens have a length of 0, at the start, middle and end of the
+    table, and that the fuzzy index can be built on a corpus holding words that are empty once processed.
+    """
+    import model.fuzzy as fz
+    import model.fuzzy_index as fi
+
+    table = tok.TokenTable(['', 'zinc', '   ', 'mud  bricks', 'zinc zinc', ''])
+    assert list(table.set_lengths()) == [0, len('zinc'), 0, len('mud bricks'), len('zinc')]
+    assert list(tok.TokenTable(['zinc', '']).set_lengths()) == [4, 0]
+    assert list(tok.TokenTable(['']).set_lengths()) == [0]
+
+    #'ñ' and '!!' are both empty once processed
+    corpus_list = [np.array(['ñ', 'straw'], dtype=object), np.array(['stick', '!!'], dtype=object),
+                   np.array(['!!', 'brick', 'ñ'], dtype=object)]
+    unknown = np.array(['brik', 'stik', 'strw'], dtype=object)
+    rank_dict = {'natural': 1, 'rudimentary': 2, 'finished': 3}
+    expected = fz.fuzzy_predict(fz.fuzzy_scan(unknown, corpus_list), fz.RANK_NAMES, 'word', 75, rank_dict)
+    pd.testing.assert_frame_equal(fi.CorpusIndex(fz.compact_corpus(corpus_list)).predict(unknown, 75, rank_dict),
+                                  expected)
+    pd.testing.assert_frame_equal(fz.fuzzy_scan_predict(unknown, corpus_list, 75, rank_dict, index=True), expected)
@@ -0,0 +1,61 @@
+#write tests
+"""This is a module used to test the hyperparameter search of the random forest model, including build_folds and
+rfc_search.
+
+build_folds builds the feature matrices of each cross-validation fold once. Here, it is tested by verifying that the
+folds are reproducible and that a cached copy is reloaded rather than rebuilt. rfc_search is tested by verifying that
+successive halving drops configurations at each round, and that running the fits in parallel gives the same accuracy.
+"""
+# import packages
+import pytest
+import pandas as pd
+import numpy as np
+
+#import custom modules fpr testing
+import sys
+sys.path.append('.')
+import model.rfc_search as rs
+
+#simulate a df in which the roof rank mostly follows the wall and floor ranks
+RNG = np.random.RandomState(0)
+N_ROW = 600
+DF_SIM = pd.DataFrame({'int_year': RNG.randint(1990, 2015, N_ROW),
+                       'wall_rank': RNG.randint(1, 4, N_ROW),
+                       'floor_rank': RNG.randint(1, 4, N_ROW),
+                       'iso3': RNG.choice(['BEN', 'NGA', 'PER'], N_ROW)})
+DF_SIM['roof_rank'] = np.where(RNG.uniform(size=N_ROW) < .8, DF_SIM['wall_rank'], RNG.randint(1, 4, N_ROW))
+FEATURES = ['int_year', 'wall_rank', 'floor_rank', 'iso3']
+
+def test_build_folds(tmp_path):
+    """This function tests that the folds have the expected shapes and are reloaded from the cache."""
+    folds = rs.build_folds(DF_SIM, FEATURES, 'roof', n_folds=2, cache_dir=str(tmp_path))
+
+    assert len(folds) == 2
+    for fold in folds:
+        assert fold['x_train'].dtype == np.float32 and fold['x_train'].shape[1] == len(FEATURES)
+        assert len(fold['x_train']) + len(fold['x_test']) == N_ROW
+        assert len(fold['y_train']) == len(fold['x_train'])
+
+    assert len(list(tmp_path.iterdir())) == 1
+    cached = rs.build_folds(DF_SIM, FEATURES, 'roof', n_folds=2, cache_dir=str(tmp_path))
+    for fold, other in zip(folds, cached):
+        for key in fold:
+            assert (fold[key] == other[key]).all()
+
+def test_rfc_search():
+    """This function tests that the search halves the configurations at each round, and that the parallel search
+    gives the same results as the serial one."""
+    folds = rs.build_folds(DF_SIM, FEATURES, 'roof', n_folds=2)
+    grid = {'max_features': [1, 2, 3], 'max_depth': [2, None]}
+
+    results, summary, best = rs.rfc_search(folds, grid, min_estimators=2, max_estimators=8, eta=2, n_jobs=1)
+
+    assert list(results.groupby('round')['config'].nunique()) == [6, 3, 2]
+    assert list(results.groupby('round')['n_estimators'].first()) == [2, 4, 8]
+    assert best['n_estimators'] == 8
+    assert summary['accuracy'].iloc[0] == summary[summary['round'] == 2]['accuracy'].max()
+    assert summary['accuracy'].iloc[0] > .6
+
+    parallel = rs.rfc_search(folds, grid, min_estimators=2, max_estimators=8, eta=2, n_jobs=2)
+    pd.testing.assert_series_equal(parallel[0]['accuracy'], results['accuracy'])
+    assert parallel[2] == best
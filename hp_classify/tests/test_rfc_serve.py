@@ -0,0 +1,99 @@
+#write tests
+"""This is a module used to test the local prediction server of the random forest models.
+
+The server micro-batches the requests that arrive together into a single predict call. Here, it is tested by sending
+concurrent requests to a server running on a free local port, and verifying that each of them gets the predictions
+that the model returns for its own records, that invalid records are flagged, and that the metrics count every request.
+"""
+# import packages
+import pytest
+import json
+import threading
+import urllib.request
+import pandas as pd
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+
+#import custom modules fpr testing
+import sys
+sys.path.append('.')
+import model.rfc_serve as srv
+
+ISO_DICT = {'BEN': 0, 'NGA': 1, 'PER': 2}
+
+def build_store():
+    """This function trains a small roof model on simulated features, in the order prep.extract_features returns."""
+    rng = np.random.RandomState(0)
+    nums = rng.randint(10, 36, (300, 2))
+    x = np.column_stack([rng.randint(1990, 2015, 300), nums, rng.randint(0, 3, 300), nums // 10])
+    y = nums[:, 0] // 10
+
+    model = RandomForestClassifier(n_estimators=5, random_state=0).fit(x, y)
+
+    return srv.ModelStore({'roof': model}, ISO_DICT), model
+
+def post(port, path, body):
+    """This function sends a json request to the server and returns its status and decoded reply."""
+    request = urllib.request.Request('http://127.0.0.1:' + str(port) + path, data=json.dumps(body).encode(),
+                                     headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request) as reply:
+            return reply.status, json.loads(reply.read())
+    except urllib.error.HTTPError as error:
+        return error.code, json.loads(error.read())
+
+def test_features():
+    """This function tests that the records are encoded and ranked like the training data, and that invalid records
+    are flagged."""
+    store, model = build_store()
+    records = [{'int_year': 2010, 'housing_wall_num': 31, 'housing_floor_num': 12, 'iso3': 'NGA'},
+               {'int_year': 2010, 'housing_wall_num': 96, 'housing_floor_num': 12, 'iso3': 'NGA'},
+               {'int_year': 2010, 'housing_wall_num': 31, 'housing_floor_num': 12, 'iso3': 'XXX'},
+               {'int_year': 2010, 'housing_floor_num': 12, 'iso3': 'NGA'}]
+
+    x, valid = store.features('roof', records)
+
+    assert list(x[0]) == [2010, 31, 12, 1, 3, 1]
+    assert list(valid) == [True, False, False, False]
+    assert store.predict('roof', records)[1:] == [None, None, None]
+
+def test_server():
+    """This function tests that concurrent requests are batched and each get their own predictions."""
+    store, model = build_store()
+    batcher = srv.MicroBatcher(store, max_wait=.05)
+    server = srv.make_server(batcher, port=0)
+    port = server.server_address[1]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    try:
+        rng = np.random.RandomState(1)
+        requests = [[{'int_year': int(rng.randint(1990, 2015)), 'housing_wall_num': int(rng.randint(10, 36)),
+                      'housing_floor_num': int(rng.randint(10, 36)), 'iso3': 'BEN'} for y in range(x + 1)]
+                    for x in range(8)]
+        replies = [None] * len(requests)
+
+        def send(x):
+            replies[x] = post(port, '/predict/roof', {'records': requests[x]})
+
+        threads = [threading.Thread(target=send, args=(x,)) for x in range(len(requests))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for records, (status, reply) in zip(requests, replies):
+            x, valid = store.features('roof', records)
+            assert status == 200
+            assert reply['pred'] == [int(y) for y in model.predict(x)]
+
+        assert post(port, '/predict/wall', {'records': requests[0]})[0] == 400 #no wall model loaded
+
+        with urllib.request.urlopen('http://127.0.0.1:' + str(port) + '/metrics') as reply:
+            metrics = json.loads(reply.read())
+        assert metrics['requests'] == len(requests)
+        assert metrics['records'] == sum([len(x) for x in requests])
+        assert metrics['batches'] < len(requests) #some requests were predicted together
+        assert metrics['latency_p50_ms'] > 0
+    finally:
+        server.shutdown()
+        server.server_close()
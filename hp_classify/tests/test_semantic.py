@@ -0,0 +1,182 @@
+#write tests
+"""This is a module used to test the semantic similarity scan and its SemanticScorer engine.
+
+The WordNet corpus is not needed to run these tests: the scorer is given a stub synset lookup, whose synsets have a
+made-up path similarity. The scan is tested by verifying that it returns the same distribution of scores as the
+original nested loop, and that the synsets of each string are only looked up once. The MaterialMatcher is tested on
+single and batch queries, run serially and in parallel.
+"""
+# import packages
+import pytest
+import pandas as pd
+import numpy as np
+
+#import custom modules fpr testing
+import sys
+sys.path.append('.')
+import semantic.semantic as sem
+import semantic.most_similar_material as msm
+
+class StubSynset(object):
+    """This is a stand-in for a WordNet synset, whose path similarity to another synset is made up from their names.
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def __eq__(self, other):
+        return self.name == other.name #like WordNet synsets, two synsets with the same name are equal
+
+    def __hash__(self):
+        return hash(self.name)
+
+    def path_similarity(self, other):
+        if self.name[0] != other.name[0]:
+            return None #no path between the synsets
+        return 1. / (1 + abs(len(self.name) - len(other.name)) + (self.name != other.name))
+
+LOOKUPS = []
+
+def stub_synsets(text):
+    """This function returns between zero and three stub synsets per string, and records every lookup."""
+    LOOKUPS.append(text)
+    return [StubSynset(text[:x + 1] + str(x)) for x in range(len(text) % 4)]
+
+def reference_scan(unknown_list, corpus_list):
+    """This function is the original nested loop of semantic_similarity_scan, without any caching."""
+    distrib = []
+    for unknown_str in unknown_list:
+        unknw_syn = stub_synsets(unknown_str)
+        out = []
+        for corpus in corpus_list:
+            scores = []
+            for known_str in corpus:
+                list_syn = stub_synsets(known_str)
+                score = 0
+                for s1 in unknw_syn:
+                    score = score + sum([s1.path_similarity(s2) for s2 in list_syn if s1.path_similarity(s2) is not None])
+                scores.append(score)
+            out.append(scores)
+        distrib.append(pd.DataFrame({'word': unknown_str, 'natural': pd.Series(out[0]),
+                                     'rudimentary': pd.Series(out[1]), 'finished': pd.Series(out[2])}))
+    return(pd.concat(distrib))
+
+UNKNOWN = ['stone', 'sand', 'stick', 'tin']
+CORPUS = [['straw', 'sand', 'sod', 'straw'], ['stick', 'thatch', 'tin'], ['slate', 'stone', 'tile', 'tin', 'sheet']]
+
+def test_scan_matches_reference():
+    """This function tests that the scan returns exactly the same scores as the original loop."""
+    expected = reference_scan(UNKNOWN, CORPUS)
+    result = sem.semantic_similarity_scan(UNKNOWN, CORPUS, scorer=sem.SemanticScorer(synsets=stub_synsets))
+
+    pd.testing.assert_frame_equal(result, expected)
+
+def test_synsets_looked_up_once():
+    """This function tests that each distinct string is only looked up once, even across several scans."""
+    scorer = sem.SemanticScorer(synsets=stub_synsets)
+
+    del LOOKUPS[:]
+    sem.semantic_similarity_scan(UNKNOWN, CORPUS, scorer=scorer)
+    sem.semantic_similarity_scan(UNKNOWN[::-1], CORPUS, scorer=scorer)
+
+    assert sorted(LOOKUPS) == sorted(set(UNKNOWN + sum(CORPUS, [])))
+
+class StubWords(object):
+    """This is a stand-in for the nltk words corpus."""
+    @staticmethod
+    def words():
+        return ['straw', 'stone', 'wood', 'tin', 'de', 'a', 'cement']
+
+@pytest.fixture
+def stub_lexicons(monkeypatch):
+    """This fixture replaces the nltk words corpus with a stub, and empties the lexicon cache before and after use."""
+    import nltk.corpus
+    monkeypatch.setattr(nltk.corpus, 'words', StubWords)
+    sem.load_lexicon.cache_clear()
+    yield
+    sem.load_lexicon.cache_clear()
+
+def test_check_if_english(stub_lexicons):
+    """This function tests that only the english materials are kept, in order of appearance, and missing values are
+    dropped."""
+    df = pd.DataFrame({'roof': ['wood', 'bois', np.nan, 'stone', 'wood', 'tin roof']})
+
+    assert sem.check_if_english(df, 'roof') == ['wood', 'stone']
+    assert list(sem.is_in_lexicon(df['roof'])) == [True, False, False, True, True, False]
+
+def test_french_lexicon(stub_lexicons):
+    """This function tests that the french lexicon holds the words of the meta.json labels that are not english."""
+    french = sem.load_lexicon('french')
+
+    assert 'bois' in french and 'ciment' in french
+    assert 'wood' not in french and 'de' not in french
+    assert sem.load_lexicon('french') is french #loaded only once
+
+    df = pd.DataFrame({'roof': ['wood', 'bois', 'ciment', 'xyzzy']})
+    assert sem.check_if_english(df, 'roof', lexicons=('english', 'french')) == ['wood', 'bois', 'ciment']
+
+def test_filter_one_word_materials():
+    """This function tests that only the materials described with one word are kept, and that an error is raised if
+    there are none."""
+    df = pd.DataFrame({'roof': ['wood', 'wood planks', np.nan, 'tin', 'tin tin']})
+
+    subset = sem.filter_one_word_materials(df, 'roof')
+    assert list(subset['roof']) == ['wood', 'tin', 'tin tin']
+
+    with pytest.raises(Exception) as error:
+        sem.filter_one_word_materials(df.iloc[[1]].copy(), 'roof')
+    assert error.type.__name__ == 'NoOneWordException'
+
+def test_material_matcher():
+    """This function tests that the matcher returns the group of words with the closest synsets, and looks up the
+    vocabulary only once."""
+    del LOOKUPS[:]
+    matcher = msm.MaterialMatcher(['stone', 'straw', 'sand', 'tin', 'thatch'], synsets=stub_synsets)
+    n_lookups = len(LOOKUPS)
+
+    assert matcher.match('sa') == ['stone', 'straw'] #same synsets, so both are returned
+    assert matcher.match('tin') == ['tin'] #tied with thatch, which comes later in the vocabulary
+    assert len(LOOKUPS) == n_lookups + 2 #only the unknown words were looked up
+
+    with pytest.raises(msm.NoneException):
+        matcher.match('xyz') #no synset in common with the vocabulary
+
+def test_material_matcher_batch():
+    """This function tests that batch queries return one match per word, in parallel or not."""
+    matcher = msm.MaterialMatcher(['stone', 'straw', 'sand', 'tin', 'thatch'], synsets=stub_synsets)
+    words = pd.Series(['stone', 'xyz', np.nan, 'tin', 'sa'] * 20, index=np.arange(100) * 2)
+
+    serial = matcher.match_many(words)
+    assert list(serial.index) == list(words.index)
+    assert list(serial[:5]) == [['stone', 'straw'], None, None, ['tin'], ['stone', 'straw']]
+
+    parallel = matcher.match_many(words, n_jobs=2, chunksize=1)
+    assert parallel.equals(serial)
+
+def test_match_or_none_other_errors():
+    """This function tests that only the NoneException of this module is turned into None, and that any other
+    exception, even one with the same name, is raised."""
+    class NoneException(Exception):
+        pass
+
+    class FailingMatcher(object):
+        def __init__(self, error):
+            self.error = error
+        def match(self, input_word):
+            raise self.error
+
+    assert msm._match_or_none(FailingMatcher(msm.NoneException()), 'xyz') is None
+    with pytest.raises(NoneException):
+        msm._match_or_none(FailingMatcher(NoneException()), 'xyz')
+
+def test_scorer_cache_bounded():
+    """This function tests that the caches of the scorer never hold more than max_size entries, and that a bounded
+    scorer still returns the same scores."""
+    expected = reference_scan(UNKNOWN, CORPUS)
+    scorer = sem.SemanticScorer(synsets=stub_synsets, max_size=3)
+
+    for x in range(2):
+        pd.testing.assert_frame_equal(sem.semantic_similarity_scan(UNKNOWN, CORPUS, scorer=scorer), expected)
+        assert max(len(scorer.synset_cache), len(scorer.pair_cache), len(scorer.score_cache)) <= 3
+
+    #the shared scorer should be bounded as well
+    assert sem.SemanticScorer(synsets=stub_synsets).max_size == sem.SCORER_CACHE_SIZE
@@ -0,0 +1,127 @@
+#write tests
+"""This is a module used to test the synthetic survey data generator, including SurveySimulator and misspell.
+
+SurveySimulator draws survey-shaped datasets from the vocabularies of meta.json. Here, it is tested by verifying that
+the rows are reproducible, that the codes of the known materials match meta.json, that the garbage and unknown rows
+are removed by the cleaning pipeline, that the corpora and unknown words built from a simulated frame are the expected
+ones, and that the written files can be read back by the loaders.
+"""
+# import packages
+import pytest
+import pandas as pd
+import numpy as np
+
+#import custom modules fpr testing
+import sys
+sys.path.append('.')
+import prep.prep_data as prep
+import prep.simulate as sim
+
+SIMULATOR = sim.SurveySimulator(seed=0)
+STR_VARS = ['housing_roof', 'housing_wall', 'housing_floor']
+NUM_VARS = [s + '_num' for s in STR_VARS]
+RANK_VARS = [s + '_rank' for s in STR_VARS]
+STR_GARBAGE = ['nan', 'other', 'not a dejure resident', 'not dejure resident']
+RANK_GARBAGE = ['4', '5', '6', '7', '8', '9', 'n']
+
+def test_misspell():
+    """This function tests that a misspelling is a single edit away from the word."""
+    rng = np.random.RandomState(0)
+    typos = [sim.misspell('cement', rng) for x in range(100)]
+    assert sum([x != 'cement' for x in typos]) > 90
+    for typo in typos:
+        assert abs(len(typo) - len('cement')) <= 1
+        assert len(set(typo) ^ set('cement')) <= 2
+
+def test_chunk():
+    """This function tests that the chunks are reproducible and consistent with meta.json."""
+    df = SIMULATOR.chunk(20000, number=3)
+
+    assert df.equals(SIMULATOR.chunk(20000, number=3))
+    assert not df.equals(SIMULATOR.chunk(20000, number=4))
+    assert list(df.columns) == ['survey_series', 'iso3', 'int_year'] + [x for s in ['roof', 'floor', 'wall']
+                                                                          for x in ['housing_' + s, 'housing_' + s + '_num']]
+
+    vocabularies, iso3 = sim.load_meta()
+    assert df['iso3'].isin(iso3).all()
+    for label in ['roof', 'floor', 'wall']:
+        text, code = df['housing_' + label], df['housing_' + label + '_num']
+        known = text.isin(list(vocabularies[label])) & (code != sim.UNKNOWN_CODE)
+        assert (code[known] == text[known].map(vocabularies[label])).all()
+        #roughly the requested fractions of unknown and garbage answers, and some typos
+        assert .08 < (code == sim.UNKNOWN_CODE).mean() < .14
+        assert text.isin([x[0] for x in sim.GARBAGE]).mean() > .01
+        assert (~text.isin(list(vocabularies[label])) & text.notnull()).mean() > .05
+
+def test_cleaning_pipeline():
+    """This function tests that the garbage and unknown answers are flagged by the cleaning pipeline, and then removed
+    by remove_garbage_codes.
+    """
+    df = SIMULATOR.chunk(5000)
+    for var in STR_VARS:
+        df[var] = prep.clean_series(df[var])
+    assert df[STR_VARS].isin(['other']).any().all()
+    df = prep.remove_garbage_codes(df, STR_VARS, STR_GARBAGE)
+    assert not df[STR_VARS].isin(['nan', 'other']).any().any(), "garbage strings were not removed"
+
+    df = prep.extract_ranking(df, NUM_VARS)
+    for var, num in zip(RANK_VARS, NUM_VARS):
+        #the unknown and garbage codes all have the garbage rank 9
+        assert set(df[var].dropna().unique()) <= set(['1', '2', '3', '9'])
+        assert (df[var][df[num] >= 96] == '9').all()
+        assert df[var].isin(['9']).mean() > .1
+
+    garbage = df[RANK_VARS].isin(['9'])
+    df = prep.remove_garbage_codes(df, RANK_VARS, RANK_GARBAGE)
+
+    #every garbage rank should now be missing, and the other ranks should be left as they were
+    for var in RANK_VARS:
+        assert df[var][garbage[var]].isnull().all(), "garbage ranks were not removed"
+        assert not df[var].isin(['9']).any()
+        assert set(df[var].dropna().unique()) <= set(['1', '2', '3'])
+
+def test_build_corpus():
+    """This function tests that the corpora built from a cleaned simulated frame hold the ranked materials, and that
+    the unknown words are the materials recorded with the unknown code, without the garbage answers that share it.
+    """
+    import model.fuzzy as fz
+
+    df = SIMULATOR.chunk(5000)
+    raw = df.copy()
+    for var in STR_VARS:
+        df[var] = prep.clean_series(df[var])
+    df = prep.remove_garbage_codes(df, STR_VARS, STR_GARBAGE)
+    df = prep.extract_ranking(df, NUM_VARS)
+    df = prep.remove_garbage_codes(df, RANK_VARS, RANK_GARBAGE)
+
+    var = 'housing_roof'
+    corpora, unknown = fz.build_corpus(df, var, var + '_rank', ['1', '2', '3'])
+    vocabulary = sim.load_meta()[0]['roof']
+
+    #the corpora only hold the words recorded with a ranked code, in the corpus of their rank
+    assert sum([len(x) for x in corpora]) == df[var + '_rank'].notnull().sum()
+    for rank, corpus in zip(['1', '2', '3'], corpora):
+        expected = df.loc[df[var + '_rank'] == rank, var]
+        assert pd.Series(corpus, index=expected.index, name=var).equals(expected)
+
+    #the unknown words are the ones recorded with the unknown code, without the garbage answers that share it
+    described = prep.clean_series(raw[var][raw[var + '_num'] == sim.UNKNOWN_CODE].dropna())
+    assert set(unknown) == set(described) - set(STR_GARBAGE)
+    assert 'other' not in set(unknown)
+    assert len(set(unknown) & set(vocabulary)) > 10, "the unknown rows should describe materials of the vocabulary"
+
+@pytest.mark.parametrize('file_name', ['sim.csv', 'sim.parquet'])
+def test_write(tmp_path, file_name):
+    """This function tests that the files are written chunk by chunk and can be read back."""
+    path = str(tmp_path / file_name)
+    SIMULATOR.write(path, 2500, chunksize=1000)
+
+    df = pd.read_parquet(path) if file_name.endswith('.parquet') else pd.read_csv(path, keep_default_na=False)
+    expected = pd.concat([SIMULATOR.chunk(1000, 0), SIMULATOR.chunk(1000, 1), SIMULATOR.chunk(500, 2)],
+                         ignore_index=True)
+    assert len(df) == 2500
+    assert (df['housing_roof'].fillna('') == expected['housing_roof'].fillna('')).all()
+
+    if file_name.endswith('.csv'):
+        typed = prep.load_data_typed(path)
+        assert len(typed) > 0 and (typed[['housing_roof_num', 'housing_wall_num']] != 0).all().all()